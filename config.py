@@ -19,7 +19,14 @@ config_dict = {
         'raw_display_height':       181,
         'processed_display_width':  650,
         'processed_display_height': 650,
-        'frame_buffer_size':        1
+        'preview_renderer':         'opencv',  # either 'opencv' (planvec.gui.preview_renderer) or 'matplotlib'
+        'source':                   'camera',  # 'camera', 'video' (file) or 'images' (directory), see frame_sources
+        'source_path':              '',  # video file or image directory to replay if source is not 'camera'
+        'replay_realtime':          True,  # replay with the original frame timing, otherwise as fast as possible
+        'replay_loop':              True,  # start over at the end of the replay
+        'record':                   False,  # record the session from the start, the shortcut toggles recording
+        'record_shortcut':          'Ctrl+R',  # records to Desktop/planvec/recordings
+        'frame_ring_slots':         3,  # shared memory slots frames are read into (0: new arrays), see frame_ring
     },
     'color_range': {
         # 'blue':                     #HSVColorRange([91,  100,  20],  [160, 255, 255]),
@@ -29,10 +36,23 @@ config_dict = {
     },
     'processing': {
         'rectify_shape':            (1920, int(1920 * 0.7)),
+        'red_dot_tracking':         True,  # search the red dots around their last positions, see RedDotTracker
+        'tracking_window_radius':   48,    # pixels
+        'tracking_move_tolerance':  1.0,   # pixels the dots may move before the transformation is recomputed
+        'red_dot_pyramid_level':    2,     # search the red dots on 1/2**level resolution first, 0 to disable
+        'red_dot_refine_radius':    8,     # pixels around the coarse dots searched on full resolution
+        'use_buffer_pool':          True,  # zero-copy mode, reuse preallocated buffers, see planvec.buffer_pool
+        'pipeline_workers':         0,     # >0: run the pipeline in that many processes, see planvec.pipeline_pool
+        'staged_pipeline':          False,  # a thread per stage (rectify, ..., render), see planvec.pipeline_stages
+        'stage_queue_size':         1,     # frames waiting in front of each stage in the staged pipeline
+        'use_calibration':          True,  # rectify with a stored calibration if there is one, see SheetCalibration
+        'calibration_check_interval': 100,  # frames between red dot checks of the calibration
+        'calibration_check_tolerance': 5.0,  # pixels the dots may deviate from the calibrated positions
         'gaussian_blur':            (3, 3),
         'img_threshold':            (100, 255),
         'area_threshold':           5000,
         'contours_size_threshold':  100,
+        'contour_engine':           'opencv',  # either 'opencv' or 'skimage', see planvec.img_proc.find_contours
         'polygon_tolerance':        1,
         'line_width':               1,
         'out_size_inches':          (7.87402, 5.51181),  # TODO: fix scaling
@@ -41,10 +61,29 @@ config_dict = {
         'plate_width_cm':           80,
         'plate_height_cm':          50,
         'draw_area_width_cm':       20,
-        'draw_area_height_cm':      14
+        'draw_area_height_cm':      14,
+        'writer':                   'vector',  # either 'vector' (planvec.vector_writer) or 'matplotlib'
+        'jam_engine':               'pypdf',  # either 'pypdf' (planvec.pdf_imposition) or 'pdfjam' (needs LaTeX)
+        'jam_jobs':                 2,  # plates created at the same time, see PdfJammer.run
+        'jam_layout':               'grid',  # 'grid' or 'packed' (mixed page sizes, see planvec.plate_packing)
+        'jam_spacing_cm':           0.0,  # space between packed drawings
+    },
+    'tracing': {
+        'enabled':                  True,  # per-frame latency tracing, see planvec.utils.tracing
+        'n_frames':                 300,   # number of recent frames kept for the trace dump
+        'dump_shortcut':            'Ctrl+T',  # dumps the trace as Chrome trace json, also on SIGUSR1
+    },
+    'metrics': {
+        'enabled':                  False,  # export metrics in Prometheus format, see planvec.utils.metrics
+        'mode':                     'http',  # either 'http' (serve on host:port/metrics) or 'file'
+        'host':                     '127.0.0.1',
+        'port':                     9464,
+        'file_path':                '',  # 'file' mode, defaults to Desktop/planvec/metrics/planvec.prom
+        'interval_s':               15,  # 'file' mode, seconds between writes
     },
     'data': {
         'overwrite_output':         False,
+        'save_workers':             2,  # writer threads of the background saves, see DataManager.save_async
         'output_location':          'desktop'  # can be either 'desktop' or 'repository'
     }
 }
@@ -0,0 +1,5 @@
+"""
+Reproducible benchmarks of the image pipeline on deterministic synthetic frames, see scripts/benchmark_pipeline.py.
+"""
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame, generate_frames
+from planvec.benchmark.runner import RESOLUTIONS, run_benchmark, save_results, load_results, compare_results
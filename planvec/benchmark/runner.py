@@ -0,0 +1,173 @@
+"""
+Times run_pipeline end-to-end, its stages (rectify, segment, vectorize, render) and all @timeit-decorated img_proc
+functions on synthetic frames of several resolutions. The results are plain dictionaries which are written as JSON,
+such that runs on different commits or machines can be compared with compare_results.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter_ns
+
+import cv2 as cv
+import numpy as np
+from dotmap import DotMap
+
+from planvec.benchmark.synthetic import generate_frames
+from planvec.buffer_pool import BufferPool
+from planvec.pipeline import run_pipeline
+from planvec.utils import timing
+from planvec.utils.timing import TimingStats
+from planvec.utils.tracing import FrameTrace
+
+from typing import Dict, List, Sequence, Tuple, Union
+
+RESOLUTIONS = {'640x480': (640, 480), '1280x720': (1280, 720), '1920x1080': (1920, 1080)}
+STAGES = ('rectify', 'segment', 'vectorize', 'render')
+PREVIEW_SIZE = (640, 448)  # size of the preview image the GUI renders into
+NS_PER_MS = 1e6
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """'1280x720' -> (1280, 720)"""
+    width, height = resolution.lower().split('x')
+    return int(width), int(height)
+
+
+def _summarize(stats: TimingStats, percentiles: Sequence[float] = timing.DEFAULT_PERCENTILES) -> dict:
+    """Summary of a TimingStats in milliseconds."""
+    summary = {'count': stats.count,
+               'mean_ms': stats.mean_ns / NS_PER_MS,
+               'min_ms': stats.min_ns / NS_PER_MS,
+               'max_ms': stats.max_ns / NS_PER_MS}
+    for percentile, value_ns in stats.percentiles_ns(percentiles).items():
+        summary[f'p{percentile}_ms'] = value_ns / NS_PER_MS
+    return summary
+
+
+def environment_info() -> dict:
+    """Commit and machine the benchmark ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'opencv': cv.__version__,
+            'timing_enabled': timing.is_timing_enabled()}
+
+
+def benchmark_resolution(frames: List[np.ndarray], config: DotMap, color_ranges: dict, repeat: int = 1,
+                         n_warmup: int = 2, use_buffer_pool: bool = False) -> dict:
+    """Runs the pipeline repeat times over all frames and returns the timing summaries of one resolution. The first
+    n_warmup passes are not recorded, they fill caches and allocate pooled buffers."""
+    # Imported here since it pulls in Qt, the synthetic frames alone do not need it
+    from planvec.gui.preview_renderer import PreviewRenderer
+    preview_renderer = PreviewRenderer(PREVIEW_SIZE, line_width=config.line_width)
+    buffer_pool = BufferPool() if use_buffer_pool else None
+
+    def run(frame, frame_trace=None):
+        return run_pipeline(frame, None, config, color_ranges, return_contours=True,
+                            preview_renderer=preview_renderer, buffer_pool=buffer_pool, frame_trace=frame_trace)
+
+    for warmup_idx in range(n_warmup):
+        run(frames[warmup_idx % len(frames)])
+
+    timing.reset_timing()
+    total_stats = TimingStats('run_pipeline')
+    stage_stats = {stage: TimingStats(stage) for stage in STAGES}
+    n_rectified, n_contours = 0, []
+    for _ in range(repeat):
+        for frame_idx, frame in enumerate(frames):
+            frame_trace = FrameTrace(frame_idx)
+            start_time = perf_counter_ns()
+            _, _, contours = run(frame, frame_trace)
+            total_stats.add(perf_counter_ns() - start_time)
+            for name, start_ns, end_ns, _ in frame_trace.spans:
+                stage_stats[name].add(end_ns - start_ns)
+            if any(span[0] == 'segment' for span in frame_trace.spans):
+                n_rectified += 1
+            n_contours.append(len(contours))
+
+    n_runs = repeat * len(frames)
+    return {'n_runs': n_runs,
+            'rectified_ratio': n_rectified / n_runs,
+            'mean_n_contours': float(np.mean(n_contours)),
+            'run_pipeline': _summarize(total_stats),
+            'stages': {stage: _summarize(stats) for stage, stats in stage_stats.items() if stats.count > 0},
+            'functions': {name: _summarize(stats) for name, stats in sorted(timing.TimeitRecord.record.items())
+                          if stats.count > 0},
+            'buffer_pool': buffer_pool.stats() if buffer_pool is not None else None}
+
+
+def run_benchmark(config: DotMap, color_ranges: dict, resolutions: Sequence[str] = tuple(RESOLUTIONS),
+                  n_frames: int = 10, repeat: int = 3, n_warmup: int = 2, seed: int = 0,
+                  use_buffer_pool: bool = False, verbose: bool = True, **spec_kwargs) -> dict:
+    """Benchmarks all resolutions ('WIDTHxHEIGHT') with n_frames synthetic frames each (seeds seed, seed + 1, ...).
+    spec_kwargs are passed on to planvec.benchmark.synthetic.SyntheticFrameSpec, e.g. noise_std."""
+    results = {'environment': environment_info(),
+               'settings': {'n_frames': n_frames, 'repeat': repeat, 'n_warmup': n_warmup, 'seed': seed,
+                            'use_buffer_pool': use_buffer_pool, 'rectify_shape': list(config.rectify_shape),
+                            'red_dot_pyramid_level': config.red_dot_pyramid_level,
+                            'contour_engine': config.get('contour_engine'), 'frame_spec': spec_kwargs},
+               'resolutions': {}}
+    for resolution in resolutions:
+        width, height = RESOLUTIONS.get(resolution) or parse_resolution(resolution)
+        frames = generate_frames(n_frames, width, height, seed=seed, **spec_kwargs)
+        resolution_results = benchmark_resolution(frames, config, color_ranges, repeat=repeat, n_warmup=n_warmup,
+                                                  use_buffer_pool=use_buffer_pool)
+        results['resolutions'][f'{width}x{height}'] = resolution_results
+        if verbose:
+            pipeline_summary = resolution_results['run_pipeline']
+            print(f'{width:>5}x{height:<5} --- mean {pipeline_summary["mean_ms"]:8.2f} ms'
+                  f' --- p95 {pipeline_summary["p95_ms"]:8.2f} ms'
+                  f' --- rectified {100 * resolution_results["rectified_ratio"]:5.1f} %')
+    return results
+
+
+def save_results(results: dict, path: Union[str, Path]) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return path
+
+
+def load_results(path: Union[str, Path]) -> dict:
+    with open(path, 'r') as results_file:
+        return json.load(results_file)
+
+
+def _timed_entries(resolution_results: dict) -> Dict[str, dict]:
+    """All timing summaries of a resolution, stages are prefixed since e.g. render is also a timed function."""
+    return {'run_pipeline': resolution_results['run_pipeline'],
+            **{f'stage {stage}': summary for stage, summary in resolution_results['stages'].items()},
+            **resolution_results['functions']}
+
+
+def compare_results(baseline: dict, candidate: dict, statistic: str = 'mean_ms') -> Dict[str, Dict[str, tuple]]:
+    """Per resolution and timed entry (run_pipeline, stages and functions): (baseline, candidate, candidate/baseline)
+    of the given statistic. Only entries present in both results are compared."""
+    comparison = {}
+    for resolution, baseline_resolution in baseline['resolutions'].items():
+        candidate_resolution = candidate['resolutions'].get(resolution)
+        if candidate_resolution is None:
+            continue
+        baseline_entries, candidate_entries = _timed_entries(baseline_resolution), _timed_entries(candidate_resolution)
+        comparison[resolution] = {}
+        for name, baseline_entry in baseline_entries.items():
+            if name not in candidate_entries:
+                continue
+            baseline_value, candidate_value = baseline_entry[statistic], candidate_entries[name][statistic]
+            ratio = candidate_value / baseline_value if baseline_value > 0 else float('nan')
+            comparison[resolution][name] = (baseline_value, candidate_value, ratio)
+    return comparison
@@ -0,0 +1,131 @@
+"""
+Deterministic synthetic camera frames for benchmarking: a sheet of paper with four red corner dots, drawn closed
+strokes (blue, kept by the pipeline) and guide strokes (green, filtered out by the pipeline), seen in perspective on
+a table under uneven lighting with sensor noise. The same seed always gives the same frame.
+"""
+import cv2 as cv
+import numpy as np
+
+from typing import List, Tuple
+
+# BGR colours of the synthetic scene
+PAPER = (225, 228, 230)
+TABLE = (70, 90, 110)
+RED_DOT = (35, 30, 215)
+BLUE_PEN = (135, 45, 15)
+GREEN_PEN = (50, 165, 45)
+
+SHEET_ASPECT = 0.7  # height / width of the sheet, same as the default rectify_shape
+
+
+class SyntheticFrameSpec:
+    """Parameters of a synthetic frame.
+
+    Arguments
+    ---------
+        width, height: frame size in pixels
+        n_blue_strokes: number of closed drawn shapes (ellipses and polygons), they become regions in the pipeline
+        n_green_strokes: number of open green guide lines, the pipeline filters them out
+        noise_std: standard deviation of the gaussian sensor noise in grey values
+        lighting_gradient: relative brightness drop across the frame, e.g. 0.3 means the darkest corner has 70%
+        perspective_jitter: how far the sheet corners are moved randomly, relative to the sheet size
+        seed: seed of the random generator, frames with equal spec are identical
+    """
+
+    def __init__(self, width: int = 1920, height: int = 1080, n_blue_strokes: int = 4, n_green_strokes: int = 3,
+                 noise_std: float = 4.0, lighting_gradient: float = 0.3, perspective_jitter: float = 0.05,
+                 seed: int = 0) -> None:
+        self.width = width
+        self.height = height
+        self.n_blue_strokes = n_blue_strokes
+        self.n_green_strokes = n_green_strokes
+        self.noise_std = noise_std
+        self.lighting_gradient = lighting_gradient
+        self.perspective_jitter = perspective_jitter
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _draw_sheet(rng: np.random.Generator, sheet_width: int, spec: SyntheticFrameSpec) -> np.ndarray:
+    """The flat sheet with dots in its corners and strokes, before perspective and lighting."""
+    sheet_height = int(sheet_width * SHEET_ASPECT)
+    sheet = np.full((sheet_height, sheet_width, 3), PAPER, dtype=np.uint8)
+    unit = sheet_width / 1000  # all sizes below are given for a sheet of 1000 pixels width
+    line_width = max(1, int(round(4 * unit)))
+
+    dot_radius = max(3, int(round(12 * unit)))
+    dot_inset = dot_radius + max(2, int(round(4 * unit)))
+    for x, y in [(dot_inset, dot_inset), (sheet_width - dot_inset, dot_inset),
+                 (sheet_width - dot_inset, sheet_height - dot_inset), (dot_inset, sheet_height - dot_inset)]:
+        cv.circle(sheet, (x, y), dot_radius, RED_DOT, -1, lineType=cv.LINE_AA)
+
+    margin = int(80 * unit)
+    for stroke_idx in range(spec.n_blue_strokes):
+        center = (int(rng.integers(margin + 60 * unit, sheet_width - margin - 60 * unit)),
+                  int(rng.integers(margin + 60 * unit, sheet_height - margin - 60 * unit)))
+        if stroke_idx % 2 == 0:
+            axes = (int(rng.integers(30, 120) * unit), int(rng.integers(30, 120) * unit))
+            cv.ellipse(sheet, center, axes, float(rng.uniform(0, 180)), 0, 360, BLUE_PEN, line_width, cv.LINE_AA)
+        else:
+            n_vertices = int(rng.integers(3, 8))
+            angles = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+            radii = rng.uniform(40, 120, n_vertices) * unit
+            vertices = np.stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)], axis=1)
+            cv.polylines(sheet, [vertices.astype(np.int32)], True, BLUE_PEN, line_width, cv.LINE_AA)
+
+    for _ in range(spec.n_green_strokes):
+        start = (int(rng.integers(margin, sheet_width - margin)), int(rng.integers(margin, sheet_height - margin)))
+        end = (int(rng.integers(margin, sheet_width - margin)), int(rng.integers(margin, sheet_height - margin)))
+        cv.line(sheet, start, end, GREEN_PEN, line_width, cv.LINE_AA)
+    return sheet
+
+
+def generate_frame(spec: SyntheticFrameSpec) -> Tuple[np.ndarray, List[Tuple[float, float]]]:
+    """Renders a synthetic BGR frame.
+
+    Returns
+    -------
+        (frame, dot_centers): the frame and the true (x, y) positions of the four red dots in it, ordered like
+                              planvec.img_proc.sort_points_clockwise
+    """
+    rng = np.random.default_rng(spec.seed)
+    width, height = spec.width, spec.height
+
+    # The sheet covers about 80% of the frame height, its corners are jittered to get a perspective view
+    sheet_width = int(min(0.8 * width, 0.8 * height / SHEET_ASPECT))
+    sheet = _draw_sheet(rng, sheet_width, spec)
+    sheet_height = sheet.shape[0]
+    offset = np.array([(width - sheet_width) / 2, (height - sheet_height) / 2])
+    src_corners = np.float32([[0, 0], [0, sheet_height], [sheet_width, sheet_height], [sheet_width, 0]])
+    jitter = rng.uniform(-1, 1, (4, 2)) * spec.perspective_jitter * np.array([sheet_width, sheet_height])
+    dst_corners = np.float32(src_corners + offset + jitter)
+    transformation = cv.getPerspectiveTransform(src_corners, dst_corners)
+    frame = cv.warpPerspective(sheet, transformation, (width, height), flags=cv.INTER_LINEAR,
+                               borderMode=cv.BORDER_CONSTANT, borderValue=TABLE)
+
+    # Uneven lighting: brightness falls off linearly in a random direction
+    angle = rng.uniform(0, 2 * np.pi)
+    x_coords, y_coords = np.meshgrid(np.linspace(-0.5, 0.5, width), np.linspace(-0.5, 0.5, height))
+    ramp = np.cos(angle) * x_coords + np.sin(angle) * y_coords
+    ramp = (ramp - ramp.min()) / max(ramp.max() - ramp.min(), 1e-9)
+    lighting = (1.0 - spec.lighting_gradient * ramp).astype(np.float32)
+    frame = frame.astype(np.float32) * lighting[..., None]
+    if spec.noise_std > 0:
+        frame += rng.normal(0, spec.noise_std, frame.shape).astype(np.float32)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    # True dot centres: the dot centres of the sheet mapped with the same transformation
+    unit = sheet_width / 1000
+    dot_inset = max(3, int(round(12 * unit))) + max(2, int(round(4 * unit)))
+    sheet_dots = np.float32([[dot_inset, dot_inset], [dot_inset, sheet_height - dot_inset],
+                             [sheet_width - dot_inset, sheet_height - dot_inset], [sheet_width - dot_inset, dot_inset]])
+    dot_centers = cv.perspectiveTransform(sheet_dots.reshape(-1, 1, 2), transformation).reshape(-1, 2)
+    return frame, [tuple(center) for center in dot_centers.tolist()]
+
+
+def generate_frames(n_frames: int, width: int, height: int, seed: int = 0, **spec_kwargs) -> List[np.ndarray]:
+    """n_frames different frames of one size, frame i uses seed + i."""
+    return [generate_frame(SyntheticFrameSpec(width, height, seed=seed + frame_idx, **spec_kwargs))[0]
+            for frame_idx in range(n_frames)]
@@ -0,0 +1,71 @@
+"""
+Preallocated image buffers for the processing pipeline. Every full-frame intermediate result of a pipeline pass
+(warped frame, HSV planes, masks, grey image, label image, ...) gets a named buffer which is allocated on first use and
+reused by all later frames of the same resolution. In steady state the pool has no misses, i.e. these results do not
+allocate new full-frame arrays, which reduces allocator and garbage collection jitter in the live loop. Arrays which
+numpy and OpenCV allocate outside of the pool (e.g. contours and temporaries of operations without a dst) are not
+counted by the pool.
+
+A pool must only be used by one thread and a buffer is only valid until the next frame overwrites it, i.e. results
+which outlive a frame need to be copied.
+"""
+import numpy as np
+
+from typing import Tuple
+
+
+class BufferPool:
+    """Named buffers keyed by (name, shape, dtype), such that every resolution gets its own set of buffers.
+
+    Pool misses, i.e. buffers which had to be allocated, are counted per frame (between calls of begin_frame) and in
+    total, see stats.
+    """
+
+    def __init__(self) -> None:
+        self._buffers = {}
+        self.n_frames = 0
+        self.n_misses = 0
+        self.miss_bytes = 0  # total over all frames
+        self.frame_miss_bytes = 0  # since the last begin_frame
+
+    def begin_frame(self) -> None:
+        """Marks the start of a new pipeline pass, resets the per-frame miss counter."""
+        self.n_frames += 1
+        self.frame_miss_bytes = 0
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Returns the buffer of given name, shape and dtype. Its content is undefined, it is allocated if it does not
+        exist yet."""
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[key] = buffer
+            self.n_misses += 1
+            self.miss_bytes += buffer.nbytes
+            self.frame_miss_bytes += buffer.nbytes
+        return buffer
+
+    def like(self, name: str, img: np.ndarray) -> np.ndarray:
+        """Buffer with the shape and dtype of img."""
+        return self.get(name, img.shape, img.dtype)
+
+    def clear(self) -> None:
+        """Releases all buffers, e.g. after the resolution changed for good."""
+        self._buffers = {}
+
+    @property
+    def n_buffers(self) -> int:
+        return len(self._buffers)
+
+    @property
+    def pooled_bytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def stats(self) -> dict:
+        return {'frames': self.n_frames,
+                'buffers': self.n_buffers,
+                'pooled_bytes': self.pooled_bytes,
+                'misses': self.n_misses,
+                'miss_bytes': self.miss_bytes,
+                'frame_miss_bytes': self.frame_miss_bytes}
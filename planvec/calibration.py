@@ -0,0 +1,169 @@
+"""
+Persisted camera to sheet calibration for fixed-mount installations where neither the camera nor the drawing board
+move. The positions of the red corner dots (and optionally the lens distortion of the camera) are stored once per
+camera. Undistortion and perspective rectification are then combined into a single pair of fixed-point remap tables,
+such that rectifying a frame is one cv.remap call. The red dot search only runs as a periodic sanity check.
+"""
+import json
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+from planvec import img_proc
+from planvec.color_range import HSVColorRange
+from planvec.planvec_paths import CALIBRATION_DIR_PATH
+from planvec.utils.date_utils import get_date_time_tag
+from planvec.utils.timing import timeit
+
+from typing import List, Optional, Tuple, Union
+
+CALIBRATION_FILE_TEMPL = 'camera_{camera_index}.json'
+
+
+class SheetCalibration:
+    """Maps camera frames onto the sheet spanned by the red corner dots.
+
+    Arguments
+    ---------
+        corners: the four dot centroids (x, y) in camera pixels, ordered by img_proc.sort_points_clockwise
+        image_size: (width, height) of the camera frames the calibration is valid for
+        camera_matrix: optional 3x3 camera matrix of the lens model, see cv.calibrateCamera
+        dist_coeffs: optional distortion coefficients of the lens model, see cv.calibrateCamera
+        check_interval: every how many frames the dot positions are verified, see check_due
+        check_tolerance: maximum distance in pixels between calibrated and detected dots
+    """
+
+    def __init__(self, corners: List[Tuple[float, float]], image_size: Tuple[int, int],
+                 camera_matrix: np.ndarray = None, dist_coeffs: np.ndarray = None,
+                 check_interval: int = 100, check_tolerance: float = 5.0) -> None:
+        self.corners = np.float32(corners)
+        self.image_size = tuple(image_size)
+        self.camera_matrix = None if camera_matrix is None else np.float64(camera_matrix)
+        self.dist_coeffs = None if dist_coeffs is None else np.float64(dist_coeffs).ravel()
+        self.check_interval = check_interval
+        self.check_tolerance = check_tolerance
+        self.valid = True  # False after a failed sanity check, the calibration should not be used then
+        self.n_frames_since_check = check_interval  # the first frame is checked, the board may have moved since
+        self.n_checks = 0
+        self.n_check_failures = 0
+        self._maps = None
+        self._maps_dst_shape = None
+
+    @property
+    def has_lens_model(self) -> bool:
+        return self.camera_matrix is not None and self.dist_coeffs is not None
+
+    @classmethod
+    def from_frame(cls, img: np.ndarray, red_color_ranges: List[HSVColorRange], camera_matrix: np.ndarray = None,
+                   dist_coeffs: np.ndarray = None, **kwargs) -> Optional['SheetCalibration']:
+        """Calibrate on a BGR frame showing the sheet with its four red dots. Returns None if the dots are not found."""
+        corners = img_proc.find_red_dot_centroids(img, red_color_ranges)
+        if corners is None:
+            return None
+        height, width = img.shape[:2]
+        return cls(corners, (width, height), camera_matrix=camera_matrix, dist_coeffs=dist_coeffs, **kwargs)
+
+    def _undistorted_corners(self) -> np.ndarray:
+        """Corner positions in the undistorted camera image (same as corners without a lens model)."""
+        if not self.has_lens_model:
+            return self.corners
+        return cv.undistortPoints(self.corners.reshape(-1, 1, 2), self.camera_matrix, self.dist_coeffs,
+                                  P=self.camera_matrix).reshape(-1, 2)
+
+    def homography(self, dst_shape: Tuple[int, int]) -> np.ndarray:
+        """Perspective transformation from the undistorted camera image to the rectified image of dst_shape."""
+        dst_corners = np.float32(img_proc.rectified_corners(dst_shape))
+        return cv.getPerspectiveTransform(self._undistorted_corners(), dst_corners)
+
+    @timeit
+    def _build_maps(self, dst_shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Fixed-point remap tables taking every rectified pixel to its (distorted) camera pixel.
+
+        cv.initUndistortRectifyMap maps a destination pixel p to inv(new_camera_matrix * R) * p, distorts the result
+        and projects it with the camera matrix. With R = H * K and the identity as new camera matrix this is
+        inv(K) * inv(H) * p, i.e. undistortion and perspective rectification in one table.
+        """
+        homography = self.homography(dst_shape)
+        if self.has_lens_model:
+            camera_matrix, dist_coeffs = self.camera_matrix, self.dist_coeffs
+        else:
+            camera_matrix, dist_coeffs = np.eye(3), np.zeros(5)
+        map_x, map_y = cv.initUndistortRectifyMap(camera_matrix, dist_coeffs, homography @ camera_matrix, np.eye(3),
+                                                  tuple(dst_shape), cv.CV_32FC1)
+        return cv.convertMaps(map_x, map_y, cv.CV_16SC2)
+
+    def fits(self, img: np.ndarray) -> bool:
+        """Whether the frame has the size the calibration was made for, e.g. not after switching the camera."""
+        height, width = img.shape[:2]
+        return (width, height) == self.image_size
+
+    @timeit
+    def rectify(self, img: np.ndarray, dst_shape: Tuple[int, int], dst: np.ndarray = None) -> np.ndarray:
+        """Undistort and rectify a BGR frame to dst_shape (width, height) with a single remap. The result is written
+        into dst if given. Raises a ValueError if the frame does not have the calibrated size, see fits."""
+        if not self.fits(img):
+            raise ValueError(f'Frame of {img.shape[1]}x{img.shape[0]} does not fit the calibration for '
+                             f'{self.image_size[0]}x{self.image_size[1]}.')
+        if self._maps is None or self._maps_dst_shape != tuple(dst_shape):
+            self._maps = self._build_maps(dst_shape)
+            self._maps_dst_shape = tuple(dst_shape)
+        self.n_frames_since_check += 1
+        return cv.remap(img, self._maps[0], self._maps[1], interpolation=cv.INTER_LINEAR, dst=dst)
+
+    def check_due(self) -> bool:
+        return self.n_frames_since_check >= self.check_interval
+
+    @timeit
+    def check(self, img: np.ndarray, red_color_ranges: List[HSVColorRange]) -> bool:
+        """Sanity check: are the red dots still where they have been calibrated? Sets and returns valid."""
+        self.n_checks += 1
+        self.n_frames_since_check = 0
+        corners = None
+        if self.fits(img):
+            corners = img_proc.find_red_dot_centroids(img, red_color_ranges)
+        if corners is None:
+            self.valid = False
+        else:
+            self.valid = bool(np.linalg.norm(np.float32(corners) - self.corners, axis=1).max() <= self.check_tolerance)
+        if not self.valid:
+            self.n_check_failures += 1
+        return self.valid
+
+    def to_dict(self, dst_shape: Tuple[int, int]) -> dict:
+        return {'created': get_date_time_tag(),
+                'image_size': list(self.image_size),
+                'corners': self.corners.tolist(),
+                'dst_shape': list(dst_shape),
+                'homography': self.homography(dst_shape).tolist(),
+                'camera_matrix': None if self.camera_matrix is None else self.camera_matrix.tolist(),
+                'dist_coeffs': None if self.dist_coeffs is None else self.dist_coeffs.tolist()}
+
+    def save(self, path: Union[str, Path], dst_shape: Tuple[int, int]) -> None:
+        """Stores the calibration as json. The homography is stored for dst_shape, for other output shapes it is
+        derived from the stored corners."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as calibration_file:
+            json.dump(self.to_dict(dst_shape), calibration_file, indent=4)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], **kwargs) -> 'SheetCalibration':
+        with open(path, 'r') as calibration_file:
+            calibration = json.load(calibration_file)
+        return cls(calibration['corners'], calibration['image_size'],
+                   camera_matrix=calibration.get('camera_matrix'), dist_coeffs=calibration.get('dist_coeffs'),
+                   **kwargs)
+
+
+def calibration_file_path(camera_index: int, calibration_dir: Path = CALIBRATION_DIR_PATH) -> Path:
+    return Path(calibration_dir) / CALIBRATION_FILE_TEMPL.format(camera_index=camera_index)
+
+
+def load_camera_calibration(camera_index: int, calibration_dir: Path = CALIBRATION_DIR_PATH,
+                            **kwargs) -> Optional[SheetCalibration]:
+    """Loads the calibration of a camera (device index) if one has been stored, else returns None."""
+    path = calibration_file_path(camera_index, calibration_dir)
+    if not path.exists():
+        return None
+    return SheetCalibration.load(path, **kwargs)
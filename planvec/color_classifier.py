@@ -0,0 +1,99 @@
+"""
+Precompiled colour classification. Instead of converting every frame to HSV and running cv.inRange once per
+HSVColorRange, all 2^24 BGR values are classified once per colour range configuration and stored in a lookup table
+(LUT). Classifying a frame then is a single gather through that table.
+
+  BGR pixel (b, g, r) --pack--> index r << 16 | g << 8 | b --LUT--> 255 (in any range) or 0
+"""
+import sys
+import threading
+from functools import lru_cache
+
+import cv2 as cv
+import numpy as np
+
+from planvec.color_range import HSVColorRange
+
+from typing import Iterable, Tuple
+
+N_BGR_VALUES = 1 << 24
+WHITE = (255, 255, 255, 0)
+
+
+class HSVRangeClassifier:
+    """Classifies BGR pixels as 'inside any of the given HSV color ranges' via a full resolution 3D lookup table.
+
+    The table holds one byte per BGR value (16 MB) and yields the exact same result as cv.cvtColor + cv.inRange.
+    Use get_hsv_range_classifier to obtain a cached instance rather than building one per frame.
+    """
+
+    def __init__(self, hsv_color_ranges: Iterable[HSVColorRange]) -> None:
+        self.hsv_color_ranges = tuple(hsv_color_ranges)
+        self.lut = self._build_lut(self.hsv_color_ranges)
+        self._scratch = threading.local()  # per-thread buffers, the cached instance might be shared between threads
+
+    @staticmethod
+    def _build_lut(hsv_color_ranges: Tuple[HSVColorRange, ...]) -> np.ndarray:
+        """Classify every possible BGR value once. The table is indexed by the packed value r << 16 | g << 8 | b."""
+        r_block = 16  # classify 16 red values (1M BGR values) at a time to keep the peak memory low
+        gb = np.arange(1 << 16, dtype=np.uint32)
+        all_bgr = np.empty((r_block, 1 << 16, 3), dtype=np.uint8)
+        all_bgr[:, :, 0] = gb & 0xFF
+        all_bgr[:, :, 1] = gb >> 8
+        lut = np.zeros((256, 1 << 16), dtype=np.uint8)
+        for r_start in range(0, 256, r_block):
+            all_bgr[:, :, 2] = np.arange(r_start, r_start + r_block, dtype=np.uint8)[:, None]
+            hsv = cv.cvtColor(all_bgr, cv.COLOR_BGR2HSV)
+            lut_block = lut[r_start:r_start + r_block]
+            for hsv_color_range in hsv_color_ranges:
+                range_mask = cv.inRange(hsv, np.array(hsv_color_range.start), np.array(hsv_color_range.end))
+                cv.bitwise_or(lut_block, range_mask, dst=lut_block)
+        return lut.ravel()
+
+    def _buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Scratch buffers (BGRA frame, packed indices, mask) for a given image shape, reused across frames. The
+        indices are intp since np.take would otherwise convert them to a temporary intp array on every call."""
+        buffers = getattr(self._scratch, 'buffers', None)
+        if buffers is None or buffers[0].shape[:2] != shape:
+            buffers = (np.empty(shape + (4,), dtype=np.uint8),
+                       np.empty(shape, dtype=np.intp),
+                       np.empty(shape, dtype=np.uint8))
+            self._scratch.buffers = buffers
+        return buffers
+
+    def mask(self, bgr_img: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+        """Returns an 8-bit mask which is 255 for pixels in any of the color ranges and 0 elsewhere. If dst is given
+        the mask is written into it, otherwise an internal buffer is returned which is overwritten by the next call."""
+        bgra, packed, mask = self._buffers(bgr_img.shape[:2])
+        if dst is None:
+            dst = mask
+        # Padding to BGRA lets us read each pixel as one 32 bit word
+        cv.cvtColor(bgr_img, cv.COLOR_BGR2BGRA, dst=bgra)
+        words = bgra.view(np.uint32)[..., 0]
+        if sys.byteorder == 'little':
+            np.bitwise_and(words, 0xFFFFFF, out=packed)
+        else:
+            np.right_shift(words, 8, out=packed)
+        np.take(self.lut, packed, out=dst, mode='clip')  # indices are always valid, 'raise' would buffer out
+        return dst
+
+    def filter_to_white(self, bgr_img: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+        """Sets all pixels within any of the color ranges to white. The result is written into dst which may be
+        bgr_img itself for in-place processing. If dst is None, a new image is allocated."""
+        mask = self.mask(bgr_img)
+        if dst is None:
+            dst = np.copy(bgr_img)
+        elif dst is not bgr_img:
+            np.copyto(dst, bgr_img)
+        cv.bitwise_or(dst, WHITE, dst=dst, mask=mask)
+        return dst
+
+
+@lru_cache(maxsize=4)
+def _cached_classifier(range_key: tuple) -> HSVRangeClassifier:
+    return HSVRangeClassifier(HSVColorRange(start, end) for start, end in range_key)
+
+
+def get_hsv_range_classifier(hsv_color_ranges: Iterable[HSVColorRange]) -> HSVRangeClassifier:
+    """Returns the classifier for a set of color ranges. The lookup table is only rebuilt if the ranges change."""
+    return _cached_classifier(tuple(hsv_color_range.as_tuple() for hsv_color_range in hsv_color_ranges))
@@ -21,6 +21,21 @@ class HSVColorRange:
         self.start = start
         self.end = end
 
+    def __eq__(self, other):
+        if not isinstance(other, HSVColorRange):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return f'HSVColorRange({list(self.start)}, {list(self.end)})'
+
+    def as_tuple(self):
+        """Immutable (start, end) representation, e.g. to be used as a cache key."""
+        return tuple(self.start), tuple(self.end)
+
     @property
     def h_min(self):
         return self.start[0]
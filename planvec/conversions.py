@@ -79,8 +79,8 @@ def rgb2bgr(rgb_img) -> np.ndarray:
 
 
 @timeit
-def bgr2rgb(bgr_img) -> np.ndarray:
-    return cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
+def bgr2rgb(bgr_img, dst=None) -> np.ndarray:
+    return cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB, dst=dst)
 
 
 @timeit
@@ -109,8 +109,9 @@ def rgb2qt(rgb_img) -> QImage:
 
 
 @timeit
-def bgr2qt(bgr_img):
-    return rgb2qt(bgr2rgb(bgr_img))
+def bgr2qt(bgr_img, dst=None):
+    """The QImage shares the memory of the RGB image, which is written into dst if given."""
+    return rgb2qt(bgr2rgb(bgr_img, dst=dst))
 
 
 @timeit
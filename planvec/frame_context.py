@@ -0,0 +1,59 @@
+"""
+A FrameContext carries one camera frame through the processing stages together with the colour space conversions
+derived from it. Conversions are computed lazily on first access and then shared by all later stages, such that a
+frame is converted to HSV at most once. With a planvec.buffer_pool.BufferPool, conversions and warped frames are
+written into pooled buffers instead of newly allocated arrays.
+"""
+import cv2 as cv
+import numpy as np
+
+from planvec.buffer_pool import BufferPool
+
+from typing import Optional, Tuple, Union
+
+
+class FrameContext:
+    """A BGR frame (OpenCV format) and its lazily computed HSV representation."""
+
+    def __init__(self, bgr: np.ndarray, hsv: np.ndarray = None, buffer_pool: BufferPool = None) -> None:
+        self.bgr = bgr
+        self._hsv = hsv
+        self.buffer_pool = buffer_pool
+
+    def buffer(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> Optional[np.ndarray]:
+        """Pooled buffer to be passed as dst to OpenCV or None (the result is allocated) if the frame has no pool."""
+        if self.buffer_pool is None:
+            return None
+        return self.buffer_pool.get(name, shape, dtype)
+
+    @property
+    def hsv(self) -> np.ndarray:
+        if self._hsv is None:
+            self._hsv = cv.cvtColor(self.bgr, cv.COLOR_BGR2HSV, dst=self.buffer('frame_hsv', self.bgr.shape))
+        return self._hsv
+
+    @property
+    def has_hsv(self) -> bool:
+        """Whether the HSV planes are already available, i.e. accessing them is free."""
+        return self._hsv is not None
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.bgr.shape
+
+    def warped(self, transformation: np.ndarray, final_size: Tuple[int, int]) -> 'FrameContext':
+        """Applies a perspective transformation to the frame. The HSV planes are not warped along: the pipeline
+        classifies the colours of the rectified frame after blurring it (see planvec.pipeline.segment), and nearest
+        neighbour warped HSV planes would not match the interpolated BGR frame anyway."""
+        width, height = final_size
+        warped_shape = (height, width) + self.bgr.shape[2:]
+        warped_bgr = cv.warpPerspective(self.bgr, transformation, final_size,
+                                        dst=self.buffer('warped_bgr', warped_shape))
+        return FrameContext(warped_bgr, buffer_pool=self.buffer_pool)
+
+
+def as_frame_context(img: Union[np.ndarray, FrameContext]) -> FrameContext:
+    """Wraps a raw BGR image into a FrameContext, contexts are passed through unchanged."""
+    if isinstance(img, FrameContext):
+        return img
+    return FrameContext(img)
@@ -0,0 +1,154 @@
+"""
+Shared memory transport of camera frames. A SharedFrameRing is a fixed number of frame slots in a single shared
+memory block. The capture thread reads every frame in place into a free slot (cv2.VideoCapture.read(image=...)),
+the slot is then handed on as FrameSlot: consumers in this process use its numpy view, worker processes attach to the
+block by name and view the slot at its offset. No frame is copied or pickled on the way.
+
+Slots are reference counted: the writer holds the first reference, every consumer which keeps a frame beyond the
+call it got it in retains the slot and releases it when done. A slot with no references is free for the next frame.
+Each published frame gets a running sequence number, such that a consumer can tell frames apart which used the same
+slot. Reference counts live in the process which owns the ring, worker processes only read slots.
+"""
+import threading
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from typing import Optional, Tuple
+
+
+class FrameSlot:
+    """A slot of a SharedFrameRing. array is a view of the slot's memory in the frame shape."""
+
+    def __init__(self, ring: 'SharedFrameRing', index: int, array: np.ndarray) -> None:
+        self.ring = ring
+        self.index = index
+        self.array = array
+        self.seq = -1  # sequence number of the frame in the slot, -1 until the first frame is published
+        self.ref_count = 0
+
+    @property
+    def block_name(self) -> str:
+        return self.ring.block_name
+
+    @property
+    def offset(self) -> int:
+        """Byte offset of the slot in the shared memory block."""
+        return self.index * self.ring.frame_nbytes
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.ring.frame_shape
+
+    def retain(self) -> 'FrameSlot':
+        self.ring._retain(self)
+        return self
+
+    def release(self) -> None:
+        self.ring._release(self)
+
+
+class SharedFrameRing:
+    """n_slots frame slots of frame_shape (uint8) in a shared memory block.
+
+    Arguments
+    ---------
+        n_slots: number of slots, must cover all frames held at the same time: the one being captured, the one
+                 waiting in the frame buffer and all frames being processed
+        frame_shape: shape of the frames, e.g. (1080, 1920, 3)
+    """
+
+    def __init__(self, n_slots: int, frame_shape: Tuple[int, ...]) -> None:
+        self.n_slots = n_slots
+        self.frame_shape = tuple(frame_shape)
+        self.frame_nbytes = int(np.prod(self.frame_shape))
+        self.shared_memory = SharedMemory(create=True, size=n_slots * self.frame_nbytes)
+        self.slots = [FrameSlot(self, index, np.ndarray(self.frame_shape, dtype=np.uint8,
+                                                        buffer=self.shared_memory.buf,
+                                                        offset=index * self.frame_nbytes))
+                      for index in range(n_slots)]
+        self._condition = threading.Condition()
+        self._next_seq = 0
+        self._retired = False
+        self._closed = False
+        self.n_acquire_timeouts = 0
+
+    @property
+    def block_name(self) -> str:
+        return self.shared_memory.name
+
+    @property
+    def n_free(self) -> int:
+        with self._condition:
+            return sum(slot.ref_count == 0 for slot in self.slots)
+
+    def acquire(self, timeout: float = None) -> Optional[FrameSlot]:
+        """A free slot to write the next frame into, with one reference held by the caller. Waits at most timeout
+        seconds (forever if None) and returns None if all slots stay in use or the ring is retired."""
+        with self._condition:
+            def free_slot():
+                return next((slot for slot in self.slots if slot.ref_count == 0), None)
+            if not self._condition.wait_for(lambda: self._retired or free_slot() is not None, timeout=timeout):
+                self.n_acquire_timeouts += 1
+                return None
+            if self._retired:
+                return None
+            slot = free_slot()
+            slot.ref_count = 1
+            return slot
+
+    def publish(self, slot: FrameSlot) -> FrameSlot:
+        """Marks the frame written into slot as complete and gives it the next sequence number."""
+        with self._condition:
+            slot.seq = self._next_seq
+            self._next_seq += 1
+        return slot
+
+    def _retain(self, slot: FrameSlot) -> None:
+        with self._condition:
+            if slot.ref_count <= 0:
+                raise RuntimeError(f'Slot {slot.index} is free, only held slots can be retained.')
+            slot.ref_count += 1
+
+    def _release(self, slot: FrameSlot) -> None:
+        with self._condition:
+            if slot.ref_count <= 0:
+                raise RuntimeError(f'Slot {slot.index} released more often than acquired and retained.')
+            slot.ref_count -= 1
+            if slot.ref_count == 0:
+                self._condition.notify_all()
+                if self._retired and all(other_slot.ref_count == 0 for other_slot in self.slots):
+                    self._close()
+
+    def retire(self) -> None:
+        """No new frames are written, e.g. because the frame size changed or capturing stopped. The shared memory is
+        freed as soon as the last held slot is released."""
+        with self._condition:
+            self._retired = True
+            self._condition.notify_all()
+            if all(slot.ref_count == 0 for slot in self.slots):
+                self._close()
+
+    def _close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        for slot in self.slots:
+            slot.array = None
+        try:
+            self.shared_memory.close()
+        except BufferError:  # a view of a slot is still referenced somewhere, the mapping goes away with it
+            pass
+        self.shared_memory.unlink()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'slots': self.n_slots,
+                    'free': sum(slot.ref_count == 0 for slot in self.slots),
+                    'frames': self._next_seq,
+                    'acquire_timeouts': self.n_acquire_timeouts}
+
+
+def slot_view(shared_memory: SharedMemory, offset: int, shape: Tuple[int, ...]) -> np.ndarray:
+    """View of a slot in a (worker) process which attached to the ring's block by name."""
+    return np.ndarray(shape, dtype=np.uint8, buffer=shared_memory.buf, offset=offset)
@@ -0,0 +1,282 @@
+"""
+Frame sources for the video stream: a live camera, a recorded video file or a directory of images, e.g. the
+*_original.jpeg files the DataManager stores for every saved drawing. All sources have the read/release interface of
+cv2.VideoCapture, such that the VideoStreamThread does not care where its frames come from.
+
+Recorded sources are replayed either with their original timing (realtime=True), i.e. read blocks until the frame is
+due, or as fast as possible. A FrameRecorder captures a live session to a video file with a timestamp file next to it
+(one line 'frame_index,timestamp_s' per frame), which VideoFileSource uses to replay the session with the original
+frame timing. Together this makes throughput and latency measurements of the GUI reproducible without a camera.
+
+All sources can read a frame into a given array (dst), e.g. a slot of a planvec.frame_ring.SharedFrameRing. Video
+sources decode in place via cv2.VideoCapture.read(image=dst), if the frame does not fit dst a new array is returned.
+"""
+import csv
+import time
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+from dotmap import DotMap
+
+from typing import List, Optional, Tuple, Union
+
+DEFAULT_REPLAY_FPS = 30
+DEFAULT_IMAGE_PATTERN = '*_original.jpeg'
+TIMESTAMPS_SUFFIX = '_timestamps.csv'
+TIMESTAMPS_FILE_NAME = 'timestamps.csv'  # timestamps of an image directory
+RECORDING_FOURCC = 'MJPG'
+RECORDING_FILE_SUFFIX = '.avi'
+FRAME_SOURCE_TYPES = ('camera', 'video', 'images')
+
+
+def timestamps_path_for(video_path: Union[str, Path]) -> Path:
+    """Path of the timestamp file belonging to a recorded video, e.g. session.avi -> session_timestamps.csv"""
+    video_path = Path(video_path)
+    return video_path.with_name(video_path.stem + TIMESTAMPS_SUFFIX)
+
+
+def load_timestamps(path: Union[str, Path]) -> Optional[List[float]]:
+    """Frame timestamps in seconds from a timestamp file, None if there is no such file."""
+    path = Path(path)
+    if not path.is_file():
+        return None
+    with open(path, 'r', newline='') as timestamps_file:
+        rows = [row for row in csv.reader(timestamps_file) if row and row[0] != 'frame_index']
+    return [float(timestamp_s) for _, timestamp_s in rows]
+
+
+class FrameSource:
+    """Interface of all frame sources, read returns (ret, bgr_frame) like cv2.VideoCapture.read. If dst is given the
+    frame is written into it when its shape fits, read_into_dst tells whether that happened."""
+
+    is_live = False
+
+    def read(self, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        raise NotImplementedError
+
+    def release(self) -> None:
+        pass
+
+    @property
+    def finished(self) -> bool:
+        """True if a recorded source has no frames left, live sources never finish."""
+        return False
+
+
+def read_into_dst(frame: Optional[np.ndarray], dst: Optional[np.ndarray]) -> bool:
+    """True if frame was read into dst, i.e. frame is dst itself or a view of it."""
+    return frame is not None and dst is not None and frame.shape == dst.shape and np.shares_memory(frame, dst)
+
+
+def _copy_to_dst(frame: Optional[np.ndarray], dst: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Copies a decoded frame into dst for sources which cannot decode in place, frame itself if it does not fit."""
+    if frame is None or dst is None or frame.shape != dst.shape or frame.dtype != dst.dtype:
+        return frame
+    np.copyto(dst, frame)
+    return dst
+
+
+class CameraSource(FrameSource):
+    """Live frames of a camera, the resolution is requested but the camera may choose a different one."""
+
+    is_live = True
+
+    def __init__(self, camera_device_index: int, width: int = None, height: int = None) -> None:
+        self.camera_device_index = camera_device_index
+        self.capture_device = cv.VideoCapture(camera_device_index)
+        if width is not None:
+            self.capture_device.set(cv.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            self.capture_device.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+
+    def read(self, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        return self.capture_device.read(image=dst)
+
+    def release(self) -> None:
+        self.capture_device.release()
+
+
+class ReplaySource(FrameSource):
+    """Base of recorded sources: paces the frames and restarts at the end if loop is set.
+
+    Arguments
+    ---------
+        timestamps: time in seconds of every frame relative to an arbitrary origin, used if realtime
+        realtime: replay with the original timing, otherwise as fast as possible
+        loop: start over after the last frame instead of finishing
+    """
+
+    def __init__(self, timestamps: List[float], realtime: bool = True, loop: bool = False) -> None:
+        self.timestamps = timestamps
+        self.realtime = realtime
+        self.loop = loop
+        self.n_frames_read = 0
+        self._frame_idx = 0
+        self._replay_start = None  # perf_counter time of the first frame of the current pass
+        self._finished = False
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def _load_frame(self, frame_idx: int, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        raise NotImplementedError
+
+    def _rewind(self) -> None:
+        pass
+
+    def _wait_until_due(self, frame_idx: int) -> None:
+        now = time.perf_counter()
+        if frame_idx == 0 or self._replay_start is None:
+            self._replay_start = now - (self.timestamps[frame_idx] - self.timestamps[0])
+            return
+        delay = self._replay_start + (self.timestamps[frame_idx] - self.timestamps[0]) - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def read(self, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """Reads the next frame, unreadable frames are skipped. The source finishes at the end of the frames if it
+        does not loop, or if no frame of a full pass could be read."""
+        n_unreadable = 0
+        while not self._finished and n_unreadable < self.n_frames:
+            if self._frame_idx >= self.n_frames:
+                if not self.loop:
+                    break
+                self._frame_idx = 0
+                self._rewind()
+            ret, frame = self._load_frame(self._frame_idx, dst)
+            if not ret:  # e.g. a corrupt image or fewer frames in the video than timestamps
+                self._frame_idx += 1
+                n_unreadable += 1
+                continue
+            if self.realtime:
+                self._wait_until_due(self._frame_idx)
+            self._frame_idx += 1
+            self.n_frames_read += 1
+            return True, frame
+        self._finished = True
+        return False, None
+
+
+class VideoFileSource(ReplaySource):
+    """Frames of a video file. Its timing is taken from the timestamp file of a FrameRecorder recording if there is
+    one, otherwise from the frame rate stored in the video (or fps if it has none)."""
+
+    def __init__(self, video_path: Union[str, Path], realtime: bool = True, loop: bool = False,
+                 fps: float = DEFAULT_REPLAY_FPS) -> None:
+        self.video_path = Path(video_path)
+        if not self.video_path.is_file():
+            raise IOError(f'Video file {self.video_path} does not exist.')
+        self.capture_device = cv.VideoCapture(str(self.video_path))
+        n_frames = int(self.capture_device.get(cv.CAP_PROP_FRAME_COUNT))
+        timestamps = load_timestamps(timestamps_path_for(self.video_path))
+        if timestamps is None:
+            video_fps = self.capture_device.get(cv.CAP_PROP_FPS) or fps
+            timestamps = [frame_idx / video_fps for frame_idx in range(n_frames)]
+        super().__init__(timestamps, realtime=realtime, loop=loop)
+
+    def _load_frame(self, frame_idx: int, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        return self.capture_device.read(image=dst)  # frames are read in order, frame_idx is implied
+
+    def _rewind(self) -> None:
+        self.capture_device.set(cv.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self) -> None:
+        self.capture_device.release()
+
+
+class ImageDirSource(ReplaySource):
+    """Images of a directory (recursively) in the order of their file names. The images are decoded when they are
+    read. Their timing is taken from a timestamps.csv in the directory if there is one, otherwise they are spaced by
+    1 / fps, saved drawings are usually minutes apart so their original timing is of no use."""
+
+    def __init__(self, dir_path: Union[str, Path], pattern: str = DEFAULT_IMAGE_PATTERN, realtime: bool = True,
+                 loop: bool = False, fps: float = DEFAULT_REPLAY_FPS) -> None:
+        self.dir_path = Path(dir_path)
+        self.image_paths = sorted(self.dir_path.rglob(pattern), key=lambda path: path.name)
+        if len(self.image_paths) == 0:
+            raise IOError(f'No images matching {pattern} found in {self.dir_path}.')
+        timestamps = load_timestamps(self.dir_path / TIMESTAMPS_FILE_NAME)
+        if timestamps is None or len(timestamps) != len(self.image_paths):
+            timestamps = [frame_idx / fps for frame_idx in range(len(self.image_paths))]
+        super().__init__(timestamps, realtime=realtime, loop=loop)
+
+    def _load_frame(self, frame_idx: int, dst: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        frame = cv.imread(str(self.image_paths[frame_idx]))
+        return frame is not None, _copy_to_dst(frame, dst)
+
+
+class FrameRecorder:
+    """Writes frames to a video file and their capture times (seconds since the first frame) to the timestamp file
+    next to it. The timestamp file is flushed after every frame, such that it survives a crash of the application.
+
+    Arguments
+    ---------
+        video_path: output video, an .avi file for the default MJPG codec
+        fps: nominal frame rate stored in the video, the replay uses the timestamps
+        fourcc: codec of the video
+    """
+
+    def __init__(self, video_path: Union[str, Path], fps: float = DEFAULT_REPLAY_FPS,
+                 fourcc: str = RECORDING_FOURCC) -> None:
+        self.video_path = Path(video_path)
+        self.timestamps_path = timestamps_path_for(self.video_path)
+        self.fps = fps
+        self.fourcc = fourcc
+        self.n_frames = 0
+        self._writer = None
+        self._frame_size = None
+        self._start_time = None
+        self._timestamps_file = None
+        self._timestamps_writer = None
+
+    def write(self, bgr_frame: np.ndarray, capture_time: float = None) -> None:
+        """Appends a frame, capture_time is a time.perf_counter value and defaults to now."""
+        capture_time = time.perf_counter() if capture_time is None else capture_time
+        frame_size = (bgr_frame.shape[1], bgr_frame.shape[0])
+        if self._writer is None:
+            self.video_path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = cv.VideoWriter(str(self.video_path), cv.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                          frame_size)
+            if not self._writer.isOpened():
+                raise IOError(f'Could not open {self.video_path} for writing with codec {self.fourcc}.')
+            self._frame_size = frame_size
+            self._start_time = capture_time
+            self._timestamps_file = open(self.timestamps_path, 'w', newline='')
+            self._timestamps_writer = csv.writer(self._timestamps_file)
+            self._timestamps_writer.writerow(['frame_index', 'timestamp_s'])
+        if frame_size != self._frame_size:  # a video has a single frame size, e.g. the camera was switched
+            bgr_frame = cv.resize(bgr_frame, self._frame_size, interpolation=cv.INTER_AREA)
+        self._writer.write(bgr_frame)
+        self._timestamps_writer.writerow([self.n_frames, f'{capture_time - self._start_time:.6f}'])
+        self._timestamps_file.flush()
+        self.n_frames += 1
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.release()
+            self._timestamps_file.close()
+            self._writer = None
+            print(f'Recorded {self.n_frames} frames to {self.video_path}.')
+
+
+def create_frame_source(video_config: DotMap, camera_device_index: int = None) -> FrameSource:
+    """Frame source of the video config: video.source is 'camera', 'video' (video.source_path is a video file) or
+    'images' (video.source_path is a directory of images)."""
+    source_type = video_config.get('source', 'camera')
+    realtime = bool(video_config.get('replay_realtime', True))
+    loop = bool(video_config.get('replay_loop', True))
+    if source_type == 'camera':
+        if camera_device_index is None:
+            raise ValueError('No camera found, set video.source to \'video\' or \'images\' to replay frames.')
+        return CameraSource(camera_device_index, video_config.max_input_width, video_config.max_input_height)
+    if source_type == 'video':
+        return VideoFileSource(video_config.source_path, realtime=realtime, loop=loop)
+    if source_type == 'images':
+        return ImageDirSource(video_config.source_path, realtime=realtime, loop=loop)
+    raise ValueError(f'Frame source {source_type} not supported, use one of {FRAME_SOURCE_TYPES}.')
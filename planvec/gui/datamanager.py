@@ -1,25 +1,97 @@
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from PyQt5 import QtCore
 from PyQt5.QtGui import QImage
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+from planvec import vizualization
+from planvec.session_manifest import SessionManifest
+from planvec.vector_writer import VectorDrawing
 
 from planvec.planvec_paths import DATA_REPOSITORY_DIR_PATH
 from planvec.planvec_paths import DATA_DESKTOP_DIR_PATH
 from planvec.utils import date_utils
+from planvec.utils.metrics import timed_operation
+from planvec.utils.units_conversion import cm_to_inches
 
-from typing import List
+from typing import List, Union
 
 date_utils.get_date_tag()
 date_utils.get_date_time_tag()
 
 IMG_NAME_FORMAT = '{idx}_{team}_{date_tag}{suffix}.{file_type}'
+DEFAULT_SAVE_WORKERS = 2
+
+
+class SaveSnapshot:
+    """Everything a save writes, taken when the user saves such that the live loop can go on while it is written.
+    The images are deep copies, the contours are never modified by the pipeline (every frame gets new ones).
+
+    Arguments
+    ---------
+        input_image: camera frame, saved as *_original.jpeg
+        output_image: processed preview, saved as *_output.jpeg
+        drawing: contours with page size and line width, saved as *_output.pdf
+        pdf_writer: 'vector' writes the drawing directly, 'matplotlib' plots it into a figure first
+    """
+
+    def __init__(self, input_image: QImage, output_image: QImage, drawing: VectorDrawing,
+                 pdf_writer: str = 'vector') -> None:
+        self.input_image = input_image.copy()
+        self.output_image = output_image.copy()
+        self.drawing = VectorDrawing(tuple(drawing.contours), canvas_shape=tuple(drawing.canvas_shape),
+                                     page_size_cm=tuple(drawing.page_size_cm), line_width=drawing.line_width,
+                                     color=drawing.color)
+        self.pdf_writer = pdf_writer
+
+
+class SaveResult:
+    """Outcome of an asynchronous save, error is the exception message if it failed."""
+
+    def __init__(self, school_name: str, team_name: str, idx: int, paths: List[str] = None,
+                 error: str = None) -> None:
+        self.school_name = school_name
+        self.team_name = team_name
+        self.idx = idx
+        self.paths = paths or []
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class SaveSignals(QtCore.QObject):
+    """Qt signals of the asynchronous saves. They are emitted on the writer threads, connected slots of objects living
+    in the GUI thread are called there (queued connection)."""
+    save_queued = QtCore.pyqtSignal(int)  # number of pending saves
+    save_finished = QtCore.pyqtSignal(object, int)  # SaveResult, number of pending saves
 
 
 class DataManager:
-    def __init__(self, output_location: str, date_tag: str = date_utils.get_date_tag()):
+    """Output folders and files of the teams. Saves are either synchronous (save_qt_image, save_pdf, save_svg) or
+    asynchronous (save_async): a snapshot is written by a pool of n_save_workers writer threads, the caller gets a
+    future and the signals are emitted when it is done. flush waits for all pending saves, e.g. before the output is
+    jammed or the application quits.
+
+    Saved files are recorded in the session manifest of the date folder (see planvec.session_manifest), schools,
+    teams, file names and image indices are looked up there instead of listing the folders."""
+
+    def __init__(self, output_location: str, date_tag: str = date_utils.get_date_tag(),
+                 n_save_workers: int = DEFAULT_SAVE_WORKERS):
         self.date_tag = date_tag
         self.out_dir_path = str(self.output_root_dir_path_from_output_location(output_location) / date_tag)
         self.create_date_output_folder_if_not_exists()
+        self.manifest = SessionManifest(self.out_dir_path)
+        self.n_save_workers = n_save_workers
+        self.signals = SaveSignals()
+        self._save_executor = None  # started with the first asynchronous save
+        self._pending_saves = set()
+        self._reserved_indices = {}  # (school, team) -> highest image index handed to a pending save
+        self._saves_lock = threading.Lock()
 
     @staticmethod
     def output_root_dir_path_from_output_location(output_location: str) -> Path:
@@ -46,61 +118,157 @@ class DataManager:
     def create_team_folder(self, school_name, team_name: str) -> None:
         if not self.team_dir_exists(school_name, team_name):
             os.makedirs(os.path.join(self.out_dir_path, school_name, team_name))
+        self.manifest.add_team(school_name, team_name)
 
     def _create_save_img_path(self, school_name: str, team_name: str, file_type: str, suffix: str = '',
-                              idx: int = None) -> str:
+                              idx: int = None, date_time_tag: str = None) -> str:
         assert self.team_dir_exists(school_name, team_name), 'Cannot save. Team directory ' \
                                                              'does not exist.'
         if idx is None:
             idx = self.get_next_team_img_idx(school_name, team_name)
         img_name = IMG_NAME_FORMAT.format(idx=idx,
                                           team=team_name,
-                                          date_tag=date_utils.get_date_time_tag(),
+                                          date_tag=date_time_tag or date_utils.get_date_time_tag(),
                                           suffix=suffix,
                                           file_type=file_type)
         team_dir = os.path.join(self.out_dir_path, school_name, team_name)
         return os.path.join(team_dir, img_name)
 
-    def save_qt_image(self, school_name: str, team_name: str, qt_img: QImage, suffix: str = '', idx: int = None) -> None:
-        file_path = self._create_save_img_path(school_name, team_name, 'jpeg', suffix, idx)
-        qt_img.save(file_path)
+    @timed_operation('save_qt_image')
+    def save_qt_image(self, school_name: str, team_name: str, qt_img: QImage, suffix: str = '', idx: int = None,
+                      date_time_tag: str = None) -> str:
+        file_path = self._create_save_img_path(school_name, team_name, 'jpeg', suffix, idx, date_time_tag)
+        if not qt_img.save(file_path):
+            raise IOError(f'Could not write {file_path}.')
+        self.manifest.record(school_name, team_name, file_path)
+        return file_path
+
+    @timed_operation('save_pdf')
+    def save_pdf(self, school_name: str, team_name: str, fig: Union[plt.Figure, VectorDrawing], suffix: str = '',
+                 idx: int = None, date_time_tag: str = None) -> str:
+        """Stores the output as pdf, either from a matplotlib figure or directly from a VectorDrawing."""
+        file_path = self._create_save_img_path(school_name, team_name, 'pdf', suffix, idx, date_time_tag)
+        if isinstance(fig, VectorDrawing):
+            save_output_drawing(fig, file_path)
+        else:
+            save_output_fig(fig, file_path)
+        self.manifest.record(school_name, team_name, file_path)
+        return file_path
 
-    def save_pdf(self, school_name: str, team_name: str, fig: plt.Figure, suffix: str = '', idx: int = None) -> None:
-        file_path = self._create_save_img_path(school_name, team_name, 'pdf', suffix, idx)
-        save_output_fig(fig, file_path)
+    @timed_operation('save_svg')
+    def save_svg(self, school_name: str, team_name: str, drawing: VectorDrawing, suffix: str = '',
+                 idx: int = None) -> None:
+        file_path = self._create_save_img_path(school_name, team_name, 'svg', suffix, idx)
+        save_output_drawing(drawing, file_path)
+        self.manifest.record(school_name, team_name, file_path)
+
+    def save_async(self, school_name: str, team_name: str, snapshot: SaveSnapshot, idx: int = None) -> Future:
+        """Writes the input image, output image and output pdf of a snapshot on a writer thread. The image index and
+        the time in the file names are taken now. Returns a future of the SaveResult, which is also emitted with
+        signals.save_finished."""
+        if idx is None:
+            idx = self.get_next_team_img_idx(school_name, team_name)
+        date_time_tag = date_utils.get_date_time_tag()
+        with self._saves_lock:
+            team_key = (school_name, team_name)
+            self._reserved_indices[team_key] = max(idx, self._reserved_indices.get(team_key, idx))
+            if self._save_executor is None:
+                self._save_executor = ThreadPoolExecutor(max_workers=self.n_save_workers,
+                                                         thread_name_prefix='DataManagerSave')
+            future = self._save_executor.submit(self._write_snapshot, school_name, team_name, snapshot, idx,
+                                                date_time_tag)
+            self._pending_saves.add(future)
+            n_pending = len(self._pending_saves)
+        self.signals.save_queued.emit(n_pending)
+        future.add_done_callback(self._save_done)
+        return future
+
+    @timed_operation('save_snapshot')
+    def _write_snapshot(self, school_name: str, team_name: str, snapshot: SaveSnapshot, idx: int,
+                        date_time_tag: str) -> SaveResult:
+        result = SaveResult(school_name, team_name, idx)
+        try:
+            result.paths.append(self.save_qt_image(school_name, team_name, snapshot.input_image, '_original', idx,
+                                                   date_time_tag))
+            result.paths.append(self.save_qt_image(school_name, team_name, snapshot.output_image, '_output', idx,
+                                                   date_time_tag))
+            pdf_output = (snapshot.drawing if snapshot.pdf_writer != 'matplotlib'
+                          else drawing_to_figure(snapshot.drawing))
+            result.paths.append(self.save_pdf(school_name, team_name, pdf_output, '_output', idx, date_time_tag))
+        except Exception as e:
+            result.error = f'{type(e).__name__}: {e}'
+        return result
+
+    def _save_done(self, future: Future) -> None:
+        with self._saves_lock:
+            self._pending_saves.discard(future)
+            n_pending = len(self._pending_saves)
+            if n_pending == 0:
+                self._reserved_indices = {}
+        if future.cancelled():
+            return
+        exception = future.exception()
+        result = future.result() if exception is None else SaveResult('', '', -1, error=str(exception))
+        self.signals.save_finished.emit(result, n_pending)
+
+    @property
+    def n_pending_saves(self) -> int:
+        with self._saves_lock:
+            return len(self._pending_saves)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits at most timeout seconds (forever if None) for the pending saves. Returns whether all are done."""
+        with self._saves_lock:
+            pending_saves = list(self._pending_saves)
+        if not pending_saves:
+            return True
+        _, not_done = wait(pending_saves, timeout=timeout)
+        return len(not_done) == 0
+
+    def shutdown(self) -> None:
+        """Writes all pending saves and stops the writer threads."""
+        n_pending = self.n_pending_saves
+        if n_pending > 0:
+            print(f'Writing {n_pending} pending saves.')
+        self.flush()
+        if self._save_executor is not None:
+            self._save_executor.shutdown(wait=True)
+            self._save_executor = None
 
     def load_team_output_file_names(self, school_name, team_name: str, endswith: str) -> List[str]:
         """Load all the output file names of a team, e.g. .jpeg or .pdf files."""
-        if self.team_dir_exists(school_name, team_name):
-            all_files = os.listdir(os.path.join(self.out_dir_path, school_name, team_name))
-            return [f for f in all_files if f.endswith(endswith)]
-        else:
-            return []
+        return self.manifest.file_names(school_name, team_name, endswith)
 
     def get_next_team_img_idx(self, school_name, team_name: str) -> int:
-        team_img_names = self.load_team_output_file_names(school_name, team_name, endswith='jpeg')
-        img_indices = sorted([int(name.split('_')[0]) for name in team_img_names])
+        """Next free image index of a team, indices of pending saves count as taken even if not written yet."""
+        img_indices = [self.manifest.max_idx(school_name, team_name)]
+        with self._saves_lock:
+            img_indices.append(self._reserved_indices.get((school_name, team_name)))
+        img_indices = [img_idx for img_idx in img_indices if img_idx is not None]
         if len(img_indices) == 0:
             return 0
-        return img_indices[-1] + 1
+        return max(img_indices) + 1
 
     def load_all_team_names(self, school_name: str) -> List[str]:
-        if os.path.exists(os.path.join(self.out_dir_path, school_name)):
-            items = os.listdir(os.path.join(self.out_dir_path, school_name))
-            return [item for item in items
-                    if os.path.isdir(os.path.join(self.out_dir_path, school_name, item))]
-        else:
-            return []
+        return self.manifest.team_names(school_name)
 
     def load_all_school_names(self) -> List[str]:
-        return [item for item in os.listdir(self.out_dir_path) if os.path.isdir(os.path.join(self.out_dir_path, item))]
+        return self.manifest.school_names()
+
+    def rebuild_manifest(self) -> None:
+        """Re-reads the date folder, e.g. after files were copied or deleted by hand."""
+        self.flush()
+        self.manifest.rebuild()
 
     def delete_all_team_images_and_pdfs(self, school_name, team_name: str):
         """Caution: This method deletes all output images stored for a team."""
         team_img_names = self.load_team_output_file_names(school_name, team_name, endswith='jpeg')
         team_pdf_names = self.load_team_output_file_names(school_name, team_name, endswith='pdf')
         for file_name in team_img_names + team_pdf_names:
-            os.remove(os.path.join(os.path.join(self.out_dir_path, school_name, team_name, file_name)))
+            file_path = os.path.join(self.out_dir_path, school_name, team_name, file_name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self.manifest.remove(school_name, team_name, team_img_names + team_pdf_names)
 
 
 def save_output_fig(out_fig, path=os.path.join(DATA_REPOSITORY_DIR_PATH, 'default_out_name.pdf')):
@@ -109,3 +277,19 @@ def save_output_fig(out_fig, path=os.path.join(DATA_REPOSITORY_DIR_PATH, 'defaul
     out_fig.tight_layout(pad=0)
     out_fig.savefig(path, bbox_inches='tight', pad_inches=0)
     print(f'Saved output figure at {path}')
+
+
+def drawing_to_figure(drawing: VectorDrawing) -> Figure:
+    """Plots a drawing into a new figure of its page size like the live output figure. The figure is not managed by
+    pyplot, such that it can be created and saved on a writer thread."""
+    fig = Figure(figsize=tuple(cm_to_inches(size_cm) for size_cm in drawing.page_size_cm))
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_aspect('equal')
+    vizualization.plot_contours(drawing.contours, ax=ax, color='red', linewidth=drawing.line_width, axis='off')
+    return fig
+
+
+def save_output_drawing(drawing: VectorDrawing, path: str) -> None:
+    """Writes the contours straight to a .pdf or .svg file with the exact page size of the drawing."""
+    drawing.write(path)
+    print(f'Saved output drawing at {path}')
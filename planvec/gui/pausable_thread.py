@@ -0,0 +1,55 @@
+import threading
+
+from PyQt5 import QtCore
+
+STOP_TIMEOUT_MS = 3000
+
+
+class PausableThread(QtCore.QThread):
+    """QThread with a run loop that can be paused, resumed and stopped cooperatively. A paused thread blocks on an
+    event, i.e. it uses no CPU at all. Subclasses implement their loop as
+
+        while self.wait_while_paused():
+            ...  # one iteration, e.g. one frame
+
+    such that a stop request is noticed between two iterations and no frame is interrupted halfway.
+    """
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent=parent)
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._stop_requested = False
+
+    @property
+    def stopped(self) -> bool:
+        """True while the thread is paused."""
+        return not self._resume_event.is_set()
+
+    @property
+    def stop_requested(self) -> bool:
+        return self._stop_requested
+
+    def pause(self) -> None:
+        self._resume_event.clear()
+
+    def resume(self) -> None:
+        self._resume_event.set()
+
+    def toggle_stopped(self) -> None:
+        if self.stopped:
+            self.resume()
+        else:
+            self.pause()
+
+    def wait_while_paused(self) -> bool:
+        """Blocks while the thread is paused. Returns False if the loop should end."""
+        self._resume_event.wait()
+        return not self._stop_requested
+
+    def stop(self, timeout_ms: int = STOP_TIMEOUT_MS) -> bool:
+        """Asks the loop to finish its current iteration and end, also if paused. Waits at most timeout_ms for the
+        thread to finish and returns whether it did."""
+        self._stop_requested = True
+        self._resume_event.set()
+        return self.wait(timeout_ms)
@@ -1,11 +1,13 @@
+import signal
 from functools import partial
 from PyQt5.QtWidgets import (QMainWindow, QLabel, QPushButton,
                              QHBoxLayout, QVBoxLayout,
                              QGridLayout, QApplication, QMessageBox, QLineEdit, QShortcut, QWidget)
 from PyQt5 import QtCore, QtGui
 
-from planvec.gui.datamanager import DataManager
+from planvec.gui.datamanager import DEFAULT_SAVE_WORKERS, DataManager, SaveResult, SaveSnapshot
 from planvec.gui.missing_school_or_team_name_msg_box import MissingSchoolOrTeamNameMsgBox
+from planvec.gui.preview_renderer import PreviewRenderer
 from planvec.gui.processing import ImgProcessThread
 from planvec.gui.save_msg_box import SaveMsgBox
 from planvec.gui.jam_msg_box import JamMsgBox
@@ -13,13 +15,18 @@ from planvec.gui.error_msg_box import ErrorMsgBox
 from planvec.gui.team_dir_dialog import TeamDirDialog
 from planvec.gui.ui_generated.planvec_ui import Ui_planvec
 from planvec.gui.video_stream import FrameBuffer, VideoStreamThread
-from planvec.pdf_jammer import PdfJammer, PdfAndPlateSizeIncompatibleException
-from planvec.utils.date_utils import get_date_tag
+from planvec.frame_sources import RECORDING_FILE_SUFFIX
+from planvec.pipeline_pool import MAX_IN_FLIGHT_PER_WORKER
+from planvec.pipeline_stages import DEFAULT_QUEUE_SIZE
+from planvec.pdf_jammer import PdfJammer, PdfAndPlateSizeIncompatibleException, PlateResult
+from planvec.utils.date_utils import get_date_tag, get_date_time_tag
+from planvec.utils.metrics import METRICS, CounterRate, start_metrics_exporter
+from planvec.utils.tracing import TraceRecorder, trace_span
 from planvec.utils.camera_utils import get_physical_camera_device_indices
-from planvec.planvec_paths import DATA_DESKTOP_DIR_PATH
+from planvec.planvec_paths import DATA_DESKTOP_DIR_PATH, METRICS_FILE_PATH, RECORDINGS_DIR_PATH, TRACES_DIR_PATH
 
 from dotmap import DotMap
-from typing import Tuple
+from typing import List, Tuple
 
 from planvec.utils.qt_utils import get_text_or_placeholder_text
 
@@ -36,11 +43,17 @@ class PlanvecGui:
 
         self.frame_buffer = FrameBuffer()
         self.video_stream_thread = None
+        self.curr_in_image = None  # copies of the last displayed images, saved by save_img_action
+        self.curr_out_image = None
+        self.trace_recorder = TraceRecorder(n_frames=self.config.tracing.n_frames,
+                                            enabled=bool(self.config.tracing.enabled))
+        self._setup_trace_dump()
 
         self.camera_map = {}  # number (1, 2, 3, ...) to camera index (physical index used by opencv)
         self.selected_camera_human_readable_index = None
         self._setup_camera_map_and_ui_camera_selection()
         video_label, processed_label = self._start_video_stream_label()
+        self._setup_recording()
         video_raw_layout = QGridLayout()
         video_raw_layout.addWidget(video_label, 0, 0,
                                    alignment=QtCore.Qt.AlignCenter)
@@ -53,7 +66,9 @@ class PlanvecGui:
 
         self.ui.nameSaveButton.clicked.connect(self.save_img_dialog)
         self.ui.nameSaveButton_2.clicked.connect(self.jam_dialog)  # TODO: rename ui element in qt creator
-        self.data_manager = DataManager(output_location=self.config.data.output_location)
+        self.data_manager = DataManager(output_location=self.config.data.output_location,
+                                        n_save_workers=self.config.data.get('save_workers', DEFAULT_SAVE_WORKERS))
+        self._setup_save_status()
         self.overwrite_output = False
         self.ui.outputWriteRadio.clicked.connect(self._toggle_overwrite_output)
 
@@ -65,26 +80,71 @@ class PlanvecGui:
         self.ui.outputSizeWidth.returnPressed.connect(self._output_plate_size_width_callback)
         self.ui.outputSizeHeight.returnPressed.connect(self._output_plate_size_height_callback)
 
+        self.metrics_exporter = self._setup_metrics()
+        QApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def shutdown(self) -> None:
+        """Stops the capture and processing threads after their current frame and closes recordings and exporters."""
+        for thread in (self.video_stream_thread, self.proc_stream_thread):
+            if not thread.stop():
+                print(f'{type(thread).__name__} did not stop in time.')
+        self.video_stream_thread.stop_recording()
+        self.data_manager.shutdown()  # writes the saves which are still pending
+        self.frame_buffer.clear()  # releases the frame ring slot of a frame nobody took anymore
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+
     def _start_video_stream_label(self):
         """Start a video VideoStreamThread, create original video and processed video QLabels and connect
         the VideoStreamThread QImage signal to the self.video_callback function which sets the pix maps
         of the video labels."""
         vid_label, proc_label = QLabel(self.ui.drawingContent), QLabel(self.ui.openGLWidget)
 
+        frame_ring_slots = self.config.video.get('frame_ring_slots', 0)
+        if frame_ring_slots > 0:  # the worker processes hold a slot for every frame in flight in addition
+            frame_ring_slots += MAX_IN_FLIGHT_PER_WORKER * self.config.processing.get('pipeline_workers', 0)
+            if self.config.processing.get('staged_pipeline', False):  # the frames waiting for and in rectify
+                frame_ring_slots += self.config.processing.get('stage_queue_size', DEFAULT_QUEUE_SIZE) + 1
         self.video_stream_thread = VideoStreamThread(frame_buffer=self.frame_buffer,
                                                      video_config=self.config.video,
-                                                     camera_map=self.camera_map)
+                                                     camera_map=self.camera_map,
+                                                     trace_recorder=self.trace_recorder,
+                                                     frame_ring_slots=frame_ring_slots)
         self.video_stream_thread.start()
+        preview_renderer = None
+        if self.config.video.preview_renderer == 'opencv':
+            preview_renderer = PreviewRenderer(display_size=(self.config.video.processed_display_width,
+                                                             self.config.video.processed_display_height),
+                                               line_width=self.config.processing.line_width)
         self.proc_stream_thread = ImgProcessThread(frame_buffer=self.frame_buffer,
                                                    processing_config=self.config.processing,
-                                                   color_ranges=self.config.color_range.toDict())
+                                                   color_ranges=self.config.color_range.toDict(),
+                                                   preview_renderer=preview_renderer,
+                                                   trace_recorder=self.trace_recorder)
+        if self.camera_map and self.config.video.source == 'camera':  # replayed frames are not rectified by calibration
+            self.proc_stream_thread.load_calibration(self.camera_map[self.selected_camera_human_readable_index])
         self.proc_stream_thread.change_pixmap_signal.connect(
             partial(self.video_callback, vid_label, proc_label)
         )
+        self.proc_stream_thread.frame_rate_signal.connect(self.ui.statusbar.showMessage)
         self.proc_stream_thread.start()
         print('Video stream started.')
         return vid_label, proc_label
 
+    def _setup_recording(self) -> None:
+        """Recording of the grabbed frames is toggled with a keyboard shortcut, the recording is closed on exit."""
+        self.record_shortcut = QShortcut(QtGui.QKeySequence(self.config.video.record_shortcut), self.main_window)
+        self.record_shortcut.activated.connect(self.toggle_recording)
+        if self.config.video.record:
+            self.toggle_recording()
+
+    def toggle_recording(self) -> None:
+        if self.video_stream_thread.recording:
+            self.video_stream_thread.stop_recording()
+        else:
+            self.video_stream_thread.start_recording(RECORDINGS_DIR_PATH / f'session_{get_date_time_tag()}'
+                                                                           f'{RECORDING_FILE_SUFFIX}')
+
     def _change_video_stream_capture_device(self, camera_label: str) -> None:
         def extract_human_readable_camera_index_from_camera_type(_camera_label: str) -> int:
             return int(_camera_label.split(" ")[1])
@@ -92,6 +152,7 @@ class PlanvecGui:
         camera_device_index = self.camera_map[extract_human_readable_camera_index_from_camera_type(camera_label)]
         print(f"Switching to {camera_label} which has device index {camera_device_index}")
         self.video_stream_thread.set_capture_device(camera_device_index)
+        self.proc_stream_thread.load_calibration(camera_device_index)
 
     def _toggle_canny_processing(self) -> None:
         self.proc_stream_thread.toggle_canny_slot()
@@ -100,6 +161,7 @@ class PlanvecGui:
         self.overwrite_output = not self.overwrite_output
 
     def _toggle_stop_video_and_proc_stream_threads(self):
+        """Pauses or resumes capturing and processing, e.g. while a dialog is open. Paused threads use no CPU."""
         self.video_stream_thread.toggle_stopped()
         self.proc_stream_thread.toggle_stopped()
 
@@ -131,20 +193,75 @@ class PlanvecGui:
         self.ui.captureDeviceName.setCurrentText(f"Kamera 1")
 
     @QtCore.pyqtSlot(QtGui.QImage)
-    def video_callback(self, video_raw_label, video_out_label, orig_image, final_image):
-        # Resizing for display
-        in_pixmap = QtGui.QPixmap.fromImage(orig_image)
-        out_pixmap = QtGui.QPixmap.fromImage(final_image)
-
-        in_pixmap = in_pixmap.scaled(self.config.video.raw_display_width,
-                                     self.config.video.raw_display_height,
-                                     QtCore.Qt.KeepAspectRatio)
-        out_pixmap = out_pixmap.scaled(self.config.video.processed_display_width,
-                                       self.config.video.processed_display_height,
-                                       QtCore.Qt.KeepAspectRatio)
-
-        video_raw_label.setPixmap(in_pixmap)
-        video_out_label.setPixmap(out_pixmap)
+    def video_callback(self, video_raw_label, video_out_label, orig_image, final_image, frame_trace=None):
+        if frame_trace is not None:
+            frame_trace.span_since_mark('signal_queue', 'emitted')
+        with trace_span(frame_trace, 'display'):
+            # The images share display buffers of the processing thread, which reuses them once acknowledged
+            self.curr_in_image, self.curr_out_image = orig_image.copy(), final_image.copy()
+            self.proc_stream_thread.acknowledge_frame()
+            # Resizing for display
+            in_pixmap = QtGui.QPixmap.fromImage(self.curr_in_image)
+            out_pixmap = QtGui.QPixmap.fromImage(self.curr_out_image)
+
+            in_pixmap = in_pixmap.scaled(self.config.video.raw_display_width,
+                                         self.config.video.raw_display_height,
+                                         QtCore.Qt.KeepAspectRatio)
+            out_pixmap = out_pixmap.scaled(self.config.video.processed_display_width,
+                                           self.config.video.processed_display_height,
+                                           QtCore.Qt.KeepAspectRatio)
+
+            video_raw_label.setPixmap(in_pixmap)
+            video_out_label.setPixmap(out_pixmap)
+        self.trace_recorder.finish(frame_trace)
+
+    def _setup_metrics(self):
+        """Starts the metrics exporter if enabled in the config and registers the gauges of the GUI's threads."""
+        METRICS.register_gauge('captured_fps', CounterRate('frames_captured'), 'Frames read from the camera per second.')
+        METRICS.register_gauge('processed_fps', CounterRate('frames_processed'), 'Frames processed per second.')
+        METRICS.register_gauge('frame_buffer_depth', self.frame_buffer.qsize, 'Frames waiting to be processed.')
+        return start_metrics_exporter(self.config.metrics, default_file_path=METRICS_FILE_PATH)
+
+    def _setup_save_status(self) -> None:
+        """Saves are written in the background, their progress is shown in a permanent label of the status bar."""
+        self.save_status_label = QLabel()
+        self.ui.statusbar.addPermanentWidget(self.save_status_label)
+        self.data_manager.signals.save_queued.connect(
+            lambda n_pending: self.save_status_label.setText(f'Speichern... ({n_pending} ausstehend)'))
+        self.data_manager.signals.save_finished.connect(self._save_finished)
+
+    def _save_finished(self, result: SaveResult, n_pending: int) -> None:
+        if not result.ok:
+            self.save_status_label.setText(f'Speichern fehlgeschlagen für Gruppe: {result.team_name}')
+            error_box = ErrorMsgBox(f'Fehler beim Speichern für Gruppe {result.team_name}: {result.error}')
+            error_box.execute()
+        elif n_pending > 0:
+            self.save_status_label.setText(f'Bilder gespeichert für Gruppe: {result.team_name} '
+                                           f'({n_pending} ausstehend)')
+        else:
+            self.save_status_label.setText(f'Bilder gespeichert für Gruppe: {result.team_name}')
+
+    def _setup_trace_dump(self) -> None:
+        """The trace of the recent frames is dumped with a keyboard shortcut or by sending SIGUSR1 to the process."""
+        self.trace_recorder.register_thread_name('GUI')
+        self.dump_trace_shortcut = QShortcut(QtGui.QKeySequence(self.config.tracing.dump_shortcut), self.main_window)
+        self.dump_trace_shortcut.activated.connect(self.dump_trace)
+        if hasattr(signal, 'SIGUSR1'):  # not available on Windows
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump_trace())
+            # Python only handles signals when it runs bytecode, the timer wakes it up from the Qt event loop
+            self.signal_wakeup_timer = QtCore.QTimer()
+            self.signal_wakeup_timer.timeout.connect(lambda: None)
+            self.signal_wakeup_timer.start(500)
+
+    def dump_trace(self) -> None:
+        if not self.trace_recorder.enabled:
+            print('Tracing is disabled, see tracing.enabled in the config.')
+            return
+        trace_path = self.trace_recorder.dump(TRACES_DIR_PATH / f'trace_{get_date_time_tag()}.json')
+        latencies_ms = sorted(latency / 1e6 for latency in self.trace_recorder.latencies_ns())
+        median_latency = f'{latencies_ms[len(latencies_ms) // 2]:.1f} ms' if latencies_ms else 'n/a'
+        print(f'Dumped trace of {len(latencies_ms)} frames (median capture to display latency {median_latency}) '
+              f'to {trace_path}. Open it in chrome://tracing or https://ui.perfetto.dev.')
 
     def save_img_dialog(self):
         """A QMessageBox pops up asking further details from the user."""
@@ -167,10 +284,13 @@ class PlanvecGui:
     def save_img_action(self, button_return):
         """This function gets called when the user presses the Save or Cancel
         buttons in the QMessageBox which pops up when the user presses Save
-        in the main window."""
-        curr_qt_img_out = self.proc_stream_thread.get_curr_out()
-        curr_qt_img_in = self.proc_stream_thread.get_curr_in()
-        curr_out_fig = self.proc_stream_thread.get_curr_out_fig()
+        in the main window. The current output is copied and written in the
+        background (see DataManager.save_async), the progress is shown in the
+        status bar."""
+        snapshot = SaveSnapshot(self.curr_in_image,
+                                self.curr_out_image,
+                                self.proc_stream_thread.get_curr_out_drawing(),
+                                pdf_writer=self.config.pdf_output.writer)
 
         if button_return.text() == '&OK':
             team_name = self.ui.teamName.text()
@@ -180,14 +300,9 @@ class PlanvecGui:
                 team_dir_dialog.execute()
             if self.data_manager.team_dir_exists(school_name, team_name):  # dir created
                 if self.overwrite_output:
+                    self.data_manager.flush()  # pending saves of the team would be written after the deletion
                     self.data_manager.delete_all_team_images_and_pdfs(school_name, team_name)
-                img_idx = self.data_manager.get_next_team_img_idx(school_name, team_name)
-                self.data_manager.save_qt_image(school_name, team_name, curr_qt_img_in, '_original', idx=img_idx)
-                self.data_manager.save_qt_image(school_name, team_name, curr_qt_img_out, '_output', idx=img_idx)
-                self.data_manager.save_pdf(school_name, team_name, curr_out_fig, '_output', idx=img_idx)
-                save_msg_box = QMessageBox()
-                save_msg_box.setText(f'Bilder gespeichert für Gruppe: {team_name}')
-                save_msg_box.exec_()
+                self.data_manager.save_async(school_name, team_name, snapshot)
         elif button_return.text() == '&Cancel':
             pass
         else:
@@ -234,13 +349,33 @@ class PlanvecGui:
             info_msg_box.setText(msg)
             info_msg_box.exec_()
 
+        def _run_jam(pdf_paths: List[str]) -> bool:
+            """Returns whether all plates were created, shows the errors otherwise."""
+            try:
+                plate_results: List[PlateResult] = pdf_jammer.run(pdf_paths)
+            except PdfAndPlateSizeIncompatibleException as exception:  # a drawing larger than the plate when packing
+                error_box = ErrorMsgBox(exception.message)
+                error_box.execute()
+                return False
+            failed = [result for result in plate_results if not result.ok]
+            if failed:
+                error_box = ErrorMsgBox('Fehler beim Erstellen von Platte ' +
+                                        ', '.join(f'{result.plate_idx + 1} ({result.error})' for result in failed))
+                error_box.execute()
+            return len(failed) == 0
+
         if button_return.text() == '&OK':
+            self.data_manager.flush()  # the jam includes drawings which are still being saved
             pdf_jammer = PdfJammer(data_manager=self.data_manager,
                                    out_dir_path=DATA_DESKTOP_DIR_PATH / get_date_tag(),
                                    plate_width=int(get_text_or_placeholder_text(self.ui.outputSizeWidth)),
                                    plate_height=int(get_text_or_placeholder_text(self.ui.outputSizeHeight)),
                                    pdf_width=int(get_text_or_placeholder_text(self.ui.inputSizeWidth)),
-                                   pdf_height=int(get_text_or_placeholder_text(self.ui.inputSizeHeight)))
+                                   pdf_height=int(get_text_or_placeholder_text(self.ui.inputSizeHeight)),
+                                   engine=self.config.pdf_output.jam_engine,
+                                   jobs=self.config.pdf_output.jam_jobs,
+                                   layout=self.config.pdf_output.jam_layout,
+                                   spacing=self.config.pdf_output.jam_spacing_cm)
             try:
                 pdf_jammer.validate_pdf_and_plate_sizes_compatibility()
             except PdfAndPlateSizeIncompatibleException as exception:
@@ -251,14 +386,16 @@ class PlanvecGui:
             school_name = self.ui.schoolName_2.text()
             team_name = self.ui.teamName_2.text()
             if team_name == '':  # jam for all teams of a specific school
-                pdfs_dict = pdf_jammer.accumulate_pdf_names_per_team(school_name)
+                pdfs_dict = pdf_jammer.accumulate_pdf_paths_per_team(school_name)
                 pdf_paths_list = pdf_jammer.teams_pdfs_paths_to_list(pdfs_dict)
-                pdf_jammer.run(pdf_paths_list)
+                if not _run_jam(pdf_paths_list):
+                    return
                 _execute_successful_jam_info_box(f'PDF Output erfolgreich generiert für alle Gruppen von Schule {school_name}: \n\t {pdf_jammer.out_dir}')
 
             else:  # jam for specific school and team
                 pdf_paths_list = pdf_jammer.accumulate_pdf_paths_for(school_name, team_name)
-                pdf_jammer.run(pdf_paths_list)
+                if not _run_jam(pdf_paths_list):
+                    return
 
                 _execute_successful_jam_info_box(f'PDF Output erfolgreich generiert für Team {team_name} von Schule {school_name}: \n\t {pdf_jammer.out_dir}')
 
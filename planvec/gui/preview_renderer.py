@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from planvec.utils.timing import timeit
+
+from typing import List, Tuple
+
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)  # buffers are RGB since they are handed to Qt directly
+SUBPIXEL_BITS = 4
+
+
+def preview_layout(display_size: Tuple[int, int], canvas_shape: Tuple[int, int]) -> (float, Tuple[int, int]):
+    """Scale and (height, width) of the preview of a canvas of shape (width, height) fitted into the display size
+    (width, height) keeping its aspect ratio."""
+    canvas_width, canvas_height = canvas_shape
+    display_width, display_height = display_size
+    scale = min(display_width / canvas_width, display_height / canvas_height)
+    return scale, (max(1, int(round(canvas_height * scale))), max(1, int(round(canvas_width * scale))))
+
+
+def draw_preview(buffer: np.ndarray, contours: List[np.ndarray], scale: float, color: Tuple[int, int, int] = RED,
+                 line_width: int = 1) -> None:
+    """Draws the (row, col) contours scaled by scale anti-aliased on white into the RGB buffer."""
+    buffer[...] = WHITE
+    fixed_point_scale = scale * (1 << SUBPIXEL_BITS)
+    polylines = [np.round(contour[:, ::-1] * fixed_point_scale).astype(np.int32) for contour in contours
+                 if len(contour) > 1]
+    if polylines:
+        cv2.polylines(buffer, polylines, isClosed=False, color=color, thickness=line_width, lineType=cv2.LINE_AA,
+                      shift=SUBPIXEL_BITS)
+
+
+class PreviewRenderer:
+    """Rasterises contours straight into preallocated display-size RGB buffers which are wrapped by QImages without
+    copying. This replaces drawing a matplotlib figure and converting it to an image in the live loop.
+
+    The buffers are used round robin. A QImage returned by render stays valid until n_buffers further frames have
+    been rendered, the caller has to make sure that the GUI thread copied it by then (see
+    ImgProcessThread.acknowledge_frame). If the canvas shape changes, the previous buffers are kept alive for n_buffers
+    frames as well, such that QImages of the old shape which are still queued for the GUI do not point to freed memory.
+    """
+
+    def __init__(self, display_size: Tuple[int, int], line_width: int = 1, color: Tuple[int, int, int] = RED,
+                 n_buffers: int = 3) -> None:
+        self.display_size = display_size
+        self.line_width = max(1, int(round(line_width)))
+        self.color = color
+        self.n_buffers = n_buffers
+        self._canvas_shape = None
+        self._scale = None
+        self._buffers = []
+        self._retired_buffers = []  # buffers of the previous canvas shape, until n_buffers frames were rendered
+        self._n_rendered = 0  # frames rendered since the buffers were (re)allocated
+        self._next_buffer_idx = 0
+
+    def _setup_buffers(self, canvas_shape: Tuple[int, int]) -> None:
+        """(Re)allocate the buffers such that the canvas fits into the display size keeping its aspect ratio."""
+        self._scale, (height, width) = preview_layout(self.display_size, canvas_shape)
+        self._retired_buffers = self._buffers
+        self._n_rendered = 0
+        self._next_buffer_idx = 0
+        self._buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(self.n_buffers)]
+        self._canvas_shape = tuple(canvas_shape)
+
+    def set_n_buffers(self, n_buffers: int) -> None:
+        """Changes the number of buffers, e.g. for a pipeline which renders frames ahead of the GUI. The buffers are
+        reallocated for the next frame, the current ones are retired like after a change of the canvas shape."""
+        if n_buffers != self.n_buffers:
+            self.n_buffers = n_buffers
+            self._canvas_shape = None
+
+    @timeit
+    def render(self, contours: List[np.ndarray], canvas_shape: Tuple[int, int]) -> QImage:
+        """Draws the (row, col) contours of a canvas of shape (width, height), e.g. rectify_shape, anti-aliased on
+        white and returns a QImage which shares the memory of the buffer."""
+        if self._canvas_shape != tuple(canvas_shape):
+            self._setup_buffers(canvas_shape)
+        buffer = self._buffers[self._next_buffer_idx]
+        self._next_buffer_idx = (self._next_buffer_idx + 1) % self.n_buffers
+        self._n_rendered += 1
+        if self._n_rendered > self.n_buffers:
+            self._retired_buffers = []
+
+        draw_preview(buffer, contours, self._scale, color=self.color, line_width=self.line_width)
+        height, width, n_channels = buffer.shape
+        return QImage(buffer.data, width, height, n_channels * width, QImage.Format_RGB888)
@@ -1,5 +1,9 @@
+import queue
+import threading
 from time import time
+
 import cv2
+import numpy as np
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtGui import QImage
 from dotmap import DotMap
@@ -8,9 +12,25 @@ from typing import Tuple
 
 import planvec.pipeline
 from planvec import vizualization, conversions
+from planvec.buffer_pool import BufferPool
+from planvec.calibration import SheetCalibration, load_camera_calibration
+from planvec.frame_ring import FrameSlot, SharedFrameRing
+from planvec.pipeline_pool import PipelineProcessPool, PoolResult, STATUS_ERROR, STATUS_OK
+from planvec.pipeline_stages import DEFAULT_QUEUE_SIZE, STAGES, StagedPipeline, StagedResult
+from planvec.red_dot_tracking import RedDotTracker
+from planvec.vector_writer import VectorDrawing
+from planvec.gui.pausable_thread import PausableThread
+from planvec.gui.preview_renderer import PreviewRenderer
 from planvec.gui.video_stream import FrameBuffer
+from planvec.utils.metrics import METRICS
+from planvec.utils.tracing import FrameTrace, TraceRecorder, trace_span
 from planvec.utils.units_conversion import cm_to_inches, inches_to_cm
 
+N_DISPLAY_BUFFERS = 3  # emitted frames the GUI may not have copied yet, see acknowledge_frame
+FRAME_WAIT_TIMEOUT_S = 0.5  # the processing loop wakes up at least this often when no frames arrive
+POOL_POLL_TIMEOUT_S = 0.005  # wait for frames or results while the worker processes are busy
+DEFAULT_POOL_PREVIEW_SIZE = (650, 650)  # preview size of the worker processes if there is no preview renderer
+
 
 class FrameRateCounter:
     """Calculate the frame rate for a series of actions (processed images)."""
@@ -31,33 +51,86 @@ class FrameRateCounter:
         return self.frame_rate
 
 
-class ImgProcessThread(QtCore.QThread):
+class ImgProcessThread(PausableThread):
     """Responsible to process frames from a frame buffer and sending the results back to the gui."""
-    change_pixmap_signal = QtCore.pyqtSignal(QtGui.QImage, QtGui.QImage)
+    change_pixmap_signal = QtCore.pyqtSignal(QtGui.QImage, QtGui.QImage, object)  # input, output, FrameTrace
     frame_rate_signal = QtCore.pyqtSignal(str)
 
-    def __init__(self, frame_buffer: FrameBuffer, processing_config: DotMap, color_ranges: dict, parent=None):
+    def __init__(self, frame_buffer: FrameBuffer, processing_config: DotMap, color_ranges: dict,
+                 preview_renderer: PreviewRenderer = None, trace_recorder: TraceRecorder = None, parent=None):
         super().__init__(parent=parent)
         self.frame_buffer = frame_buffer
         self.processing_config = processing_config
         self.color_ranges = color_ranges
+        self.preview_renderer = preview_renderer  # if given, the output figure is only drawn when requested
+        self.trace_recorder = trace_recorder
+        self.tracker = None
+        if processing_config.red_dot_tracking:
+            self.tracker = RedDotTracker.from_config(processing_config, color_ranges)
+        self.calibration = None
+        self.buffer_pool = BufferPool() if processing_config.use_buffer_pool else None
+        self.process_pool = None  # PipelineProcessPool if processing_config.pipeline_workers > 0, while running
+        self.staged_pipeline = None  # StagedPipeline if processing_config.staged_pipeline is set, while running
+        self._submit_ring = None  # frames which do not come in a frame ring are copied into this one for the pool
+        self._display_slots = {}  # round robin index of the pooled display buffers by name
+        self.n_display_buffers = N_DISPLAY_BUFFERS  # per name, more in the staged mode, see run
+        self._display_buffers_free = None  # semaphore of the display buffers which the GUI is done with, see run
         self.out_fig, self.out_ax = vizualization.setup_figure()
         self.do_canny = False
         self.curr_qt_img_input = None
         self.curr_qt_img_out = None
-        self.stopped = False
+        self.curr_contours = []
 
-    def get_curr_out(self) -> QImage:
-        return self.curr_qt_img_out
+    def acknowledge_frame(self) -> None:
+        """Called by the GUI thread once it copied the images of an emitted frame. The emitted QImages share the
+        display buffers (pooled buffers and those of the PreviewRenderer), which are used round robin. A frame is only
+        written into buffers whose previous frame was acknowledged, i.e. at most n_display_buffers frames are
+        emitted but not yet copied by the GUI, further frames wait."""
+        if self._display_buffers_free is not None:
+            self._display_buffers_free.release()
 
-    def get_curr_in(self) -> QImage:
-        return self.curr_qt_img_input
+    def _acquire_display_buffers(self) -> bool:
+        """Waits until the GUI acknowledged the frame which used the display buffers of the next frame before.
+        Returns False if the thread is asked to stop meanwhile."""
+        while not self._display_buffers_free.acquire(timeout=FRAME_WAIT_TIMEOUT_S):
+            if self.stop_requested:
+                return False
+        return True
 
     def get_curr_out_fig(self) -> plt.Figure:
+        if self.preview_renderer is not None:
+            # The live loop does not draw the figure, draw it now for the current contours
+            self.out_ax.clear()
+            self.out_ax = vizualization.plot_contours(self.curr_contours, ax=self.out_ax, color='red',
+                                                      linewidth=self.processing_config.line_width, axis='off')
+            self.out_fig.set_size_inches(*self.processing_config.out_size_inches)
         return self.out_fig
 
-    def toggle_stopped(self):
-        self.stopped = not self.stopped
+    def get_curr_out_drawing(self) -> VectorDrawing:
+        """The contours of the current output with the page size of the current input size setting."""
+        return VectorDrawing.from_config(self.curr_contours, self.processing_config)
+
+    def set_calibration(self, calibration: SheetCalibration) -> None:
+        """Use a stored calibration (None to disable) and search the red dots again if it does not hold."""
+        self.calibration = calibration
+        if self.tracker is not None:
+            self.tracker.reset()
+        if self.process_pool is not None:
+            self.process_pool.update_settings(self.processing_config, calibration)
+        if self.staged_pipeline is not None:
+            self.staged_pipeline.update_settings(self.processing_config, calibration)
+
+    def load_calibration(self, camera_device_index: int) -> None:
+        """Loads the calibration stored for the camera, if any and if calibrations are enabled in the config."""
+        calibration = None
+        if self.processing_config.use_calibration:
+            calibration = load_camera_calibration(
+                camera_device_index,
+                check_interval=self.processing_config.calibration_check_interval,
+                check_tolerance=self.processing_config.calibration_check_tolerance)
+        print(f'Calibration for camera device index {camera_device_index}: '
+              f'{"loaded" if calibration is not None else "none"}.')
+        self.set_calibration(calibration)
 
     def set_input_width(self, width_cm) -> None:
         _, current_height_inches = self.processing_config.out_size_inches
@@ -72,6 +145,10 @@ class ImgProcessThread(QtCore.QThread):
     def _set_out_size_inches(self, new_out_size_inches: tuple) -> None:
         self.processing_config.out_size_inches = new_out_size_inches
         self.processing_config.rectify_shape = self._calculate_display_shape_in_pixels(*new_out_size_inches)
+        if self.process_pool is not None:
+            self.process_pool.update_settings(self.processing_config, self.calibration)
+        if self.staged_pipeline is not None:
+            self.staged_pipeline.update_settings(self.processing_config, self.calibration)
         print(f"New output shape in cm (width,height): "
               f"{tuple([round(inches_to_cm(entry), 2) for entry in new_out_size_inches])}. "
               f"{self.processing_config.rectify_shape} pixels.")
@@ -95,38 +172,268 @@ class ImgProcessThread(QtCore.QThread):
         self.do_canny = not self.do_canny
 
     @staticmethod
-    def process_frame(img, processing_config: DotMap, color_ranges: dict, do_canny: bool, ax: plt.Axes) -> (plt.Axes, QImage):
+    def process_frame(img, processing_config: DotMap, color_ranges: dict, do_canny: bool,
+                      ax: plt.Axes, preview_renderer: PreviewRenderer = None,
+                      tracker: RedDotTracker = None,
+                      calibration: SheetCalibration = None,
+                      buffer_pool: BufferPool = None,
+                      frame_trace: FrameTrace = None) -> (plt.Axes, QImage, list):
         """Main function which takes the camera bgr_frame (bgr_frame since opencv) and
         processes it such that the resulting image (QImage format) can be displayed
-        next to the input image."""
-        ax.clear()
-        if do_canny:
-            rgb_img = conversions.bgr2rgb(img)
-            gray_img = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2GRAY)
-            edged = cv2.Canny(gray_img, 50, 100)
-            qt_img_processed = conversions.gray2qt(edged)
+        next to the input image. Also returns the contours of the drawing.
 
+        With a buffer_pool the pipeline runs in zero-copy mode and works on the frame directly instead of a copy, the
+        pipeline never modifies its input."""
+        if preview_renderer is None:
+            ax.clear()
+        if do_canny:
+            with trace_span(frame_trace, 'canny'):
+                rgb_img = conversions.bgr2rgb(img)
+                gray_img = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2GRAY)
+                edged = cv2.Canny(gray_img, 50, 100)
+                qt_img_processed = conversions.gray2qt(edged)
+            contours = []
         else:
-            ax, qt_img_processed = planvec.pipeline.run_pipeline(img.copy(),
-                                                                 ax=ax,
-                                                                 config=processing_config,
-                                                                 color_ranges=color_ranges,
-                                                                 verbose=False,
-                                                                 visualize_steps=False)
-        return ax, qt_img_processed
+            ax, qt_img_processed, contours = planvec.pipeline.run_pipeline(img if buffer_pool is not None else img.copy(),
+                                                                           ax=ax,
+                                                                           config=processing_config,
+                                                                           color_ranges=color_ranges,
+                                                                           verbose=False,
+                                                                           visualize_steps=False,
+                                                                           return_contours=True,
+                                                                           preview_renderer=preview_renderer,
+                                                                           tracker=tracker,
+                                                                           calibration=calibration,
+                                                                           buffer_pool=buffer_pool,
+                                                                           frame_trace=frame_trace)
+        return ax, qt_img_processed, contours
 
     def run(self) -> None:
+        if self.trace_recorder is not None:
+            self.trace_recorder.register_thread_name('ImgProcessThread')
+        self._display_buffers_free = threading.Semaphore(self.n_display_buffers)
+        if self.processing_config.get('pipeline_workers', 0) > 0:
+            self._run_with_process_pool()
+            return
+        if self.processing_config.get('staged_pipeline', False):
+            self._run_staged()
+            return
         frame_rate_counter = FrameRateCounter(buffer_size=1)
-        while True:
-            if not self.stopped:
-                bgr_frame = self.frame_buffer.get()
-                self.out_ax, self.curr_qt_img_out = self.process_frame(bgr_frame,
-                                                                       processing_config=self.processing_config,
-                                                                       color_ranges=self.color_ranges,
-                                                                       do_canny=self.do_canny,
-                                                                       ax=self.out_ax)
-                self.curr_qt_img_input = conversions.bgr2qt(bgr_frame)
-                self.change_pixmap_signal.emit(self.curr_qt_img_input, self.curr_qt_img_out)
-                frame_rate_counter.event_happened()
-                self.frame_rate_signal.emit(f'Frame rate (last {frame_rate_counter.buffer_size} frames): '
-                                            f'{round(frame_rate_counter.get_frame_rate(), 2)}')
+        while self.wait_while_paused():
+            try:
+                frame, frame_trace = self.frame_buffer.get(timeout=FRAME_WAIT_TIMEOUT_S)
+            except queue.Empty:
+                continue
+            if frame_trace is not None:
+                frame_trace.span_since_mark('frame_buffer_wait', 'enqueued')
+            if isinstance(frame, FrameSlot):  # the pipeline works on the view of the shared slot, nothing is copied
+                try:
+                    self._process_and_emit(frame.array, frame_trace, frame_rate_counter)
+                finally:
+                    frame.release()
+            else:
+                self._process_and_emit(frame, frame_trace, frame_rate_counter)
+
+    def _process_and_emit(self, bgr_frame, frame_trace: FrameTrace, frame_rate_counter: FrameRateCounter) -> None:
+        """Processes a frame on this thread and sends the result to the GUI."""
+        if not self._acquire_display_buffers():
+            return
+        self.out_ax, self.curr_qt_img_out, self.curr_contours = self.process_frame(
+            bgr_frame,
+            processing_config=self.processing_config,
+            color_ranges=self.color_ranges,
+            do_canny=self.do_canny,
+            ax=self.out_ax,
+            preview_renderer=self.preview_renderer,
+            tracker=self.tracker,
+            calibration=self.calibration,
+            buffer_pool=self.buffer_pool,
+            frame_trace=frame_trace)
+        with trace_span(frame_trace, 'input_to_qt'):
+            self.curr_qt_img_input = conversions.bgr2qt(bgr_frame, dst=self._display_buffer('input_rgb', bgr_frame))
+        self._emit(frame_trace, frame_rate_counter)
+
+    def _emit(self, frame_trace: FrameTrace, frame_rate_counter: FrameRateCounter) -> None:
+        if frame_trace is not None:
+            frame_trace.mark('emitted')  # the GUI thread owns the trace after the emit
+        self.change_pixmap_signal.emit(self.curr_qt_img_input, self.curr_qt_img_out, frame_trace)
+        frame_rate_counter.event_happened()
+        METRICS.inc('frames_processed', help_text='Frames processed and sent to the GUI.')
+        self.frame_rate_signal.emit(f'Frame rate (last {frame_rate_counter.buffer_size} frames): '
+                                    f'{round(frame_rate_counter.get_frame_rate(), 2)}'
+                                    f'{self._status_info()}')
+
+    def _run_with_process_pool(self) -> None:
+        """Run loop of the multiprocessing backend (see planvec.pipeline_pool): frames are handed to the worker
+        processes as long as they have free slots and the results are sent to the GUI in the order of the frames.
+        Canny edge detection is cheap and runs on this thread."""
+        preview_size = (DEFAULT_POOL_PREVIEW_SIZE if self.preview_renderer is None
+                        else self.preview_renderer.display_size)
+        self.process_pool = PipelineProcessPool(self.processing_config.pipeline_workers, self.processing_config,
+                                                self.color_ranges, preview_size, calibration=self.calibration).start()
+        if self.trace_recorder is not None:
+            for worker_idx, worker_pid in enumerate(self.process_pool.worker_pids):
+                self.trace_recorder.register_thread_name(f'PipelineWorker-{worker_idx}', thread_id=worker_pid)
+        frame_rate_counter = FrameRateCounter(buffer_size=1)
+        try:
+            while self.wait_while_paused():
+                pool = self.process_pool
+                # While frames are in flight, canny frames wait such that the output stays in order
+                if pool.can_submit() and not (self.do_canny and pool.n_in_flight > 0):
+                    try:
+                        frame, frame_trace = self.frame_buffer.get(
+                            timeout=POOL_POLL_TIMEOUT_S if pool.n_in_flight > 0 else FRAME_WAIT_TIMEOUT_S)
+                    except queue.Empty:
+                        frame, frame_trace = None, None
+                    if frame is not None:
+                        if frame_trace is not None:
+                            frame_trace.span_since_mark('frame_buffer_wait', 'enqueued')
+                        frame_slot = frame if isinstance(frame, FrameSlot) else self._copy_into_submit_ring(frame)
+                        try:
+                            if self.do_canny:
+                                self._process_and_emit(frame_slot.array, frame_trace, frame_rate_counter)
+                            else:
+                                with trace_span(frame_trace, 'submit'):
+                                    pool.submit(frame_slot, frame_trace)  # the pool retains the slot
+                        finally:
+                            frame_slot.release()
+                for result in pool.collect(timeout=0 if pool.can_submit() else POOL_POLL_TIMEOUT_S):
+                    self._emit_pool_result(result, frame_rate_counter)
+        finally:
+            self.process_pool, pool = None, self.process_pool
+            pool.close()
+            if self._submit_ring is not None:
+                self._submit_ring.retire()
+                self._submit_ring = None
+
+    def _copy_into_submit_ring(self, bgr_frame: np.ndarray) -> FrameSlot:
+        """Copies a frame which the capture thread did not read into a shared frame ring into a slot of the pool's
+        own ring. The ring has a slot for every frame in flight and the one being submitted."""
+        if self._submit_ring is None or self._submit_ring.frame_shape != bgr_frame.shape:
+            if self._submit_ring is not None:
+                self._submit_ring.retire()
+            self._submit_ring = SharedFrameRing(self.process_pool.n_slots + 1, bgr_frame.shape)
+        frame_slot = self._submit_ring.acquire(timeout=0)
+        np.copyto(frame_slot.array, bgr_frame)
+        return self._submit_ring.publish(frame_slot)
+
+    def _run_staged(self) -> None:
+        """Run loop of the staged execution mode (see planvec.pipeline_stages): frames are handed to the stage
+        threads as long as the rectify queue has room and the results are sent to the GUI as they come out of the
+        render stage. The input image is converted on this thread before a frame is submitted, such that the frame
+        slot is only held until the frame is rectified."""
+        self.staged_pipeline = StagedPipeline(self.processing_config, self.color_ranges,
+                                              preview_renderer=self.preview_renderer, ax=self.out_ax,
+                                              tracker=self.tracker, calibration=self.calibration,
+                                              queue_size=self.processing_config.get('stage_queue_size',
+                                                                                    DEFAULT_QUEUE_SIZE),
+                                              trace_recorder=self.trace_recorder).start()
+        # Frames in flight hold their input display buffer and possibly a rendered preview already
+        self.n_display_buffers = N_DISPLAY_BUFFERS + self.staged_pipeline.max_in_flight
+        self._display_buffers_free = threading.Semaphore(self.n_display_buffers)
+        if self.preview_renderer is not None:
+            self.preview_renderer.set_n_buffers(self.n_display_buffers)
+        frame_rate_counter = FrameRateCounter(buffer_size=1)
+        try:
+            while self.wait_while_paused():
+                pipeline = self.staged_pipeline
+                # While frames are in flight, canny frames wait such that the output stays in order
+                if pipeline.can_submit() and not (self.do_canny and pipeline.n_in_flight > 0):
+                    try:
+                        frame, frame_trace = self.frame_buffer.get(
+                            timeout=POOL_POLL_TIMEOUT_S if pipeline.n_in_flight > 0 else FRAME_WAIT_TIMEOUT_S)
+                    except queue.Empty:
+                        frame, frame_trace = None, None
+                    if frame is not None:
+                        if frame_trace is not None:
+                            frame_trace.span_since_mark('frame_buffer_wait', 'enqueued')
+                        bgr_frame = frame.array if isinstance(frame, FrameSlot) else frame
+                        try:
+                            if self.do_canny:
+                                self._process_and_emit(bgr_frame, frame_trace, frame_rate_counter)
+                            elif self._acquire_display_buffers():
+                                with trace_span(frame_trace, 'input_to_qt'):
+                                    qt_img_input = conversions.bgr2qt(bgr_frame, dst=self._display_buffer('input_rgb',
+                                                                                                          bgr_frame))
+                                pipeline.submit(frame, frame_trace, qt_img_input)  # retains a frame slot
+                        finally:
+                            if isinstance(frame, FrameSlot):
+                                frame.release()
+                            del bgr_frame
+                for result in pipeline.collect(timeout=0 if pipeline.can_submit() else POOL_POLL_TIMEOUT_S):
+                    self._emit_staged_result(result, frame_rate_counter)
+        finally:
+            self.staged_pipeline, pipeline = None, self.staged_pipeline
+            pipeline.close()
+
+    def _emit_staged_result(self, result: StagedResult, frame_rate_counter: FrameRateCounter) -> None:
+        if result.error is not None:
+            print(f'Pipeline stage failed:\n{result.error}')
+            self._display_buffers_free.release()  # nothing is emitted for the frame
+            return
+        if self.buffer_pool is not None:
+            self.buffer_pool.begin_frame()  # only the display buffers are pooled on this thread
+        self.out_ax = self.staged_pipeline.ax
+        self.curr_qt_img_input, self.curr_qt_img_out, self.curr_contours = (result.qt_img_input, result.qt_img_out,
+                                                                            result.contours)
+        self._emit(result.frame_trace, frame_rate_counter)
+
+    def _emit_pool_result(self, result: PoolResult, frame_rate_counter: FrameRateCounter) -> None:
+        """Converts the input frame and preview of a worker result for the GUI and frees the result's slot."""
+        if not self._acquire_display_buffers():
+            self.process_pool.release(result)
+            return
+        if self.buffer_pool is not None:
+            self.buffer_pool.begin_frame()  # only the display buffers are pooled on this thread
+        frame_trace = result.frame_trace
+        if frame_trace is not None:
+            for name, start_ns, end_ns in result.spans:
+                frame_trace.add_span(name, start_ns, end_ns, thread_id=result.worker_pid)
+        if result.status == STATUS_ERROR:
+            print(f'Pipeline worker failed:\n{result.error}')
+        with trace_span(frame_trace, 'input_to_qt'):
+            self.curr_qt_img_input = conversions.bgr2qt(result.frame,
+                                                        dst=self._display_buffer('input_rgb', result.frame))
+            if result.status == STATUS_OK:
+                preview = self._display_buffer('preview_rgb', result.preview)
+                if preview is None:
+                    preview = result.preview.copy()
+                else:
+                    np.copyto(preview, result.preview)
+                self.curr_qt_img_out = conversions.rgb2qt(preview)
+            else:  # like run_pipeline, show the unrectified frame if the red dots were not found
+                self.curr_qt_img_out = conversions.bgr2qt(result.frame, dst=self._display_buffer('output_rgb',
+                                                                                                  result.frame))
+        self.curr_contours = result.contours
+        self.process_pool.release(result)
+        self._emit(frame_trace, frame_rate_counter)
+
+    def _display_buffer(self, name: str, img):
+        """Pooled buffer with the shape and dtype of img for an image sent to the GUI. The GUI thread copies the
+        emitted QImages asynchronously, so the n_display_buffers buffers of a name are used round robin like the ones
+        of the PreviewRenderer, see acknowledge_frame."""
+        if self.buffer_pool is None:
+            return None
+        display_slot = (self._display_slots.get(name, -1) + 1) % self.n_display_buffers
+        self._display_slots[name] = display_slot
+        return self.buffer_pool.like(f'{name}_{display_slot}', img)
+
+    def _status_info(self) -> str:
+        info = (f' | Frames: {self.frame_buffer.n_put} captured, {self.frame_buffer.n_dropped} dropped, '
+                f'{self.frame_buffer.n_consumed} processed')
+        if self.calibration is not None:
+            info += (f' | Calibration: {"valid" if self.calibration.valid else "invalid"}, '
+                     f'{self.calibration.n_check_failures}/{self.calibration.n_checks} checks failed')
+        if self.process_pool is not None:
+            info += f' | Workers: {self.process_pool.n_workers}, {self.process_pool.n_in_flight} frames in flight'
+        elif self.staged_pipeline is not None:
+            queue_depths = self.staged_pipeline.queue_depths()
+            info += ' | Stage queues: ' + ', '.join(f'{stage} {queue_depths[stage]}/{self.staged_pipeline.queue_size}'
+                                                    for stage in STAGES)
+        elif self.tracker is not None:
+            info += (f' | Dot tracking: {self.tracker.n_tracking_hits} hits, '
+                     f'{self.tracker.n_tracking_misses} misses, {self.tracker.n_full_searches} full searches')
+        if self.buffer_pool is not None:
+            info += (f' | Buffers: {self.buffer_pool.n_buffers} ({self.buffer_pool.pooled_bytes / 2 ** 20:.1f} MB), '
+                     f'pool misses last frame: {self.buffer_pool.frame_miss_bytes / 2 ** 10:.0f} kB')
+        return info
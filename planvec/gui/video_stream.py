@@ -1,47 +1,213 @@
 import queue
+import threading
+from pathlib import Path
 
-import cv2
-from PyQt5 import QtCore
+import numpy as np
 from dotmap import DotMap
 
+from planvec.frame_ring import FrameSlot, SharedFrameRing
+from planvec.frame_sources import CameraSource, FrameRecorder, FrameSource, create_frame_source, read_into_dst
+from planvec.gui.pausable_thread import PausableThread
+from planvec.utils.metrics import METRICS
+from planvec.utils.tracing import TraceRecorder, trace_span
 
-class FrameBuffer(queue.Queue):
-    """Queue to hold frames. Gets filled up by a thread grabbing frames from the camera while processing functions
-    might dequeue frames from the queue."""
+from typing import Optional
 
-    def __init__(self, max_size=1):
-        super().__init__(maxsize=max_size)
+RING_ACQUIRE_TIMEOUT_S = 0.1  # wait for a free frame slot at most this long before checking for a stop request
 
 
-class VideoStreamThread(QtCore.QThread):
-    """Grab images from video stream thread and put them into the frame buffer queue."""
+class FrameBuffer:
+    """Mailbox holding the newest frame only. The thread grabbing frames from the camera puts every frame without
+    blocking and overwrites a frame which has not been processed yet, such that the processing thread always gets the
+    freshest frame instead of a stale one. Items are (bgr_frame, frame_trace) tuples, frame_trace is a
+    planvec.utils.tracing.FrameTrace or None if tracing is disabled. bgr_frame is a planvec.frame_ring.FrameSlot if
+    the capture thread uses a shared frame ring, the buffer releases the slot of an overwritten frame and the
+    consumer releases the slot of a frame it took.
 
-    def __init__(self, frame_buffer: FrameBuffer, video_config: DotMap, camera_map: dict, parent=None):
+    Counters: n_put frames were put, n_dropped of them were overwritten before being taken and n_consumed were taken.
+    """
+
+    def __init__(self) -> None:
+        self._item = None
+        self._condition = threading.Condition()
+        self.n_put = 0
+        self.n_dropped = 0
+        self.n_consumed = 0
+
+    def put(self, item: tuple) -> None:
+        with self._condition:
+            if self._item is not None:
+                self.n_dropped += 1
+                METRICS.inc('frames_dropped', help_text='Frames overwritten in the frame buffer before they were '
+                                                        'processed.')
+                _release_item(self._item)
+            self._item = item
+            self.n_put += 1
+            self._condition.notify()
+
+    def get(self, timeout: float = None) -> tuple:
+        """Takes the newest frame, waits for one at most timeout seconds (forever if None). Raises queue.Empty if
+        there was none, like queue.Queue.get."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._item is not None, timeout=timeout):
+                raise queue.Empty
+            item, self._item = self._item, None
+            self.n_consumed += 1
+            return item
+
+    def clear(self) -> None:
+        """Drops the waiting frame, e.g. after the threads stopped."""
+        with self._condition:
+            if self._item is not None:
+                _release_item(self._item)
+            self._item = None
+
+    def qsize(self) -> int:
+        """Number of frames waiting, 0 or 1."""
+        return int(self._item is not None)
+
+    def stats(self) -> dict:
+        return {'put': self.n_put, 'dropped': self.n_dropped, 'consumed': self.n_consumed}
+
+
+def _release_item(item: tuple) -> None:
+    if isinstance(item[0], FrameSlot):
+        item[0].release()
+
+
+class VideoStreamThread(PausableThread):
+    """Grab images from a frame source and put them into the frame buffer queue. The frame source is a live camera by
+    default, or a recorded video or image directory (see planvec.frame_sources). Frames can be recorded to a video
+    file while they are grabbed.
+
+    With frame_ring_slots > 0 the frames are read in place into the slots of a shared memory frame ring (see
+    planvec.frame_ring) instead of a new array per frame, and passed on as FrameSlot. The ring is created for the size
+    of the first frame and replaced if the size changes."""
+
+    def __init__(self, frame_buffer: FrameBuffer, video_config: DotMap, camera_map: dict,
+                 trace_recorder: TraceRecorder = None, frame_source: FrameSource = None, frame_ring_slots: int = 0,
+                 parent=None):
         super().__init__(parent=parent)
         print(f"Initializing video stream with config: {video_config}")
         self.frame_buffer = frame_buffer
         self.video_config = video_config
         self.camera_map = camera_map
-        self.stopped = False
-        self.capture_device = None
+        self.trace_recorder = trace_recorder
+        self.frame_source = frame_source
+        # A source set while the thread runs is swapped in by the thread between two reads, see set_frame_source
+        self._pending_frame_source = None
+        self._frame_source_lock = threading.Lock()
+        self._capturing = False
+        self.frame_recorder = None
+        self._recorder_lock = threading.Lock()
+        self.frame_ring_slots = frame_ring_slots
+        self.frame_ring = None
 
     def run(self) -> None:
-        camera_running_index_to_initialize_with = 1
-        camera_device_index = self.camera_map[camera_running_index_to_initialize_with]
-        print(f"Initializing to first camera {camera_running_index_to_initialize_with} "
-              f"which has device index {camera_device_index}")
-        self.set_capture_device(camera_device_index)
-
-        while True:
-            if not self.stopped:
-                ret, bgr_frame = self.capture_device.read()  # frame is BGR since OpenCV format
-                if ret:
-                    self.frame_buffer.put(bgr_frame)
+        if self.frame_source is None:
+            camera_running_index_to_initialize_with = 1
+            camera_device_index = self.camera_map.get(camera_running_index_to_initialize_with)
+            if self.video_config.get('source', 'camera') == 'camera':
+                print(f"Initializing to first camera {camera_running_index_to_initialize_with} "
+                      f"which has device index {camera_device_index}")
+            self.frame_source = create_frame_source(self.video_config, camera_device_index)
+        if self.trace_recorder is not None:
+            self.trace_recorder.register_thread_name('VideoStreamThread')
+        with self._frame_source_lock:
+            self._capturing = True
+
+        while self.wait_while_paused():
+            self._swap_in_pending_frame_source()
+            frame_source = self.frame_source
+            if frame_source.finished:
+                self.msleep(100)  # replay is over, the GUI keeps showing the last frame
+                continue
+            frame_trace = self.trace_recorder.new_frame() if self.trace_recorder is not None else None
+            with trace_span(frame_trace, 'capture'):
+                if self.frame_ring_slots > 0:
+                    frame_slot = self._read_into_ring(frame_source)
+                    ret, bgr_frame = frame_slot is not None, frame_slot
+                else:
+                    ret, bgr_frame = frame_source.read()  # frame is BGR since OpenCV format
+            if ret:
+                METRICS.inc('frames_captured', help_text='Frames read from the camera.')
+                with self._recorder_lock:
+                    if self.frame_recorder is not None:
+                        self.frame_recorder.write(bgr_frame.array if self.frame_ring_slots > 0 else bgr_frame)
+                if frame_trace is not None:
+                    frame_trace.mark('enqueued')  # before put, the consumer owns the trace afterwards
+                self.frame_buffer.put((bgr_frame, frame_trace))  # never blocks, overwrites an unprocessed frame
+            else:
+                self.msleep(10)  # e.g. the camera is disconnected, do not spin on failing reads
+        with self._frame_source_lock:
+            self._capturing = False
+        self._swap_in_pending_frame_source()
+        self.frame_source.release()
+        if self.frame_ring is not None:
+            self.frame_ring.retire()  # freed once the consumers released their frames
+
+    def _read_into_ring(self, frame_source: FrameSource) -> Optional[FrameSlot]:
+        """Reads the next frame in place into a free slot of the frame ring. Returns the published slot, or None if
+        there was no frame or all slots stayed in use."""
+        if self.frame_ring is None:
+            ret, bgr_frame = frame_source.read()  # the first frame tells the size of the ring
+            return self._copy_into_new_ring(bgr_frame) if ret else None
+        frame_slot = self.frame_ring.acquire(timeout=RING_ACQUIRE_TIMEOUT_S)
+        if frame_slot is None:
+            METRICS.inc('frame_ring_full', help_text='Frame reads skipped since all frame ring slots were in use.')
+            return None
+        ret, bgr_frame = frame_source.read(dst=frame_slot.array)
+        if ret and read_into_dst(bgr_frame, frame_slot.array):
+            return self.frame_ring.publish(frame_slot)
+        frame_slot.release()
+        return self._copy_into_new_ring(bgr_frame) if ret else None  # the frame size changed, e.g. other camera
+
+    def _copy_into_new_ring(self, bgr_frame: np.ndarray) -> FrameSlot:
+        if self.frame_ring is not None:
+            self.frame_ring.retire()
+        self.frame_ring = SharedFrameRing(self.frame_ring_slots, bgr_frame.shape)
+        print(f'Frame ring of {self.frame_ring_slots} slots for {bgr_frame.shape[1]}x{bgr_frame.shape[0]} frames.')
+        frame_slot = self.frame_ring.acquire(timeout=0)
+        np.copyto(frame_slot.array, bgr_frame)
+        return self.frame_ring.publish(frame_slot)
+
+    def set_frame_source(self, frame_source: FrameSource) -> None:
+        """Replaces the frame source. While the thread runs, the source is handed to it and swapped in before its
+        next read, such that the previous source is never released during a read on the capture thread."""
+        with self._frame_source_lock:
+            if self._capturing:
+                superseded_frame_source, self._pending_frame_source = self._pending_frame_source, frame_source
+            else:
+                superseded_frame_source, self.frame_source = self.frame_source, frame_source
+        if superseded_frame_source is not None:
+            superseded_frame_source.release()  # a pending source is not in use yet, released on any thread
+
+    def _swap_in_pending_frame_source(self) -> None:
+        """Called by the capture thread between two reads."""
+        with self._frame_source_lock:
+            pending_frame_source, self._pending_frame_source = self._pending_frame_source, None
+        if pending_frame_source is not None:
+            previous_frame_source, self.frame_source = self.frame_source, pending_frame_source
+            if previous_frame_source is not None:
+                previous_frame_source.release()
 
     def set_capture_device(self, camera_device_index: int) -> None:
-        self.capture_device = cv2.VideoCapture(camera_device_index)
-        self.capture_device.set(cv2.CAP_PROP_FRAME_WIDTH, self.video_config.max_input_width)
-        self.capture_device.set(cv2.CAP_PROP_FRAME_HEIGHT, self.video_config.max_input_height)
+        self.set_frame_source(CameraSource(camera_device_index, self.video_config.max_input_width,
+                                           self.video_config.max_input_height))
+
+    def start_recording(self, video_path: Path) -> None:
+        """Records all grabbed frames with their capture times, see planvec.frame_sources.FrameRecorder."""
+        self.stop_recording()
+        with self._recorder_lock:
+            self.frame_recorder = FrameRecorder(video_path)
+        print(f'Recording frames to {video_path}.')
+
+    def stop_recording(self) -> None:
+        with self._recorder_lock:
+            if self.frame_recorder is not None:
+                self.frame_recorder.close()
+            self.frame_recorder = None
 
-    def toggle_stopped(self):
-        self.stopped = not self.stopped
+    @property
+    def recording(self) -> bool:
+        return self.frame_recorder is not None
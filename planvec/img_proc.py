@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import skimage
 import skimage.measure
 import cv2 as cv
+from collections import namedtuple
 from functools import reduce
 import operator
 import math
@@ -11,11 +12,24 @@ from time import time
 import planvec.vizualization
 from planvec.utils.timing import timeit
 from planvec.color_range import HSVColorRange
+from planvec.color_classifier import get_hsv_range_classifier, WHITE
+from planvec.frame_context import FrameContext, as_frame_context
+from planvec.utils.metrics import METRICS
 
-from typing import List
+from typing import List, Union
 
 DEBUG_BARS = 5 * '-'
 
+CONTOUR_ENGINES = ('skimage', 'opencv')
+DEFAULT_CONTOUR_ENGINE = 'opencv'  # same as the processing config
+
+# Compact per-region statistics as returned by find_connected_regions. For n regions:
+#   labels:    (n,)   label of the region in the connected components image
+#   areas:     (n,)   number of pixels
+#   bboxes:    (n, 4) (min_row, min_col, max_row, max_col), max exclusive, same convention as skimage's regionprops
+#   centroids: (n, 2) (row, col)
+RegionStats = namedtuple('RegionStats', ['labels', 'areas', 'bboxes', 'centroids'])
+
 
 @timeit
 def copy_img(img):
@@ -23,20 +37,20 @@ def copy_img(img):
 
 
 @timeit
-def img_to_greyscale(img):
-    return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+def img_to_greyscale(img, dst=None):
+    return cv.cvtColor(img, cv.COLOR_BGR2GRAY, dst=dst)
 
 
 @timeit
-def add_gaussian_blur(img, std_x, std_y):
-    return cv.GaussianBlur(img, (std_x, std_y), sigmaX=0)
+def add_gaussian_blur(img, std_x, std_y, dst=None):
+    return cv.GaussianBlur(img, (std_x, std_y), sigmaX=0, dst=dst)
 
 
 @timeit
-def thresh_img(img, thresh_val, max_val, thresh_type=cv.THRESH_BINARY):
+def thresh_img(img, thresh_val, max_val, thresh_type=cv.THRESH_BINARY, dst=None):
     """Apply threshold to pixel values from an image. Refer to
-    https://docs.opencv.org/2.4/doc/tutorials/imgproc/threshold/threshold.html for docs."""
-    _, img = cv.threshold(img, thresh_val, max_val, thresh_type)
+    https://docs.opencv.org/2.4/doc/tutorials/imgproc/threshold/threshold.html for docs. dst may be img itself."""
+    _, img = cv.threshold(img, thresh_val, max_val, thresh_type, dst=dst)
     return img
 
 
@@ -47,44 +61,84 @@ def invert_mask(mask):
 
 
 @timeit
-def create_hsv_range_mask(img, hsv_color_range: HSVColorRange):
-    """Based on a HSVColorRange, create a mask for which pixels in an input image are in this range."""
-    hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
-    return cv.inRange(hsv, np.array(hsv_color_range.start), np.array(hsv_color_range.end))
+def create_hsv_range_mask(img: Union[np.ndarray, FrameContext], hsv_color_range: HSVColorRange, dst=None):
+    """Based on a HSVColorRange, create a mask for which pixels in an input image are in this range. The input can be
+    a BGR image or a FrameContext, whose HSV conversion is then shared with other stages."""
+    frame = as_frame_context(img)
+    return cv.inRange(frame.hsv, np.array(hsv_color_range.start), np.array(hsv_color_range.end), dst=dst)
 
 
 @timeit
-def filter_keep_by_hsv_range(img, hsv_color_range: HSVColorRange):
+def create_multi_hsv_ranges_mask(img: Union[np.ndarray, FrameContext], hsv_color_ranges: List[HSVColorRange],
+                                 dst=None):
+    """Mask of all pixels which fall into any of the hsv color ranges. If the HSV planes of the frame are already
+    available they are used directly, else the BGR frame is classified through the cached lookup table of
+    planvec.color_classifier without any HSV conversion."""
+    frame = as_frame_context(img)
+    if dst is None:
+        dst = np.empty(frame.shape[:2], dtype=np.uint8)
+    if not frame.has_hsv:
+        return get_hsv_range_classifier(hsv_color_ranges).mask(frame.bgr, dst=dst)
+    dst[...] = 0
+    range_mask = frame.buffer('range_mask', frame.shape[:2])
+    for hsv_color_range in hsv_color_ranges:
+        cv.bitwise_or(dst, create_hsv_range_mask(frame, hsv_color_range, dst=range_mask), dst=dst)
+    return dst
+
+
+@timeit
+def filter_keep_by_hsv_range(img: Union[np.ndarray, FrameContext], hsv_color_range: HSVColorRange):
     """Returns an image where only pixels are kept with their values which fall into a HSV range between
     range_start, e.g. [0, 0, 0] and range_end, e.g. [179, 255, 255] or any values in-between those bounds."""
-    mask = create_hsv_range_mask(img, hsv_color_range)
-    return cv.bitwise_and(img, img, mask=mask)
+    frame = as_frame_context(img)
+    mask = create_hsv_range_mask(frame, hsv_color_range)
+    return cv.bitwise_and(frame.bgr, frame.bgr, mask=mask)
 
 
 @timeit
-def filter_keep_multi_ranges(img, hsv_color_ranges: List[HSVColorRange]):
+def filter_keep_multi_ranges(img: Union[np.ndarray, FrameContext], hsv_color_ranges: List[HSVColorRange]):
     """Same as filter_keep_by_hsv_range but for multiple hsv color ranges."""
-    masks = [create_hsv_range_mask(img, hsv_color_range) for hsv_color_range in hsv_color_ranges]
-    final_mask = sum(masks)
-    return cv.bitwise_and(img, img, mask=final_mask)
+    frame = as_frame_context(img)
+    final_mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+    for hsv_color_range in hsv_color_ranges:
+        cv.bitwise_or(final_mask, create_hsv_range_mask(frame, hsv_color_range), dst=final_mask)
+    return cv.bitwise_and(frame.bgr, frame.bgr, mask=final_mask)
 
 
 @timeit
-def filter_by_hsv_range_to_white(img, hsv_color_range: HSVColorRange):
+def filter_by_hsv_range_to_white(img: Union[np.ndarray, FrameContext], hsv_color_range: HSVColorRange):
     """Pixels of the input image will be set to white is they are within the hsv color range."""
-    img = copy_img(img)
-    mask = planvec.img_proc.create_hsv_range_mask(img, hsv_color_range)
+    frame = as_frame_context(img)
+    mask = planvec.img_proc.create_hsv_range_mask(frame, hsv_color_range)
+    img = copy_img(frame.bgr)
     img[mask > 0] = 255
     return img
 
 
 @timeit
-def filter_multi_hsv_ranges_to_white(img, hsv_color_ranges: List[HSVColorRange]):
-    """Same as filter_by_hsv_range_to_white but for multiple hsv color ranges."""
-    img = copy_img(img)
-    for hsv_color_range in hsv_color_ranges:
-        img = filter_by_hsv_range_to_white(img, hsv_color_range)
-    return img
+def filter_multi_hsv_ranges_to_white(img: Union[np.ndarray, FrameContext], hsv_color_ranges: List[HSVColorRange],
+                                     dst=None):
+    """Same as filter_by_hsv_range_to_white but for multiple hsv color ranges. All ranges are applied in a single
+    pass, either on the HSV planes of a FrameContext or through a cached lookup table (see
+    planvec.color_classifier). The result is written into dst, which may be the input image itself to filter in
+    place. If dst is None, a new image is returned and the input is left untouched."""
+    frame = as_frame_context(img)
+    if not frame.has_hsv:
+        return get_hsv_range_classifier(hsv_color_ranges).filter_to_white(frame.bgr, dst=dst)
+    mask = create_multi_hsv_ranges_mask(frame, hsv_color_ranges)
+    return mask_to_white(frame.bgr, mask, dst=dst)
+
+
+@timeit
+def mask_to_white(img, mask, dst=None):
+    """Sets all pixels of a BGR image to white where the 8-bit mask is non-zero. The result is written into dst,
+    which may be img itself. If dst is None, a new image is returned."""
+    if dst is None:
+        dst = copy_img(img)
+    elif dst is not img:
+        np.copyto(dst, img)
+    cv.bitwise_or(dst, WHITE, dst=dst, mask=mask)
+    return dst
 
 
 @timeit
@@ -102,9 +156,49 @@ def adaptive_thresh_img(img):
 
 
 @timeit
-def find_contours(img, level):
-    contours = skimage.measure.find_contours(img, level=level)
-    return contours
+def find_contours(img, level, engine=DEFAULT_CONTOUR_ENGINE, dst=None):
+    """Find the iso-valued contours of an image at a given level. Contours are returned as a list of (n, 2) float
+    arrays of (row, col) coordinates, closed contours repeat their first point at the end.
+
+    engine selects the implementation, see CONTOUR_ENGINES:
+        'skimage': skimage.measure.find_contours, sub-pixel accurate but slow on large images
+        'opencv':  cv.findContours on the binary image img > level, see find_contours_cv, the binary image is written
+                   into dst (8-bit, shape of img) if given
+
+    On a binary mask at level 0 (as in the pipeline) the engines differ by one pixel: OpenCV contours run through the
+    centers of the outermost pixels of a region, skimage contours through the centers of the background pixels next
+    to it, since values equal to the level count as outside. The pixel edge lies half way between, i.e. OpenCV
+    outlines are 0.5 px inside and skimage outlines 0.5 px outside of it, holes the other way around. With the
+    default rectify_shape a pixel is about 0.1 mm of a 20 cm wide drawing, so the offset is not corrected.
+    """
+    if engine == 'opencv':
+        contours, _ = find_contours_cv(cv.compare(img, level, cv.CMP_GT, dst=dst))
+        return contours
+    elif engine == 'skimage':
+        return skimage.measure.find_contours(img, level=level)
+    raise ValueError(f'Contour engine {engine} not supported, choose one of {CONTOUR_ENGINES}.')
+
+
+@timeit
+def find_contours_cv(binary_img):
+    """Trace the outlines of the non-zero regions of an 8-bit binary image with cv.findContours (RETR_CCOMP).
+
+    Returns
+    -------
+        (contours, parents): contours as list of closed (n, 2) float arrays of (row, col) coordinates and for each
+                             contour the index of its enclosing outer contour, -1 for outer contours, e.g. holes
+                             are the contours with parents >= 0
+    """
+    # OpenCV 3 returns (image, contours, hierarchy), OpenCV 4 (contours, hierarchy)
+    cv_contours, hierarchy = cv.findContours(binary_img, cv.RETR_CCOMP, cv.CHAIN_APPROX_NONE)[-2:]
+    if hierarchy is None:
+        return [], np.empty(0, dtype=np.int32)
+    contours = []
+    for cv_contour in cv_contours:
+        points = cv_contour[:, 0, ::-1].astype(np.float64)  # (x, y) -> (row, col)
+        contours.append(np.concatenate([points, points[:1]]))
+    parents = hierarchy[0][:, 3]
+    return contours, parents
 
 
 @timeit
@@ -114,20 +208,66 @@ def filter_contours_by_size(contours, n_points_thresh):
 
 @timeit
 def find_regions(img, area_threshold, intens_threshold):
-    """Use skimage's region finding capabilities to find connected regions in an image.
+    """Find connected bright regions in a BGR image, see find_connected_regions.
 
-    #TODO: specify args and returns
+    Arguments
+    ---------
+        img: BGR input image
+        area_threshold: regions with less pixels are dropped
+        intens_threshold: grey value above which a pixel counts as foreground
+    Returns
+    -------
+        (regions_mask, regions): 8-bit mask of all kept regions and their RegionStats
     """
     # Threshold processing
     img = planvec.img_proc.img_to_greyscale(img)
     img = planvec.img_proc.add_gaussian_blur(img, std_x=3, std_y=3)
     img_thresh = planvec.img_proc.thresh_img(img, thresh_val=intens_threshold, max_val=255, thresh_type=cv.THRESH_BINARY)
-    labelled_img, n = skimage.measure.label(img_thresh, background=0, return_num=True)
-    regions = skimage.measure.regionprops(labelled_img)
-    # Filtering regions
-    img_labelled_proc, filtered_regions = planvec.img_proc.filter_regions(labelled_img, regionprops=regions,
-                                                                          area_threshold=area_threshold)
-    return img_labelled_proc, filtered_regions
+    return planvec.img_proc.find_connected_regions(img_thresh, area_threshold=area_threshold)
+
+
+@timeit
+def find_connected_regions(binary_img, area_threshold, connectivity=8, dst=None, labels_dst=None, index_dst=None):
+    """Label the connected non-zero regions of an 8-bit binary image and filter them in one go. Dropped are regions
+    which are too small (basically noise) and regions whose bounding box spans the whole image since they represent
+    the background (sheet) rather than a drawing.
+
+    Filtering is done on the statistics of cv.connectedComponentsWithStats only, the kept regions are then painted
+    with a single label -> keep lookup over the label image. The mask is written into dst (8-bit) and the label image
+    into labels_dst (int32) if given. index_dst (intp) takes the labels as lookup indices, without it np.take converts
+    them into a temporary array. All buffers have the shape of binary_img.
+
+    Returns
+    -------
+        (regions_mask, regions): 8-bit mask which is 255 for all kept regions and their RegionStats
+    """
+    n_labels, labelled_img, stats, centroids = cv.connectedComponentsWithStats(binary_img, labels=labels_dst,
+                                                                               connectivity=connectivity,
+                                                                               ltype=cv.CV_32S)
+    height, width = binary_img.shape[:2]
+    areas = stats[:, cv.CC_STAT_AREA]
+    spans_image = (stats[:, cv.CC_STAT_WIDTH] == width) & (stats[:, cv.CC_STAT_HEIGHT] == height)
+    keep = (areas >= area_threshold) & ~spans_image
+    keep[0] = False  # label 0 is the background of the binary image
+
+    keep_lut = np.where(keep, 255, 0).astype(np.uint8)
+    label_indices = labelled_img
+    if index_dst is not None:
+        np.copyto(index_dst, labelled_img)
+        label_indices = index_dst
+    regions_mask = np.take(keep_lut, label_indices, out=dst, mode='clip')  # labels are valid, 'raise' buffers out
+
+    kept_labels = np.flatnonzero(keep)
+    kept_stats = stats[kept_labels]
+    min_col, min_row = kept_stats[:, cv.CC_STAT_LEFT], kept_stats[:, cv.CC_STAT_TOP]
+    bboxes = np.stack([min_row, min_col,
+                       min_row + kept_stats[:, cv.CC_STAT_HEIGHT],
+                       min_col + kept_stats[:, cv.CC_STAT_WIDTH]], axis=1)
+    regions = RegionStats(labels=kept_labels,
+                          areas=areas[kept_labels],
+                          bboxes=bboxes,
+                          centroids=centroids[kept_labels][:, ::-1])  # OpenCV gives (x, y)
+    return regions_mask, regions
 
 
 @timeit
@@ -168,7 +308,7 @@ def warp_image(img, src_points, dst_points, final_size, show_plot=False):
 
     Arguments
     ---------
-        img: an numpy nd-array
+        img: an numpy nd-array or a FrameContext, in which case a warped FrameContext is returned
         src_points: list of four points, a point is a list or tuple of length two (x, y), x is horizontal
         dst_points: same shape as src_points, coordinates to map the src_points to
         final_size: shape of the final image (x, y)
@@ -183,16 +323,138 @@ def warp_image(img, src_points, dst_points, final_size, show_plot=False):
                                                f'given: {len(dst_points)} and {len(src_points)}'
 
     transformation = cv.getPerspectiveTransform(src_points, dst_points)
-    warped_img = cv.warpPerspective(img, transformation, final_size)
+    return warp_image_by_transformation(img, transformation, final_size, show_plot=show_plot)
+
+
+@timeit
+def warp_image_by_transformation(img, transformation, final_size, show_plot=False):
+    """Same as warp_image but for an already computed 3x3 perspective transformation."""
+    if isinstance(img, FrameContext):
+        warped_img = img.warped(transformation, final_size)
+        img_bgr, warped_bgr = img.bgr, warped_img.bgr
+    else:
+        warped_img = cv.warpPerspective(img, transformation, final_size)
+        img_bgr, warped_bgr = img, warped_img
     if show_plot:
         plt.subplots(figsize=(15, 9))
-        plt.subplot(121), plt.imshow(cv.cvtColor(img, cv.COLOR_BGR2RGB)), plt.title('Input')
-        plt.subplot(122), plt.imshow(cv.cvtColor(warped_img, cv.COLOR_BGR2RGB)), plt.title('Output')
+        plt.subplot(121), plt.imshow(cv.cvtColor(img_bgr, cv.COLOR_BGR2RGB)), plt.title('Input')
+        plt.subplot(122), plt.imshow(cv.cvtColor(warped_bgr, cv.COLOR_BGR2RGB)), plt.title('Output')
     return warped_img
 
 
 @timeit
-def rectify_wrt_red_dots(img, dst_shape, red_color_ranges, n_dots=4, show_plot=False, verbose=False):
+def sort_points_clockwise(coords):
+    """
+    We need to sort corner_centroids such that they map correctly to the new corners.
+    1 - 4
+    |   |
+    2 - 3
+    Therefore the points are sorted by their angle around their common center, starting top left.
+    """
+    center = tuple(map(operator.truediv, reduce(lambda x, y: map(operator.add, x, y), coords), [len(coords)] * 2))
+    return sorted(coords, key=lambda coord: (-135 - math.degrees(math.atan2(*tuple(map(operator.sub, coord, center))[::-1]))) % 360)
+
+
+def rectified_corners(dst_shape):
+    """The corners of the rectified image in the order of sort_points_clockwise."""
+    return [[0, 0], [0, dst_shape[1]], [dst_shape[0], dst_shape[1]], [dst_shape[0], 0]]
+
+
+@timeit
+def find_red_dot_centroids(img, red_color_ranges, n_dots=4, pyramid_level=0, refine_radius=8):
+    """Searches the whole image for the red corner dots.
+
+    With pyramid_level > 0 the dots are searched coarse to fine: first on the image downsampled by 2**pyramid_level,
+    then each dot is refined on full resolution in a window around its upscaled bounding box. If that does not find
+    all dots, the search falls back to full resolution.
+
+    Arguments
+    ---------
+        img: input image, either BGR or a FrameContext
+        red_color_ranges: list of HSVColorRange's for red low and red high filter ranges
+        n_dots: number of dots to find, the n_dots largest red regions are taken
+        pyramid_level: 0 searches on full resolution, 2 searches on 1/4 resolution first
+        refine_radius: margin in full resolution pixels added around the upscaled bounding boxes for refinement
+    Returns
+    -------
+        corner_centroids: list of n_dots (x, y) centroids ordered by sort_points_clockwise or None if less than
+                          n_dots red regions have been found
+    """
+    if pyramid_level > 0:
+        corner_centroids = find_red_dot_centroids_coarse_to_fine(img, red_color_ranges, n_dots=n_dots,
+                                                                 pyramid_level=pyramid_level,
+                                                                 refine_radius=refine_radius)
+        if corner_centroids is not None:
+            return corner_centroids
+    img_red = filter_keep_multi_ranges(img, red_color_ranges)
+    _, regions = planvec.img_proc.find_regions(img_red, area_threshold=2, intens_threshold=10)
+    if len(regions.areas) < n_dots:
+        return None
+    largest = np.argsort(regions.areas, kind='stable')[::-1][:n_dots]  # only keep 4 largest regions
+    return sort_points_clockwise([(col, row) for row, col in regions.centroids[largest]])
+
+
+@timeit
+def find_red_dot_centroids_coarse_to_fine(img, red_color_ranges, n_dots=4, pyramid_level=2, refine_radius=8):
+    """Coarse to fine part of find_red_dot_centroids. Returns None if any dot cannot be found or refined."""
+    frame = as_frame_context(img)
+    height, width = frame.shape[:2]
+    scale = 2 ** pyramid_level
+    small_width, small_height = max(1, width // scale), max(1, height // scale)
+    small = cv.resize(frame.bgr, (small_width, small_height), interpolation=cv.INTER_AREA)
+    small_red = filter_keep_multi_ranges(small, red_color_ranges)
+    _, regions = planvec.img_proc.find_regions(small_red, area_threshold=1, intens_threshold=10)
+    if len(regions.areas) < n_dots:
+        return None
+    largest = np.argsort(regions.areas, kind='stable')[::-1][:n_dots]
+    scale_x, scale_y = width / small_width, height / small_height
+    corner_centroids = []
+    for min_row, min_col, max_row, max_col in regions.bboxes[largest]:
+        window = (max(0, int(min_col * scale_x) - refine_radius), max(0, int(min_row * scale_y) - refine_radius),
+                  min(width, int(math.ceil(max_col * scale_x)) + refine_radius),
+                  min(height, int(math.ceil(max_row * scale_y)) + refine_radius))
+        largest_region = find_largest_red_region(frame, red_color_ranges, window)
+        if largest_region is None or window_border_touched(largest_region[1], window, (width, height)):
+            return None
+        corner_centroids.append(largest_region[0])
+    return sort_points_clockwise(corner_centroids)
+
+
+def find_largest_red_region(img, red_color_ranges, window):
+    """Finds the largest red region within a window (x_min, y_min, x_max, y_max), max exclusive, of the image.
+
+    Returns
+    -------
+        ((x, y), bbox) centroid and (min_row, min_col, max_row, max_col) bounding box of the region in image
+        coordinates or None if the window is empty or contains no red region
+    """
+    frame = as_frame_context(img)
+    x_min, y_min, x_max, y_max = window
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    window_red = filter_keep_multi_ranges(FrameContext(frame.bgr[y_min:y_max, x_min:x_max]), red_color_ranges)
+    _, regions = planvec.img_proc.find_regions(window_red, area_threshold=2, intens_threshold=10)
+    if len(regions.areas) == 0:
+        return None
+    largest = int(np.argmax(regions.areas))
+    min_row, min_col, max_row, max_col = regions.bboxes[largest]
+    row, col = regions.centroids[largest]
+    return (col + x_min, row + y_min), (min_row + y_min, min_col + x_min, max_row + y_min, max_col + x_min)
+
+
+def window_border_touched(bbox, window, image_size):
+    """Whether a region's bounding box (min_row, min_col, max_row, max_col) touches the border of the window (x_min,
+    y_min, x_max, y_max), i.e. the region might extend beyond the window. Image borders do not count."""
+    min_row, min_col, max_row, max_col = bbox
+    x_min, y_min, x_max, y_max = window
+    width, height = image_size
+    return ((min_row == y_min and y_min > 0) or (min_col == x_min and x_min > 0) or
+            (max_row == y_max and y_max < height) or (max_col == x_max and x_max < width))
+
+
+@timeit
+def rectify_wrt_red_dots(img, dst_shape, red_color_ranges, n_dots=4, show_plot=False, verbose=False, tracker=None,
+                         pyramid_level=0, refine_radius=8):
     """This function assumes we have four red dots in an image which represent the convex hull in a rectangular
     shape. When taking an image the camera is likely to take the picture a little bit from the side and distortion
     effects may take place. This function rectifies the image such that the four red dots form the outer boundary
@@ -200,38 +462,38 @@ def rectify_wrt_red_dots(img, dst_shape, red_color_ranges, n_dots=4, show_plot=F
 
     Arguments
     ---------
-        img: input image
+        img: input image, either BGR or a FrameContext whose HSV planes are then reused by the dot search
         red_color_ranges: list of HSVCOlorRange's for red low and red high filter ranges
         dst_shape: tuple for size of final image, e.g. (600, 400) will give 600 pixels in x and 400 in y direction
         show_plot: if True, shows plot of before and after warping process
+        tracker: optional planvec.red_dot_tracking.RedDotTracker which follows the dots from frame to frame instead
+                 of searching the whole image every time, it needs to be set up with the same red_color_ranges
+        pyramid_level: search the dots coarse to fine, see find_red_dot_centroids (not used with a tracker)
+        refine_radius: refinement window margin, see find_red_dot_centroids (not used with a tracker)
     Returns
     -------
-        (warped, success): a warped version of the input image in dst_shape and a boolean whether warping worked
+        (warped, success): a warped version of the input image in dst_shape and a boolean whether warping worked,
+                           warped is a FrameContext if the input was one
     """
-    img_red = filter_keep_multi_ranges(img, red_color_ranges)
-    img_labelled_proc, filtered_regions = planvec.img_proc.find_regions(img_red, area_threshold=2, intens_threshold=10)
-    filtered_regions = sorted(filtered_regions, key=lambda region: region.area, reverse=True)
-    filtered_regions = filtered_regions[:4]  # only keep 4 largest regions
-    if len(filtered_regions) < 4:
+    METRICS.inc('rectification_attempts', help_text='Frames for which the red dots were searched.')
+    if tracker is None:
+        corner_centroids = find_red_dot_centroids(img, red_color_ranges, n_dots=n_dots, pyramid_level=pyramid_level,
+                                                  refine_radius=refine_radius)
+    else:
+        corner_centroids = tracker.locate(img)
+    if corner_centroids is None:
         # Rectification only works if we find 4 corners, else we return the original image and signal no success
         return img, False
 
-    """
-    We need to sort corner_centroids such that they map correctly to the new corners.
-    1 - 3
-    |   |
-    2 - 4
-    Therefore we first sort by lateral x-direction and then by vertical y-direction.
-    """
-    @timeit
-    def sort_points_clockwise(coords):
-        center = tuple(map(operator.truediv, reduce(lambda x, y: map(operator.add, x, y), coords), [len(coords)] * 2))
-        return sorted(coords, key=lambda coord: (-135 - math.degrees(math.atan2(*tuple(map(operator.sub, coord, center))[::-1]))) % 360)
-    corner_centroids = sort_points_clockwise([(region.centroid[1], region.centroid[0]) for region in filtered_regions])
-    new_corners = [[0, 0], [0, dst_shape[1]], [dst_shape[0], dst_shape[1]], [dst_shape[0], 0]]
-    warped = warp_image(img, corner_centroids, new_corners, dst_shape, show_plot=show_plot)
+    new_corners = rectified_corners(dst_shape)
+    if tracker is None:
+        warped = warp_image(img, corner_centroids, new_corners, dst_shape, show_plot=show_plot)
+    else:
+        transformation = tracker.get_transformation(new_corners)
+        warped = warp_image_by_transformation(img, transformation, dst_shape, show_plot=show_plot)
     if verbose:
         print(DEBUG_BARS)
         print(f'Warping image wrt corners. Found {len(corner_centroids)} corners at positions\n'
               f'{np.array(corner_centroids).round(decimals=2)}\nMapped to \n{np.array(new_corners)}.\nNew image size: {dst_shape}.')
+    METRICS.inc('rectification_successes', help_text='Frames rectified wrt the four red dots.')
     return warped, True
@@ -0,0 +1,139 @@
+"""
+In-process imposition of the team PDFs onto plates, the replacement of 'pdfunite' followed by 'pdfjam --nup'.
+
+The first page of every team PDF becomes a form XObject (its content stream and resources, unchanged) which the plate
+page draws at the offset of its grid cell:
+
+    q s 0 0 s x y cm /Team0 Do Q   (scale s and offset x, y in pt, one line per team PDF)
+
+Like pdfjam, cells are filled row by row from the top left and pages are scaled to fit their cell keeping the aspect
+ratio and centered in it. The plate is written in one pass with PyPDF2, no intermediate files and no LaTeX run.
+
+impose_packed_plate places pages of mixed sizes at their actual size and at given positions instead, e.g. as packed by
+planvec.plate_packing, optionally rotated by 90 degrees.
+"""
+from functools import partial
+
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject, StreamObject
+from PyPDF2.pdf import PageObject
+
+from planvec.utils.metrics import timed_operation
+
+from typing import Callable, List, Sequence, Tuple
+
+POINTS_PER_INCH = 72.0
+CM_PER_INCH = 2.54
+PAGE_SIZE_DECIMALS = 2  # page sizes in cm are rounded, such that e.g. 20.0000002cm pages fit 4 times on 80cm
+
+
+def cm_to_pt(cm: float) -> float:
+    return cm / CM_PER_INCH * POINTS_PER_INCH
+
+
+def read_page_size_cm(pdf_path: str) -> Tuple[float, float]:
+    """(width, height) in cm of the first page of a pdf."""
+    with open(pdf_path, 'rb') as pdf_file:
+        media_box = PdfFileReader(pdf_file, strict=False).getPage(0).mediaBox
+        return (round(float(media_box.getWidth()) / POINTS_PER_INCH * CM_PER_INCH, PAGE_SIZE_DECIMALS),
+                round(float(media_box.getHeight()) / POINTS_PER_INCH * CM_PER_INCH, PAGE_SIZE_DECIMALS))
+
+
+def grid_offsets(n_pdfs: int, n_cols: int, n_rows: int, cell_width: float,
+                 cell_height: float) -> List[Tuple[float, float]]:
+    """Lower left corners (x, y) of the first n_pdfs cells, row by row from the top left as pdfjam places them."""
+    if n_pdfs > n_cols * n_rows:
+        raise ValueError(f'{n_pdfs} PDFs do not fit on a grid of {n_cols}x{n_rows}.')
+    return [((idx % n_cols) * cell_width, (n_rows - 1 - idx // n_cols) * cell_height) for idx in range(n_pdfs)]
+
+
+@timed_operation('impose_plate')
+def impose_plate(pdf_paths: List[str], out_file_path: str, n_cols: int, n_rows: int, cell_width_cm: float,
+                 cell_height_cm: float) -> None:
+    """Writes a single-page PDF of n_cols x n_rows cells of cell_width_cm x cell_height_cm with the first page of
+    every PDF in pdf_paths in a cell of its own."""
+    cell_width, cell_height = cm_to_pt(cell_width_cm), cm_to_pt(cell_height_cm)
+    offsets = grid_offsets(len(pdf_paths), n_cols, n_rows, cell_width, cell_height)
+    placements = [partial(_grid_placement, x=x, y=y, cell_width=cell_width, cell_height=cell_height)
+                  for x, y in offsets]
+    _write_plate(pdf_paths, placements, out_file_path, n_cols * cell_width, n_rows * cell_height)
+
+
+@timed_operation('impose_plate')
+def impose_packed_plate(placements: Sequence[Tuple[str, float, float, bool]], out_file_path: str,
+                        plate_width_cm: float, plate_height_cm: float) -> None:
+    """Writes a single-page PDF of plate_width_cm x plate_height_cm with the first page of every pdf in placements,
+    given as (pdf_path, x_cm, y_cm, rotated). The page is placed at its actual size with its lower left corner at
+    x_cm, y_cm and, if rotated, turned by 90 degrees counterclockwise."""
+    _write_plate([pdf_path for pdf_path, _, _, _ in placements],
+                 [partial(_packed_placement, x_cm=x_cm, y_cm=y_cm, rotated=rotated)
+                  for _, x_cm, y_cm, rotated in placements],
+                 out_file_path, cm_to_pt(plate_width_cm), cm_to_pt(plate_height_cm))
+
+
+def _write_plate(pdf_paths: List[str], placements: List[Callable[[PageObject, str], str]], out_file_path: str,
+                 plate_width: float, plate_height: float) -> None:
+    """Writes the plate of plate_width x plate_height pt, placements[i](page, x_object_name) returns the content
+    stream operators drawing the first page of pdf_paths[i] on it."""
+    writer = PdfFileWriter()
+    plate = PageObject.createBlankPage(None, plate_width, plate_height)
+    x_objects = DictionaryObject()
+    content_lines = []
+    pdf_files = [open(pdf_path, 'rb') for pdf_path in pdf_paths]
+    try:
+        for pdf_idx, (pdf_file, placement) in enumerate(zip(pdf_files, placements)):
+            page = PdfFileReader(pdf_file, strict=False).getPage(0)
+            name = f'/Team{pdf_idx}'
+            x_objects[NameObject(name)] = writer._addObject(_page_to_form_x_object(page))
+            content_lines.append(placement(page, name))
+        plate[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): x_objects})
+        plate_content = DecodedStreamObject()
+        plate_content.setData('\n'.join(content_lines).encode('ascii'))
+        plate[NameObject('/Contents')] = writer._addObject(plate_content.flateEncode())
+        writer.addPage(plate)
+        with open(out_file_path, 'wb') as out_file:
+            writer.write(out_file)  # copies the referenced objects of the team PDFs, they have to be open until here
+    finally:
+        for pdf_file in pdf_files:
+            pdf_file.close()
+
+
+def _page_to_form_x_object(page: PageObject) -> StreamObject:
+    """Form XObject drawing the page, in the page's own coordinates."""
+    contents = page.getContents()
+    if contents is None:
+        data = b''
+    elif isinstance(contents, ArrayObject):
+        data = b'\n'.join(stream.getObject().getData() for stream in contents)
+    else:
+        data = contents.getData()
+    form = DecodedStreamObject()
+    form.setData(data)
+    form = form.flateEncode()  # a new stream object with the /Filter entry only, the form entries are added to it
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject([FloatObject(value) for value in page.mediaBox]),
+        NameObject('/Resources'): page.get('/Resources', DictionaryObject()),
+    })
+    return form
+
+
+def _grid_placement(page: PageObject, name: str, x: float, y: float, cell_width: float, cell_height: float) -> str:
+    """Content stream operators drawing the form XObject name scaled to fit and centered in the cell at x, y."""
+    media_box = page.mediaBox
+    page_width, page_height = float(media_box.getWidth()), float(media_box.getHeight())
+    scale = min(cell_width / page_width, cell_height / page_height)
+    x += (cell_width - scale * page_width) / 2 - scale * float(media_box.getLowerLeft_x())
+    y += (cell_height - scale * page_height) / 2 - scale * float(media_box.getLowerLeft_y())
+    return f'q {scale:.6f} 0 0 {scale:.6f} {x:.4f} {y:.4f} cm {name} Do Q'
+
+
+def _packed_placement(page: PageObject, name: str, x_cm: float, y_cm: float, rotated: bool) -> str:
+    """Content stream operators drawing the form XObject name at its size with the lower left corner at x_cm, y_cm."""
+    media_box = page.mediaBox
+    lower_left_x, lower_left_y = float(media_box.getLowerLeft_x()), float(media_box.getLowerLeft_y())
+    x, y = cm_to_pt(x_cm), cm_to_pt(y_cm)
+    if rotated:  # (u, v) -> (-v, u), the page's height becomes its width on the plate
+        return f'q 0 1 -1 0 {x + lower_left_y + float(media_box.getHeight()):.4f} {y - lower_left_x:.4f} cm {name} Do Q'
+    return f'q 1 0 0 1 {x - lower_left_x:.4f} {y - lower_left_y:.4f} cm {name} Do Q'
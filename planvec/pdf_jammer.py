@@ -1,20 +1,59 @@
 import os
 import subprocess
 import math
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from time import perf_counter
 
 from planvec.gui.datamanager import DataManager
+from planvec.pdf_imposition import impose_packed_plate, impose_plate, read_page_size_cm
+from planvec.plate_packing import pack_rectangles
 from planvec.utils.date_utils import get_date_time_tag
+from planvec.utils.metrics import timed_operation
 from typing import Dict, List
 
 UNITE_FILE_TEMPL = 'unite_plate-{plate_idx}_{date_time_tag}.pdf'
 JAMMED_FILE_TEMPL = 'jammed_plate-{plate_idx}_{date_time_tag}.pdf'
+ENGINE_PYPDF = 'pypdf'  # in-process imposition, see planvec.pdf_imposition
+ENGINE_PDFJAM = 'pdfjam'  # 'pdfunite' and 'pdfjam' subprocesses, requires poppler and LaTeX
+JAM_ENGINES = (ENGINE_PYPDF, ENGINE_PDFJAM)
+LAYOUT_GRID = 'grid'  # all pdfs in cells of pdf_width x pdf_height
+LAYOUT_PACKED = 'packed'  # pdfs of their actual page size packed onto the plate, see planvec.plate_packing
+JAM_LAYOUTS = (LAYOUT_GRID, LAYOUT_PACKED)
+DEFAULT_JOBS = 1
+
+
+class PlateResult:
+    """Outcome of creating one plate, error is the exception message if it failed. utilisation is the fraction of the
+    plate area covered by pdfs."""
+
+    def __init__(self, plate_idx: int, out_file_path: str, n_pdfs: int, duration_s: float = 0.0,
+                 error: str = None, utilisation: float = None) -> None:
+        self.plate_idx = plate_idx
+        self.out_file_path = out_file_path
+        self.n_pdfs = n_pdfs
+        self.duration_s = duration_s
+        self.error = error
+        self.utilisation = utilisation
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 
 class PdfJammer:
     def __init__(self, data_manager: DataManager, out_dir_path: Path, 
                  plate_width: int, plate_height: int, pdf_width: int, pdf_height: int,
-                 verbose: bool = True):
+                 verbose: bool = True, engine: str = ENGINE_PYPDF, jobs: int = DEFAULT_JOBS,
+                 layout: str = LAYOUT_GRID, spacing: float = 0.0):
+        if engine not in JAM_ENGINES:
+            raise ValueError(f'Jam engine {engine} not supported, use one of {JAM_ENGINES}.')
+        if layout not in JAM_LAYOUTS:
+            raise ValueError(f'Jam layout {layout} not supported, use one of {JAM_LAYOUTS}.')
+        if layout == LAYOUT_PACKED and engine != ENGINE_PYPDF:
+            raise ValueError(f'Jam layout {layout} needs the {ENGINE_PYPDF} engine.')
+        if jobs < 1:
+            raise ValueError(f'At least one job needed to jam, given: {jobs}.')
         self.data_manager = data_manager
         self.out_dir = out_dir_path
         self.plate_width = plate_width
@@ -22,21 +61,82 @@ class PdfJammer:
         self.pdf_width = pdf_width
         self.pdf_height = pdf_height
         self.verbose = verbose
-
-    def run(self, pdf_paths: List[str]) -> None:
-        """Main function to ran PDF jamming. Creates a united and jammed output PDF."""
-        unite_commands, jam_commands = self.create_commands(pdf_paths)
-        for unite_command, jam_command in zip(unite_commands, jam_commands):
-            print(f'Calling unite: {unite_command}')
-            print(f'Calling jam: {jam_command}')
-
-            subprocess.call(unite_command)
-            subprocess.call(' '.join(jam_command), shell=True)  # pdfjam seems to work only with shell call
-        print('Done.')
+        self.engine = engine
+        self.jobs = jobs
+        self.layout = layout
+        self.spacing = spacing
+
+    @timed_operation('jam')
+    def run(self, pdf_paths: List[str]) -> List[PlateResult]:
+        """Main function to ran PDF jamming. Creates a jammed output PDF per plate, with the pdfjam engine also a
+        united one. The plates are independent of each other and created by up to self.jobs workers at a time.
+        Returns a PlateResult per plate, a failing plate does not stop the others.
+
+        With the packed layout, the pdfs are placed at their page size, rotated where it saves space, on as few plates
+        as possible. Raises a PdfAndPlateSizeIncompatibleException if a pdf does not fit onto a plate."""
+        self.print_general_info(pdf_paths)
+        plate_jobs = self.create_plate_jobs(pdf_paths)
+        if self.jobs == 1 or len(plate_jobs) <= 1:
+            results = [plate_function(*plate_args) for plate_function, plate_args, _ in plate_jobs]
+        else:
+            # Threads: with the pdfjam engine they only wait for the subprocesses, an imposed plate takes milliseconds
+            # which is less than starting a worker process
+            n_workers = min(self.jobs, len(plate_jobs))
+            with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='PdfJammer') as executor:
+                futures = [executor.submit(plate_function, *plate_args) for plate_function, plate_args, _ in plate_jobs]
+                results = [future.result() for future in futures]
+        for result, (_, _, utilisation) in zip(results, plate_jobs):
+            result.utilisation = utilisation
+        PdfJammer.print_plate_results(results)
+        return results
+
+    def create_plate_jobs(self, pdf_paths: List[str]) -> List[tuple]:
+        """(function, arguments, utilisation) for every plate, the functions create the plate and return a
+        PlateResult."""
+        if self.layout == LAYOUT_PACKED:
+            return self._create_packed_plate_jobs(pdf_paths)
+        if self.engine == ENGINE_PDFJAM:
+            unite_commands, jam_commands = self.create_commands(pdf_paths)
+            return [(make_plate_with_subprocesses, (plate_idx, unite_command, jam_command),
+                     self._grid_utilisation(len(unite_command) - 2))
+                    for plate_idx, (unite_command, jam_command) in enumerate(zip(unite_commands, jam_commands))]
+        n_pdfs_per_plate = calc_max_n_pdfs_per_plate(self.plate_width, self.plate_height, self.pdf_width, self.pdf_height)
+        date_time_tag = get_date_time_tag()
+        plate_jobs = []
+        for plate_idx, pdfs_chunk in enumerate(chunks(pdf_paths, n_pdfs_per_plate)):
+            out_file_path = os.path.join(self.data_manager.out_dir_path,
+                                         JAMMED_FILE_TEMPL.format(plate_idx=plate_idx, date_time_tag=date_time_tag))
+            n_cols, n_rows = calc_n_cols_rows(len(pdfs_chunk), self.plate_width, self.pdf_width)
+            plate_jobs.append((make_plate_with_imposition,
+                               (plate_idx, pdfs_chunk, out_file_path, n_cols, n_rows, self.pdf_width, self.pdf_height),
+                               self._grid_utilisation(len(pdfs_chunk))))
+            self.print_plate_info(len(pdfs_chunk), plate_idx, out_file_path, self.plate_width, self.pdf_width, self.pdf_height)
+        return plate_jobs
+
+    def _create_packed_plate_jobs(self, pdf_paths: List[str]) -> List[tuple]:
+        sizes = [(pdf_path,) + read_page_size_cm(pdf_path) for pdf_path in pdf_paths]
+        try:
+            plates = pack_rectangles(sizes, self.plate_width, self.plate_height, spacing=self.spacing)
+        except ValueError as e:
+            raise PdfAndPlateSizeIncompatibleException(str(e))
+        date_time_tag = get_date_time_tag()
+        plate_jobs = []
+        for plate_idx, plate in enumerate(plates):
+            out_file_path = os.path.join(self.data_manager.out_dir_path,
+                                         JAMMED_FILE_TEMPL.format(plate_idx=plate_idx, date_time_tag=date_time_tag))
+            placements = [(item.key, item.x, item.y, item.rotated) for item in plate.items]
+            plate_jobs.append((make_plate_with_packing,
+                               (plate_idx, placements, out_file_path, self.plate_width, self.plate_height),
+                               plate.utilisation))
+            PdfJammer.print_packed_plate_info(len(plate.items), plate_idx, out_file_path, self.plate_width,
+                                              self.plate_height, plate.utilisation)
+        return plate_jobs
+
+    def _grid_utilisation(self, n_pdfs: int) -> float:
+        return n_pdfs * self.pdf_width * self.pdf_height / (self.plate_width * self.plate_height)
 
     def create_commands(self, pdfs) -> (List[List[str]], List[List[str]]):
         """Main function to arrange all pdfs in the input list on one or more single-page pdfs."""
-        self.print_general_info(len(pdfs))
         n_pdfs_per_plate = calc_max_n_pdfs_per_plate(self.plate_width, self.plate_height, self.pdf_width, self.pdf_height)
         unite_commands = []
         jam_commands = []
@@ -129,16 +229,19 @@ class PdfJammer:
             for path in pdfs:
                 print(f'   {os.path.split(path)[1]}')
 
-    def print_general_info(self, n_pdfs_total):
+    def print_general_info(self, pdf_paths: List[str]):
+        n_pdfs_total = len(pdf_paths)
         max_pdfs_per_plate = calc_max_n_pdfs_per_plate(self.plate_width, self.plate_height, self.pdf_width, self.pdf_height)
         n_plates = calc_n_plates(max_pdfs_per_plate, n_pdfs_total)
         print(f'Collecting output from {self.data_manager.out_dir_path}...')
         print(f'Found {n_pdfs_total} pdf output files.')
-        pdfs_dict = self.accumulate_pdf_paths_all_schools_and_teams()
-        PdfJammer.print_pdf_paths(pdfs_dict)
+        PdfJammer.print_pdf_paths(group_pdf_paths_by_team(pdf_paths))
         print(f'Given dimensions:')
         print(f' Plate width:\t {self.plate_width}')
         print(f' Plate height:\t {self.plate_height}')
+        if self.layout == LAYOUT_PACKED:
+            print(f' PDFs are packed by their page size with {self.spacing} cm spacing.')
+            return
         print(f' PDF width:\t\t {self.pdf_width}')
         print(f' PDF width:\t\t {self.pdf_height}')
         print(f' which means maximum {max_pdfs_per_plate} PDF\'s per plate and...')
@@ -156,6 +259,25 @@ class PdfJammer:
               f'{final_width}x{final_height} cm')
         print(f'\t{out_file_path}')
 
+    @staticmethod
+    def print_packed_plate_info(n_pdfs_on_plate, plate_idx, out_file_path, plate_width, plate_height, utilisation):
+        print(f'Plate {plate_idx + 1}: ')
+        print(f'\t{n_pdfs_on_plate} PDF{"s" if n_pdfs_on_plate > 1 else ""} packed on this plate of '
+              f'{plate_width}x{plate_height} cm, {utilisation:.0%} used')
+        print(f'\t{out_file_path}')
+
+    @staticmethod
+    def print_plate_results(results: List[PlateResult]) -> None:
+        n_failed = sum(not result.ok for result in results)
+        print(f'Done, {len(results) - n_failed} of {len(results)} plates created.')
+        for result in results:
+            status = 'ok' if result.ok else f'FAILED: {result.error}'
+            print(f' Plate {result.plate_idx + 1}:\t {result.duration_s:6.2f}s, {result.n_pdfs} PDFs, '
+                  f'{result.utilisation:4.0%} used, {status}')
+        if len(results) > 0:
+            mean_utilisation = sum(result.utilisation for result in results) / len(results)
+            print(f' Mean plate utilisation: {mean_utilisation:.0%}')
+
     def validate_pdf_and_plate_sizes_compatibility(self) -> None:
         if self.pdf_width > self.plate_width:
             raise PdfAndPlateSizeIncompatibleException("PDF Input kann nicht breiter als Output Platte sein!")
@@ -168,6 +290,47 @@ class PdfAndPlateSizeIncompatibleException(Exception):
         self.message = message
 
 
+def make_plate_with_imposition(plate_idx: int, pdf_paths: List[str], out_file_path: str, n_cols: int, n_rows: int,
+                               pdf_width: int, pdf_height: int) -> PlateResult:
+    result = PlateResult(plate_idx, out_file_path, len(pdf_paths))
+    start_time = perf_counter()
+    try:
+        impose_plate(pdf_paths, out_file_path, n_cols, n_rows, pdf_width, pdf_height)
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    result.duration_s = perf_counter() - start_time
+    return result
+
+
+def make_plate_with_packing(plate_idx: int, placements: List[tuple], out_file_path: str, plate_width: int,
+                            plate_height: int) -> PlateResult:
+    result = PlateResult(plate_idx, out_file_path, len(placements))
+    start_time = perf_counter()
+    try:
+        impose_packed_plate(placements, out_file_path, plate_width, plate_height)
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    result.duration_s = perf_counter() - start_time
+    return result
+
+
+def make_plate_with_subprocesses(plate_idx: int, unite_command: List[str], jam_command: List[str]) -> PlateResult:
+    """Step one: 'pdfunite' merges the pdfs of the plate into one pdf as pages, step two: 'pdfjam' arranges its pages
+    on the plate."""
+    out_file_path = jam_command[-1].split(' ', 1)[1]  # '--outfile {path}'
+    result = PlateResult(plate_idx, out_file_path, len(unite_command) - 2)
+    start_time = perf_counter()
+    try:
+        print(f'Calling unite: {unite_command}')
+        subprocess.check_call(unite_command)
+        print(f'Calling jam: {jam_command}')
+        subprocess.check_call(' '.join(jam_command), shell=True)  # pdfjam seems to work only with shell call
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    result.duration_s = perf_counter() - start_time
+    return result
+
+
 def calc_max_n_horizontal(plate_width, pdf_width):
     return plate_width // pdf_width
 
@@ -200,6 +363,14 @@ def calc_final_width_height(n_cols, n_rows, pdf_width, pdf_height):
     return width, height
 
 
+def group_pdf_paths_by_team(pdf_paths: List[str]) -> Dict[str, List[str]]:
+    """Groups pdf paths by their team folder, without looking at the folders again."""
+    teams_pdf_paths = {}
+    for pdf_path in pdf_paths:
+        teams_pdf_paths.setdefault(os.path.basename(os.path.dirname(pdf_path)), []).append(pdf_path)
+    return teams_pdf_paths
+
+
 def chunks(list_, chunk_size):
     """Yield successive (chunk_size)-sized chunks from list_."""
     for idx in range(0, len(list_), chunk_size):
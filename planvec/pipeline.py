@@ -1,3 +1,4 @@
+import numpy as np
 import skimage
 from PIL.ImageQt import ImageQt
 from dotmap import DotMap
@@ -5,78 +6,159 @@ from dotmap import DotMap
 from planvec import img_proc
 from planvec import vizualization
 from planvec import conversions
+from planvec.frame_context import FrameContext
+from planvec.utils.metrics import METRICS
+from planvec.utils.tracing import trace_span
 # from config import planvec_config
 
 DEFAULT_FIG_SIZE = (13, 8)
 
 
 def run_pipeline(img, ax, config: DotMap, color_ranges: dict, visualize_steps=False, verbose=False,
-                 return_np_arr=True, return_fig=False, save_pdf_path=None):
+                 return_np_arr=True, return_fig=False, save_pdf_path=None, return_contours=False,
+                 preview_renderer=None, tracker=None, calibration=None, buffer_pool=None, frame_trace=None):
     """Full processing pipeline for an incoming image producing end-to-end the final figure which then can be
-    stored as a pdf."""
+    stored as a pdf. With return_contours, the approximated contours are returned as third element (empty if no
+    drawing was found) such that they can be written with planvec.vector_writer.
+
+    If a preview_renderer (planvec.gui.preview_renderer.PreviewRenderer) is given, the output image is rasterised
+    by it directly and ax is returned untouched, i.e. no matplotlib drawing happens at all.
+
+    A tracker (planvec.red_dot_tracking.RedDotTracker) follows the red dots from frame to frame and a calibration
+    (planvec.calibration.SheetCalibration) replaces the dot search for fixed-mount cameras, see rectify.
+
+    With a buffer_pool (planvec.buffer_pool.BufferPool) the pipeline runs in zero-copy mode: all full-frame
+    intermediate results are written into pooled buffers, which are allocated for the first frame of a resolution
+    only. The input image is never modified and pooled results are only valid until the next pass with the same
+    pool.
+
+    If a frame_trace (planvec.utils.tracing.FrameTrace) is given, every stage is recorded as a span of it."""
+    if buffer_pool is not None:
+        buffer_pool.begin_frame()
 
     if visualize_steps:
         vizualization.imshow(img, figsize=DEFAULT_FIG_SIZE, img_space='BGR', title='Input image')
 
-    # ----- Process image, stretch to dots -----
-    red_color_ranges = [color_range for key, color_range in color_ranges.items() if 'red' in key]
-    img, warped_ok = img_proc.rectify_wrt_red_dots(img, config.rectify_shape, red_color_ranges,
-                                                   show_plot=visualize_steps, verbose=verbose)
+    with trace_span(frame_trace, 'rectify'):
+        frame, warped_ok = rectify(img, config, color_ranges, visualize_steps=visualize_steps, verbose=verbose,
+                                   tracker=tracker, calibration=calibration, buffer_pool=buffer_pool)
     if not warped_ok:
-        return ax, conversions.bgr2qt(img)
+        return (ax, conversions.bgr2qt(frame.bgr), []) if return_contours else (ax, conversions.bgr2qt(frame.bgr))
+
+    with trace_span(frame_trace, 'segment'):
+        regions_mask, _ = segment(frame, config, color_ranges, visualize_steps=visualize_steps, verbose=verbose)
+
+    with trace_span(frame_trace, 'vectorize'):
+        approx_contours = vectorize(regions_mask, config, buffer_pool=buffer_pool)
+    if approx_contours is None:
+        qt_img = conversions.gray2qt(regions_mask)
+        return (ax, qt_img, []) if return_contours else (ax, qt_img)
+
+    with trace_span(frame_trace, 'render'):
+        ax, qt_img = render(approx_contours, ax, config, preview_renderer=preview_renderer)
+    return (ax, qt_img, approx_contours) if return_contours else (ax, qt_img)
+
+
+def rectify(img, config: DotMap, color_ranges: dict, visualize_steps=False, verbose=False,
+            tracker=None, calibration=None, buffer_pool=None) -> (FrameContext, bool):
+    """First pipeline stage: stretch the input image to the red corner dots. Returns the (rectified) FrameContext and
+    whether rectification worked. With a tracker the dots are only searched in small windows around their last
+    positions as long as they can be found there.
+
+    With a valid calibration, the frame is rectified with its precomputed remap tables and the dots are only searched
+    every calibration.check_interval frames to verify the calibration still holds. If it does not, or the frame does
+    not have the calibrated size, the dots are searched in every frame again.
+
+    The returned frame carries the buffer_pool along, later stages write their results into its buffers."""
+    red_color_ranges = [color_range for key, color_range in color_ranges.items() if 'red' in key]
+    if calibration is not None:
+        if calibration.check_due():
+            calibration.check(img, red_color_ranges)
+        elif calibration.valid and not calibration.fits(img):  # e.g. another camera or input size
+            calibration.valid = False
+            calibration.n_check_failures += 1
+        if calibration.valid:
+            METRICS.inc('rectification_calibrated',
+                        help_text='Frames rectified with the remap tables of a calibration instead of the red dots.')
+            width, height = config.rectify_shape
+            dst = None if buffer_pool is None else buffer_pool.get('warped_bgr', (height, width) + img.shape[2:])
+            return FrameContext(calibration.rectify(img, config.rectify_shape, dst=dst), buffer_pool=buffer_pool), True
+        calibration.n_frames_since_check += 1
+
+    # The frame context computes the HSV planes at most once for all searches of the red dots
+    frame = FrameContext(img, buffer_pool=buffer_pool)
+    return img_proc.rectify_wrt_red_dots(frame, config.rectify_shape, red_color_ranges,
+                                         show_plot=visualize_steps, verbose=verbose, tracker=tracker,
+                                         pyramid_level=config.red_dot_pyramid_level,
+                                         refine_radius=config.red_dot_refine_radius)
+
+
+def segment(frame: FrameContext, config: DotMap, color_ranges: dict, visualize_steps=False, verbose=False):
+    """Second pipeline stage: find the drawn regions of a rectified frame. Returns an 8-bit mask of the kept regions
+    and their img_proc.RegionStats. All full-frame results are written into the buffers of the frame's buffer pool,
+    if it has one."""
+    mask_shape = frame.shape[:2]
     # ----- Add Gaussian Blur before filtering colors -----
-    img = img_proc.add_gaussian_blur(img, *config.gaussian_blur)
+    img = img_proc.add_gaussian_blur(frame.bgr, *config.gaussian_blur, dst=frame.buffer('blurred', frame.shape))
 
-    # ----- Filter out (make white) color ranges -----
-    img = img_proc.filter_multi_hsv_ranges_to_white(img, list(color_ranges.values()))
+    # ----- Filter out (make white) color ranges, classified on the blurred frame through the lookup table -----
+    img = img_proc.filter_multi_hsv_ranges_to_white(img, list(color_ranges.values()), dst=img)
     if visualize_steps:
         vizualization.imshow(img, figsize=DEFAULT_FIG_SIZE, img_space='BGR', title='Filtered out colors')
 
     # ----- Convert to greyscale -----
-    img = img_proc.img_to_greyscale(img)
+    img = img_proc.img_to_greyscale(img, dst=frame.buffer('grey', mask_shape))
     if visualize_steps:
         vizualization.imshow(img, figsize=DEFAULT_FIG_SIZE, img_space='BGR', title='Grey scale')
 
     # ----- Threshold image -----
-    img = img_proc.thresh_img(img, *config.img_threshold)
+    img = img_proc.thresh_img(img, *config.img_threshold, dst=img)
     if visualize_steps:
         vizualization.imshow(img, figsize=DEFAULT_FIG_SIZE, img_space='BGR', title='Grey thresholded')
 
-    # ----- Labelling connected regions -----
-    labelled_img, n = skimage.measure.label(img, background=0, return_num=True)
-    regions = skimage.measure.regionprops(labelled_img)
-    # TODO(matt): Clear stuff up and use find / filter regions functions properly.
-
-    if visualize_steps:
-        vizualization.imshow(labelled_img, figsize=DEFAULT_FIG_SIZE, img_space='BGR',
-                             title='Regions before filter')
-
-    # ----- Filter regions by size -----
-    img_labelled_proc, filtered_regions = img_proc.filter_regions(labelled_img, regionprops=regions,
-                                                                  area_threshold=config.area_threshold,
-                                                                  verbose=verbose)
+    # ----- Labelling and filtering connected regions by size -----
+    regions_mask, regions = img_proc.find_connected_regions(img, area_threshold=config.area_threshold,
+                                                            dst=frame.buffer('regions_mask', mask_shape),
+                                                            labels_dst=frame.buffer('labels', mask_shape, np.int32),
+                                                            index_dst=frame.buffer('label_indices', mask_shape,
+                                                                                   np.intp))
+    if verbose:
+        print(f'{len(regions.areas)} regions left, sizes: {regions.areas.tolist()}')
     if visualize_steps:
-        vizualization.imshow(img_labelled_proc, figsize=DEFAULT_FIG_SIZE, img_space='BGR',
-                             title='Regions after filter')
-        vizualization.plot_image_regions(img_labelled_proc, filtered_regions, figsize=DEFAULT_FIG_SIZE,
+        vizualization.plot_image_regions(regions_mask, regions, figsize=DEFAULT_FIG_SIZE,
                                          title='Image regions filtered with boxes')
+    return regions_mask, regions
+
 
+def vectorize(regions_mask, config: DotMap, buffer_pool=None):
+    """Third pipeline stage: trace the outlines of the kept regions and approximate them by polygons. Returns a list
+    of (n, 2) arrays of (row, col) coordinates or None if contour finding failed."""
+    binary_dst = None if buffer_pool is None else buffer_pool.like('binary_regions', regions_mask)
     # ----- Find and filter contours of connected regions -----
     try:
-        contours = img_proc.find_contours(img_labelled_proc != 0, level=0)
+        contours = img_proc.find_contours(regions_mask, level=0,
+                                          engine=config.get('contour_engine', img_proc.DEFAULT_CONTOUR_ENGINE),
+                                          dst=binary_dst)
     except KeyError:  # bug in skimage, see https://github.com/scikit-image/scikit-image/issues/4830
-        return ax, conversions.bgr2qt(img)
+        return None
     contours = img_proc.filter_contours_by_size(contours, n_points_thresh=config.contours_size_threshold)
 
     # ----- Approximate contours by polygons to smooth outline ------
     approx_contours = []
     for contour in contours:
         approx_contours.append(skimage.measure.approximate_polygon(contour.copy(), tolerance=0.7))
+    return approx_contours
+
+
+def render(approx_contours, ax, config: DotMap, preview_renderer=None):
+    """Fourth pipeline stage: draw the contours into the output image. Returns ax and the output QImage. With a
+    preview_renderer the image is rasterised by it and ax is returned untouched, otherwise the contours are plotted
+    into ax and its figure is converted."""
+    if preview_renderer is not None:
+        return ax, preview_renderer.render(approx_contours, config.rectify_shape)
 
     # ----- Creating the final output figure of the contours ------
     ax = vizualization.plot_contours(approx_contours, ax=ax, color='red',
                                      linewidth=config.line_width, axis='off')
     ax.figure.set_size_inches(*config.out_size_inches)
-
-    pil_img = conversions.fig2img(ax.figure)
-    return ax, ImageQt(pil_img)
+    return ax, ImageQt(conversions.fig2img(ax.figure))
@@ -0,0 +1,297 @@
+"""
+Multiprocessing backend of the image pipeline. Large parts of a pipeline pass hold the GIL (labelling, polygon
+approximation, Python loops), so a single processing thread uses about one core. The PipelineProcessPool runs the
+pipeline stages in worker processes instead, each with its own red dot tracker and buffer pool.
+
+Frames are neither pickled nor copied: they are submitted as slots of a planvec.frame_ring.SharedFrameRing, into
+which the capture thread read them. The pool retains the frame slot while the frame is in flight and a worker
+attaches to the ring's block by name and processes the frame in place. Every in-flight frame also occupies a preview
+slot, a shared memory block the worker renders the preview into, only the small contour arrays travel back through a
+queue. Results are returned in the order the frames were submitted and keep both slots until the caller releases
+them.
+
+Workers are started with the 'spawn' method, forking a process with running Qt threads is not safe. They share the
+resource tracker of the main process, which owns (and unlinks) all shared memory blocks.
+
+A spawned worker has its own METRICS registry and @timeit records. Every result carries the counter increments and
+run times recorded in the worker since its previous result, which are merged into the registry and records of the
+main process, such that e.g. the rectification counters and function histograms include the work of the workers.
+"""
+import multiprocessing as mp
+import os
+import queue
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from dotmap import DotMap
+
+from planvec.buffer_pool import BufferPool
+from planvec.frame_ring import FrameSlot, slot_view
+from planvec.gui.preview_renderer import draw_preview, preview_layout
+from planvec.pipeline import rectify, segment, vectorize
+from planvec.red_dot_tracking import RedDotTracker
+from planvec.utils.metrics import METRICS
+from planvec.utils.timing import add_timings, drain_new_timings, is_timing_enabled, set_timing_enabled
+from planvec.utils.tracing import FrameTrace
+
+from typing import List, Optional, Tuple
+
+STATUS_OK = 'ok'
+STATUS_NOT_RECTIFIED = 'not_rectified'  # red dots not found, no preview was rendered
+STATUS_ERROR = 'error'
+MAX_IN_FLIGHT_PER_WORKER = 2  # one frame being processed and one waiting, such that workers never idle
+WORKER_POLL_TIMEOUT_S = 1.0
+
+
+class PoolResult:
+    """Result of a frame processed by a worker. frame is the view of the frame slot and preview a view of the preview
+    slot, they stay valid until the result is released with PipelineProcessPool.release."""
+
+    def __init__(self, seq: int, slot_idx: int, frame_slot: FrameSlot, preview: Optional[np.ndarray], status: str,
+                 contours: List[np.ndarray], spans: List[tuple], worker_pid: int, frame_trace=None,
+                 error: str = None) -> None:
+        self.seq = seq
+        self.slot_idx = slot_idx
+        self.frame_slot = frame_slot
+        self.frame = frame_slot.array
+        self.preview = preview
+        self.status = status
+        self.contours = contours
+        self.spans = spans  # (name, start_ns, end_ns) recorded in the worker
+        self.worker_pid = worker_pid
+        self.frame_trace = frame_trace
+        self.error = error
+
+
+class _Slot:
+    """Shared memory block of the preview of one in-flight frame."""
+
+    def __init__(self, preview_nbytes: int) -> None:
+        self.preview_memory = SharedMemory(create=True, size=preview_nbytes)
+
+    def preview_view(self, shape: Tuple[int, ...]) -> np.ndarray:
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.preview_memory.buf)
+
+    def close(self) -> None:
+        try:
+            self.preview_memory.close()
+        except BufferError:  # a view is still referenced, the mapping goes away with it
+            pass
+        self.preview_memory.unlink()
+
+
+def _process_in_worker(frame: np.ndarray, preview_memory: SharedMemory, config: DotMap, color_ranges: dict,
+                       preview_size: Tuple[int, int], tracker, calibration, buffer_pool) -> tuple:
+    """Rectify, segment, vectorize and render the preview of a frame. Returns (status, contours, preview shape,
+    spans)."""
+    if buffer_pool is not None:
+        buffer_pool.begin_frame()
+    frame_trace = FrameTrace(0)
+    with frame_trace.span('rectify'):
+        rectified_frame, warped_ok = rectify(frame, config, color_ranges, tracker=tracker, calibration=calibration,
+                                             buffer_pool=buffer_pool)
+    if not warped_ok:
+        return STATUS_NOT_RECTIFIED, [], None, [span[:3] for span in frame_trace.spans]
+    with frame_trace.span('segment'):
+        regions_mask, _ = segment(rectified_frame, config, color_ranges)
+    with frame_trace.span('vectorize'):
+        contours = vectorize(regions_mask, config, buffer_pool=buffer_pool) or []
+    with frame_trace.span('render'):
+        scale, (height, width) = preview_layout(preview_size, config.rectify_shape)
+        preview = np.ndarray((height, width, 3), dtype=np.uint8, buffer=preview_memory.buf)
+        draw_preview(preview, contours, scale, line_width=max(1, int(round(config.line_width))))
+        del preview  # no view of the block may outlive the frame, the block could not be closed otherwise
+    return STATUS_OK, contours, (height, width, 3), [span[:3] for span in frame_trace.spans]
+
+
+def _worker_main(task_queue: mp.Queue, result_queue: mp.Queue, processing_config: dict, color_ranges: dict,
+                 preview_size: Tuple[int, int], calibration, metrics_enabled: bool, timing_enabled: bool) -> None:
+    """Loop of a worker process. Tasks are ('frame', seq, frame ring block, slot offset, frame shape, preview block),
+    ('settings', processing config, calibration), ('detach', block names) or None to exit."""
+    METRICS.enabled = metrics_enabled
+    set_timing_enabled(timing_enabled)
+    n_timings_sent = {}
+    config = DotMap(processing_config)
+    tracker = RedDotTracker.from_config(config, color_ranges) if config.red_dot_tracking else None
+    buffer_pool = BufferPool() if config.use_buffer_pool else None
+    attached = {}  # block name -> SharedMemory
+    pid = os.getpid()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        if task[0] == 'settings':
+            config, calibration = DotMap(task[1]), task[2]
+            if tracker is not None:
+                tracker.reset()
+        elif task[0] == 'detach':
+            for name in task[1]:
+                if name in attached:
+                    attached.pop(name).close()
+        elif task[0] == 'frame':
+            _, seq, frame_block, frame_offset, frame_shape, preview_block = task
+            for name in (frame_block, preview_block):
+                if name not in attached:
+                    attached[name] = SharedMemory(name=name)
+            frame = slot_view(attached[frame_block], frame_offset, frame_shape)
+            try:
+                status, contours, preview_shape, spans = _process_in_worker(
+                    frame, attached[preview_block], config, color_ranges, preview_size, tracker, calibration,
+                    buffer_pool)
+                message = (seq, status, contours, preview_shape, spans, pid, None)
+            except Exception:
+                message = (seq, STATUS_ERROR, [], None, [], pid, traceback.format_exc())
+            del frame
+            telemetry = (METRICS.drain_counters() if metrics_enabled else {},
+                         drain_new_timings(n_timings_sent) if timing_enabled else {})
+            result_queue.put(message + (telemetry,))
+    for shared_memory in attached.values():
+        shared_memory.close()
+
+
+class PipelineProcessPool:
+    """Runs the pipeline on n_workers worker processes.
+
+    Arguments
+    ---------
+        n_workers: number of worker processes
+        processing_config: the processing config section
+        color_ranges: dict of HSVColorRange's
+        preview_size: (width, height) the preview is fitted into, e.g. the processed display size
+        calibration: planvec.calibration.SheetCalibration or None
+        max_in_flight_per_worker: number of preview slots per worker, i.e. frames submitted but not yet released. The
+                                  frame ring needs as many slots for the pool in addition to its other frames.
+    """
+
+    def __init__(self, n_workers: int, processing_config: DotMap, color_ranges: dict, preview_size: Tuple[int, int],
+                 calibration=None, max_in_flight_per_worker: int = MAX_IN_FLIGHT_PER_WORKER) -> None:
+        self.n_workers = n_workers
+        self.preview_size = tuple(preview_size)
+        self.n_slots = n_workers * max_in_flight_per_worker
+        context = mp.get_context('spawn')
+        self.result_queue = context.Queue()
+        self.task_queues = [context.Queue() for _ in range(n_workers)]
+        self.workers = [context.Process(target=_worker_main, name=f'PipelineWorker-{worker_idx}', daemon=True,
+                                        args=(self.task_queues[worker_idx], self.result_queue,
+                                              processing_config.toDict(), color_ranges, self.preview_size,
+                                              calibration, METRICS.enabled, is_timing_enabled()))
+                        for worker_idx in range(n_workers)]
+        preview_width, preview_height = self.preview_size
+        self._slots = [_Slot(preview_width * preview_height * 3) for _ in range(self.n_slots)]
+        self._free_slots = list(range(self.n_slots))
+        self._frame_blocks = []  # names of the frame ring blocks the workers have attached to, the current one last
+        self._in_flight = {}  # seq -> (slot index, frame slot, worker index, frame trace)
+        self._worker_loads = [0] * n_workers  # frames submitted to each worker and not returned yet
+        self._finished = {}  # seq -> PoolResult, returned but waiting for earlier frames
+        self._next_seq = 0
+        self._next_result_seq = 0
+
+    @property
+    def worker_pids(self) -> List[int]:
+        return [worker.pid for worker in self.workers]
+
+    def start(self) -> 'PipelineProcessPool':
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    @property
+    def n_in_flight(self) -> int:
+        """Frames submitted and not released yet."""
+        return self.n_slots - len(self._free_slots)
+
+    def can_submit(self) -> bool:
+        return len(self._free_slots) > 0
+
+    def _use_frame_block(self, block_name: str) -> None:
+        """Keeps track of the frame ring block, the workers detach from the previous one once they are done with it,
+        i.e. when the capture thread replaced its ring because the frame size changed."""
+        if self._frame_blocks and self._frame_blocks[-1] == block_name:
+            return
+        if self._frame_blocks:  # queued after all frames of the previous block, so no worker needs it anymore
+            for task_queue in self.task_queues:
+                task_queue.put(('detach', self._frame_blocks))
+        self._frame_blocks = [block_name]
+
+    def submit(self, frame_slot: FrameSlot, frame_trace=None) -> int:
+        """Hands the frame in a slot of a SharedFrameRing to the least busy worker and retains the slot until the
+        result is released. Returns the sequence number of the frame, results are returned in this order."""
+        if not self._free_slots:
+            raise RuntimeError('No free slot, release results or check can_submit before submitting.')
+        self._use_frame_block(frame_slot.block_name)
+        slot_idx = self._free_slots.pop()
+        worker_idx = int(np.argmin(self._worker_loads))
+        self._worker_loads[worker_idx] += 1
+        seq = self._next_seq
+        self._next_seq += 1
+        self._in_flight[seq] = (slot_idx, frame_slot.retain(), worker_idx, frame_trace)
+        self.task_queues[worker_idx].put(('frame', seq, frame_slot.block_name, frame_slot.offset, frame_slot.shape,
+                                          self._slots[slot_idx].preview_memory.name))
+        return seq
+
+    def collect(self, timeout: float = 0.0) -> List[PoolResult]:
+        """Returns the results which are ready in submission order. Waits at most timeout seconds for the first
+        result to arrive if none is ready yet."""
+        if self._next_result_seq not in self._finished and self._in_flight:
+            self._receive(timeout)
+        while True:  # take everything else which has arrived meanwhile
+            try:
+                self._store(self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+        results = []
+        while self._next_result_seq in self._finished:
+            results.append(self._finished.pop(self._next_result_seq))
+            self._next_result_seq += 1
+        return results
+
+    def _receive(self, timeout: float) -> None:
+        try:
+            self._store(self.result_queue.get(timeout=timeout) if timeout > 0 else self.result_queue.get_nowait())
+        except queue.Empty:
+            dead_workers = [worker.name for worker in self.workers if not worker.is_alive()]
+            if dead_workers:
+                raise RuntimeError(f'Pipeline workers died: {", ".join(dead_workers)}.')
+
+    def _store(self, message: tuple) -> None:
+        seq, status, contours, preview_shape, spans, pid, error, (counters, timings) = message
+        METRICS.merge_counters(counters)
+        add_timings(timings)
+        slot_idx, frame_slot, worker_idx, frame_trace = self._in_flight.pop(seq)
+        self._worker_loads[worker_idx] -= 1
+        slot = self._slots[slot_idx]
+        preview = slot.preview_view(preview_shape) if preview_shape is not None else None
+        self._finished[seq] = PoolResult(seq, slot_idx, frame_slot, preview, status, contours, spans, pid,
+                                         frame_trace=frame_trace, error=error)
+
+    def release(self, result: PoolResult) -> None:
+        """Frees the slots of a result, its frame and preview views must not be used afterwards."""
+        result.frame = None
+        result.preview = None
+        result.frame_slot.release()
+        self._free_slots.append(result.slot_idx)
+
+    def update_settings(self, processing_config: DotMap, calibration=None) -> None:
+        """Sends a changed processing config or calibration to all workers, it applies to frames submitted later."""
+        for task_queue in self.task_queues:
+            task_queue.put(('settings', processing_config.toDict(), calibration))
+
+    def close(self) -> None:
+        """Stops the workers, releases the frame slots still held and frees the preview slots. Results which were not
+        released must not be used."""
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=WORKER_POLL_TIMEOUT_S * 5)
+            if worker.is_alive():
+                worker.terminate()
+        for _, frame_slot, _, _ in self._in_flight.values():
+            frame_slot.release()
+        for result in self._finished.values():
+            result.frame_slot.release()
+        self._in_flight, self._finished = {}, {}
+        for slot in self._slots:
+            slot.close()
+        self._slots = []
+        self._free_slots = []
@@ -0,0 +1,246 @@
+"""
+Staged execution of the image pipeline. run_pipeline processes a frame end-to-end before it takes the next one, so a
+frame rate is bounded by the sum of all stage times. The StagedPipeline runs rectify, segment, vectorize and render on
+a thread each, connected by bounded queues: frame N+1 is rectified while frame N is vectorized, such that the frame
+rate approaches the one of the slowest stage. The OpenCV and numpy parts of the stages release the GIL, the pure
+Python parts (polygon approximation, tracking) do not, so the overlap is partial.
+
+Every stage thread owns the state only it needs (the tracker and calibration belong to rectify, the preview renderer
+to render). Buffer pools hold the full-frame results of rectify, segment and vectorize, a frame takes a free pool in
+rectify and returns it after vectorize, so frames in flight never share buffers. The queues block when full, which
+propagates back pressure to submit: can_submit is False while the rectify queue is full.
+
+The queue depths and busy times of the stages are available via stats and as gauges of planvec.utils.metrics.
+"""
+import queue
+import threading
+import traceback
+from time import perf_counter_ns
+
+from dotmap import DotMap
+
+from planvec import conversions
+from planvec.buffer_pool import BufferPool
+from planvec.frame_ring import FrameSlot
+from planvec.pipeline import rectify, render, segment, vectorize
+from planvec.utils.metrics import METRICS
+from planvec.utils.tracing import FrameTrace, TraceRecorder, trace_span
+
+from typing import List
+
+STAGES = ('rectify', 'segment', 'vectorize', 'render')
+DEFAULT_QUEUE_SIZE = 1  # per stage, deeper queues add latency since the newest frame waits behind older ones
+STATUS_OK = 'ok'
+STATUS_NOT_RECTIFIED = 'not_rectified'  # red dots not found, the output image is the input frame
+STATUS_NO_CONTOURS = 'no_contours'  # contour finding failed, the output image is the regions mask
+STATUS_ERROR = 'error'
+_STOP = None
+
+
+class StagedResult:
+    """A frame which passed all stages. qt_img_out is the output image (the preview if status is STATUS_OK),
+    qt_img_input the input image which was handed to submit."""
+
+    def __init__(self, seq: int, frame_trace: FrameTrace = None, qt_img_input=None) -> None:
+        self.seq = seq
+        self.frame_trace = frame_trace
+        self.qt_img_input = qt_img_input
+        self.qt_img_out = None
+        self.contours = []
+        self.status = STATUS_OK
+        self.error = None
+        # Passed between the stages
+        self.frame = None  # bgr frame or FrameSlot until rectify, then the rectified FrameContext
+        self.regions_mask = None
+        self.buffer_pool = None
+
+
+class StagedPipeline:
+    """Runs the pipeline stages on a thread each.
+
+    Arguments
+    ---------
+        processing_config: the processing config section, read by the stages for every frame
+        color_ranges: dict of HSVColorRange's
+        preview_renderer: planvec.gui.preview_renderer.PreviewRenderer, if None the contours are plotted into ax
+        ax: matplotlib axes the render stage plots into if there is no preview renderer
+        tracker: planvec.red_dot_tracking.RedDotTracker or None
+        calibration: planvec.calibration.SheetCalibration or None
+        queue_size: capacity of the queue in front of every stage
+        trace_recorder: names the stage threads in the traces if given
+    """
+
+    def __init__(self, processing_config: DotMap, color_ranges: dict, preview_renderer=None, ax=None, tracker=None,
+                 calibration=None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 trace_recorder: TraceRecorder = None) -> None:
+        self.config = processing_config
+        self.color_ranges = color_ranges
+        self.preview_renderer = preview_renderer
+        self.ax = ax
+        self.tracker = tracker
+        self.calibration = calibration
+        self.queue_size = queue_size
+        self.trace_recorder = trace_recorder
+        # queues[i] is in front of STAGES[i], the last one holds the finished frames
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in STAGES] + [queue.Queue()]
+        # A frame holds a buffer pool from rectify to vectorize: one per stage and queue slot in between
+        self.n_buffer_pools = 3 + 2 * queue_size
+        self._free_buffer_pools = queue.Queue()
+        self.use_buffer_pools = bool(processing_config.use_buffer_pool)
+        if self.use_buffer_pools:
+            for _ in range(self.n_buffer_pools):
+                self._free_buffer_pools.put(BufferPool())
+        self.max_in_flight = len(STAGES) * (queue_size + 1)
+        self.busy_ns = {stage: 0 for stage in STAGES}
+        self.n_frames = {stage: 0 for stage in STAGES}
+        self._stage_functions = {'rectify': self._rectify, 'segment': self._segment, 'vectorize': self._vectorize,
+                                 'render': self._render}
+        self._threads = [threading.Thread(target=self._stage_loop, args=(stage_idx,), daemon=True,
+                                          name=f'PipelineStage-{stage}')
+                         for stage_idx, stage in enumerate(STAGES)]
+        self._next_seq = 0
+        self._n_collected = 0
+        for stage_idx, stage in enumerate(STAGES):
+            METRICS.register_gauge(f'stage_queue_depth_{stage}', self.queues[stage_idx].qsize,
+                                   help_text=f'Frames waiting in front of the {stage} stage.')
+
+    def start(self) -> 'StagedPipeline':
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    @property
+    def n_in_flight(self) -> int:
+        """Frames submitted and not collected yet."""
+        return self._next_seq - self._n_collected
+
+    def can_submit(self) -> bool:
+        return not self.queues[0].full() and self.n_in_flight < self.max_in_flight
+
+    def submit(self, frame, frame_trace: FrameTrace = None, qt_img_input=None) -> int:
+        """Queues a frame (bgr array or planvec.frame_ring.FrameSlot) for rectification. A frame slot is retained
+        until the frame is rectified. Returns the sequence number of the frame, results are returned in this order."""
+        if isinstance(frame, FrameSlot):
+            frame.retain()
+        result = StagedResult(self._next_seq, frame_trace=frame_trace, qt_img_input=qt_img_input)
+        result.frame = frame
+        self._next_seq += 1
+        self.queues[0].put(result)
+        return result.seq
+
+    def collect(self, timeout: float = 0.0) -> List[StagedResult]:
+        """Returns the finished frames, waits at most timeout seconds for the first one if none is ready yet."""
+        results = []
+        try:
+            if timeout > 0 and self.n_in_flight > 0:
+                results.append(self.queues[-1].get(timeout=timeout))
+            while True:
+                results.append(self.queues[-1].get_nowait())
+        except queue.Empty:
+            pass
+        self._n_collected += len(results)
+        return results
+
+    def update_settings(self, processing_config: DotMap, calibration=None) -> None:
+        """Changed processing config or calibration, it applies to the next frame entering a stage."""
+        self.config = processing_config
+        self.calibration = calibration
+
+    def queue_depths(self) -> dict:
+        return {stage: self.queues[stage_idx].qsize() for stage_idx, stage in enumerate(STAGES)}
+
+    def stats(self) -> dict:
+        """Queue depth, number of frames and busy time (seconds) per stage."""
+        return {stage: {'queue_depth': self.queues[stage_idx].qsize(), 'frames': self.n_frames[stage],
+                        'busy_s': self.busy_ns[stage] / 1e9}
+                for stage_idx, stage in enumerate(STAGES)}
+
+    def close(self) -> None:
+        """Lets the frames in flight pass and stops the stage threads."""
+        self.queues[0].put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        for stage in STAGES:
+            METRICS.unregister_gauge(f'stage_queue_depth_{stage}')
+
+    def _stage_loop(self, stage_idx: int) -> None:
+        stage = STAGES[stage_idx]
+        if self.trace_recorder is not None:
+            self.trace_recorder.register_thread_name(threading.current_thread().name)
+        stage_function = self._stage_functions[stage]
+        in_queue, out_queue = self.queues[stage_idx], self.queues[stage_idx + 1]
+        while True:
+            result = in_queue.get()
+            if result is _STOP:
+                if stage_idx < len(STAGES) - 1:
+                    out_queue.put(_STOP)
+                break
+            start_ns = perf_counter_ns()
+            try:
+                stage_function(result)
+            except Exception:
+                result.status, result.error = STATUS_ERROR, traceback.format_exc()
+                self._release_frame(result)
+            finally:
+                if stage == 'vectorize' or result.status == STATUS_ERROR:
+                    self._release_buffer_pool(result)
+            self.busy_ns[stage] += perf_counter_ns() - start_ns
+            self.n_frames[stage] += 1
+            out_queue.put(result)  # blocks while the next stage is behind
+
+    def _rectify(self, result: StagedResult) -> None:
+        if self.use_buffer_pools:  # waits while all pools are held by frames further down the pipeline
+            result.buffer_pool = self._free_buffer_pools.get()
+            result.buffer_pool.begin_frame()
+        img = result.frame.array if isinstance(result.frame, FrameSlot) else result.frame
+        try:
+            with trace_span(result.frame_trace, 'rectify'):
+                # Without buffer pool the stages may write into their input, so they get a copy like in run_pipeline
+                frame, warped_ok = rectify(img if result.buffer_pool is not None else img.copy(), self.config,
+                                           self.color_ranges, tracker=self.tracker, calibration=self.calibration,
+                                           buffer_pool=result.buffer_pool)
+            if not warped_ok:
+                result.status, result.qt_img_out = STATUS_NOT_RECTIFIED, conversions.bgr2qt(frame.bgr)
+                frame = None
+        finally:
+            del img
+            self._release_frame(result)
+        result.frame = frame
+
+    def _segment(self, result: StagedResult) -> None:
+        if result.status != STATUS_OK:
+            return
+        with trace_span(result.frame_trace, 'segment'):
+            result.regions_mask, _ = segment(result.frame, self.config, self.color_ranges)
+        result.frame = None
+
+    def _vectorize(self, result: StagedResult) -> None:
+        if result.status != STATUS_OK:
+            return
+        with trace_span(result.frame_trace, 'vectorize'):
+            contours = vectorize(result.regions_mask, self.config, buffer_pool=result.buffer_pool)
+        if contours is None:
+            result.status, result.qt_img_out = STATUS_NO_CONTOURS, conversions.gray2qt(result.regions_mask)
+        else:
+            result.contours = contours
+        result.regions_mask = None  # a pooled buffer, the pool is returned after this stage
+
+    def _render(self, result: StagedResult) -> None:
+        if result.status != STATUS_OK:
+            return
+        with trace_span(result.frame_trace, 'render'):
+            if self.preview_renderer is None:
+                self.ax.clear()
+            self.ax, result.qt_img_out = render(result.contours, self.ax, self.config,
+                                                preview_renderer=self.preview_renderer)
+
+    @staticmethod
+    def _release_frame(result: StagedResult) -> None:
+        if isinstance(result.frame, FrameSlot):
+            result.frame.release()
+        result.frame = None
+
+    def _release_buffer_pool(self, result: StagedResult) -> None:
+        if result.buffer_pool is not None:
+            self._free_buffer_pools.put(result.buffer_pool)
+            result.buffer_pool = None
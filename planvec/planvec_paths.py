@@ -4,4 +4,8 @@ from pathlib import Path
 PROJECT_ROOT_PATH = Path(os.path.dirname(os.path.dirname(__file__)))
 DATA_REPOSITORY_DIR_PATH = os.path.join(PROJECT_ROOT_PATH, 'data')
 DATA_DESKTOP_DIR_PATH = Path.home() / 'Desktop' / 'planvec'
+CALIBRATION_DIR_PATH = DATA_DESKTOP_DIR_PATH / 'calibration'
+TRACES_DIR_PATH = DATA_DESKTOP_DIR_PATH / 'traces'
+RECORDINGS_DIR_PATH = DATA_DESKTOP_DIR_PATH / 'recordings'
+METRICS_FILE_PATH = DATA_DESKTOP_DIR_PATH / 'metrics' / 'planvec.prom'
 UI_GENERATED_PATH = PROJECT_ROOT_PATH / 'planvec/gui/ui_generated'
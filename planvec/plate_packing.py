@@ -0,0 +1,189 @@
+"""
+Packing of drawings with mixed sizes onto as few plates as possible, for plates which do not fit a fixed grid.
+
+Every plate is a MaxRects bin: it keeps the list of maximal free rectangles (rectangles of free space which are not
+contained in another one). A drawing goes into the free rectangle chosen by the placement rule, rotated by 90 degrees
+if that is better. The free rectangles overlapping the placed drawing are split into the up to four maximal rectangles
+around it and contained ones are pruned. Placement rules:
+
+    best_short_side_fit: the free rectangle which leaves the shortest side over, good for mixed sizes
+    bottom_left: the lowest top edge, then leftmost position, fills rows like a grid for equally sized drawings
+
+Plates are filled one after another: the remaining drawings are packed largest first with every rule and the plate
+with the highest utilisation is kept, the drawings which did not fit go on to the next plate. Drawings of equal size
+are packed as a group. After every placement the sizes which still fit into a free rectangle are found for all
+remaining groups at once with numpy, the largest of them is placed next, such that no time is spent on trying
+drawings which do not fit anymore.
+"""
+import numpy as np
+
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+EPS = 1e-6  # sizes are in cm, floats read from pdf page sizes
+BEST_SHORT_SIDE_FIT = 'best_short_side_fit'
+BOTTOM_LEFT = 'bottom_left'
+PLACEMENT_RULES = (BEST_SHORT_SIDE_FIT, BOTTOM_LEFT)
+
+
+class PackedItem:
+    """A drawing on a plate, x and y are the lower left corner. If rotated, it covers height x width on the plate."""
+
+    def __init__(self, key: Hashable, width: float, height: float, x: float, y: float, rotated: bool) -> None:
+        self.key = key
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.rotated = rotated
+
+    @property
+    def area(self) -> float:
+        return self.width * self.height
+
+
+class PackedPlate:
+    """A plate of width x height and the items packed onto it, with spacing between items (not at the edges)."""
+
+    def __init__(self, width: float, height: float, spacing: float = 0.0, rule: str = BEST_SHORT_SIDE_FIT) -> None:
+        if rule not in PLACEMENT_RULES:
+            raise ValueError(f'Placement rule {rule} not supported, use one of {PLACEMENT_RULES}.')
+        self.width = width
+        self.height = height
+        self.spacing = spacing
+        self.rule = rule
+        self.items = []
+        # Items are packed enlarged by the spacing on a plate enlarged by it, such that they end up spacing apart
+        self._free_rects = [(0.0, 0.0, width + spacing, height + spacing)]
+        self._max_free_width = width + spacing
+        self._max_free_height = height + spacing
+
+    @property
+    def utilisation(self) -> float:
+        """Fraction of the plate area covered by items."""
+        return sum(item.area for item in self.items) / (self.width * self.height)
+
+    def insert(self, key: Hashable, width: float, height: float, allow_rotation: bool = True) -> Optional[PackedItem]:
+        """Packs an item of width x height, returns None if it does not fit."""
+        padded_width, padded_height = width + self.spacing, height + self.spacing
+        if not self._may_fit(padded_width, padded_height) and \
+                not (allow_rotation and self._may_fit(padded_height, padded_width)):
+            return None
+        orientations = ((padded_width, padded_height, False), (padded_height, padded_width, True))
+        best_score, best_placement = None, None
+        for free_x, free_y, free_width, free_height in self._free_rects:
+            for item_width, item_height, rotated in orientations[:2 if allow_rotation else 1]:
+                if item_width <= free_width + EPS and item_height <= free_height + EPS:
+                    if self.rule == BOTTOM_LEFT:
+                        score = (free_y + item_height, free_x)
+                    else:
+                        left_over_x, left_over_y = free_width - item_width, free_height - item_height
+                        score = (min(left_over_x, left_over_y), max(left_over_x, left_over_y))
+                    if best_score is None or score < best_score:
+                        best_score, best_placement = score, (free_x, free_y, item_width, item_height, rotated)
+        if best_placement is None:
+            return None
+        x, y, item_width, item_height, rotated = best_placement
+        self._split_free_rects(x, y, item_width, item_height)
+        item = PackedItem(key, width, height, x, y, rotated)
+        self.items.append(item)
+        return item
+
+    def fits(self, widths: np.ndarray, heights: np.ndarray, allow_rotation: bool = True) -> np.ndarray:
+        """Mask of the item sizes which fit into one of the free rectangles."""
+        free_rects = np.array(self._free_rects, dtype=np.float64).reshape(-1, 4)
+        free_widths, free_heights = free_rects[:, 2] + EPS, free_rects[:, 3] + EPS
+        widths, heights = widths + self.spacing, heights + self.spacing
+        if allow_rotation:  # fits in one of the orientations iff the short side fits the short and the long the long
+            widths, heights = np.minimum(widths, heights), np.maximum(widths, heights)
+            free_widths, free_heights = np.minimum(free_widths, free_heights), np.maximum(free_widths, free_heights)
+        return ((widths[:, None] <= free_widths) & (heights[:, None] <= free_heights)).any(axis=1)
+
+    def _may_fit(self, width: float, height: float) -> bool:
+        return width <= self._max_free_width + EPS and height <= self._max_free_height + EPS
+
+    def _split_free_rects(self, x: float, y: float, width: float, height: float) -> None:
+        right, top = x + width, y + height
+        free_rects = []
+        for free_rect in self._free_rects:
+            free_x, free_y, free_width, free_height = free_rect
+            free_right, free_top = free_x + free_width, free_y + free_height
+            if x >= free_right - EPS or right <= free_x + EPS or y >= free_top - EPS or top <= free_y + EPS:
+                free_rects.append(free_rect)  # no overlap
+                continue
+            if x > free_x + EPS:
+                free_rects.append((free_x, free_y, x - free_x, free_height))
+            if right < free_right - EPS:
+                free_rects.append((right, free_y, free_right - right, free_height))
+            if y > free_y + EPS:
+                free_rects.append((free_x, free_y, free_width, y - free_y))
+            if top < free_top - EPS:
+                free_rects.append((free_x, top, free_width, free_top - top))
+        self._free_rects = _prune_contained(free_rects)
+        self._max_free_width = max((rect[2] for rect in self._free_rects), default=0.0)
+        self._max_free_height = max((rect[3] for rect in self._free_rects), default=0.0)
+
+
+def pack_rectangles(sizes: Sequence[Tuple[Hashable, float, float]], plate_width: float, plate_height: float,
+                    spacing: float = 0.0, allow_rotation: bool = True) -> List[PackedPlate]:
+    """Packs items given as (key, width, height) onto plates of plate_width x plate_height. Raises a ValueError if
+    an item does not fit onto an empty plate."""
+    for key, width, height in sizes:
+        if not _fits_empty_plate(width, height, plate_width, plate_height, allow_rotation):
+            raise ValueError(f'{key} of {width}x{height} does not fit onto a plate of {plate_width}x{plate_height}.')
+    keys_by_size = {}
+    for key, width, height in sizes:
+        keys_by_size.setdefault((width, height), []).append(key)
+    size_groups = sorted(keys_by_size.items(), key=lambda item: (max(item[0]), item[0][0] * item[0][1]), reverse=True)
+    widths = np.array([size[0] for size, _ in size_groups], dtype=np.float64)
+    heights = np.array([size[1] for size, _ in size_groups], dtype=np.float64)
+    n_keys = np.array([len(keys) for _, keys in size_groups])
+    n_packed = np.zeros_like(n_keys)  # per size group, keys are packed in order
+    plates = []
+    while (n_packed < n_keys).any():
+        plate, n_packed = max((_fill_plate(size_groups, widths, heights, n_keys, n_packed, plate_width, plate_height,
+                                           spacing, allow_rotation, rule) for rule in PLACEMENT_RULES),
+                              key=lambda filled: filled[0].utilisation)
+        plates.append(plate)
+    return plates
+
+
+def _fill_plate(size_groups: List[tuple], widths: np.ndarray, heights: np.ndarray, n_keys: np.ndarray,
+                n_packed: np.ndarray, plate_width: float, plate_height: float, spacing: float, allow_rotation: bool,
+                rule: str) -> (PackedPlate, np.ndarray):
+    """Packs as many of the remaining items of the ((width, height), keys) size groups as possible onto a new plate,
+    returns it and the number of packed items per group afterwards. n_packed is not modified, such that the same
+    items can be packed with another rule again."""
+    plate = PackedPlate(plate_width, plate_height, spacing, rule)
+    n_packed = n_packed.copy()
+    candidate_indices = np.flatnonzero(n_packed < n_keys)
+    while True:
+        # Sizes which do not fit now will not fit later on this plate either
+        candidate_indices = candidate_indices[plate.fits(widths[candidate_indices], heights[candidate_indices],
+                                                         allow_rotation)]
+        if len(candidate_indices) == 0:
+            return plate, n_packed
+        group_idx = candidate_indices[0]  # the largest remaining size which fits
+        (width, height), keys = size_groups[group_idx]
+        plate.insert(keys[n_packed[group_idx]], width, height, allow_rotation)
+        n_packed[group_idx] += 1
+        if n_packed[group_idx] == n_keys[group_idx]:
+            candidate_indices = candidate_indices[1:]
+
+
+def _fits_empty_plate(width: float, height: float, plate_width: float, plate_height: float,
+                      allow_rotation: bool) -> bool:
+    if width <= plate_width + EPS and height <= plate_height + EPS:
+        return True
+    return allow_rotation and height <= plate_width + EPS and width <= plate_height + EPS
+
+
+def _prune_contained(rects: List[Tuple[float, float, float, float]]) -> List[Tuple[float, float, float, float]]:
+    """Removes the rectangles contained in another one, of equal rectangles one is kept."""
+    # Larger rectangles first: a rectangle can only be contained in one which comes before it
+    rects = sorted(set(rects), key=lambda rect: rect[2] * rect[3], reverse=True)
+    kept = []
+    for x, y, width, height in rects:
+        if not any(x >= kept_x - EPS and y >= kept_y - EPS and x + width <= kept_x + kept_width + EPS and
+                   y + height <= kept_y + kept_height + EPS for kept_x, kept_y, kept_width, kept_height in kept):
+            kept.append((x, y, width, height))
+    return kept
@@ -0,0 +1,126 @@
+"""
+Frame to frame tracking of the red corner dots. The sheet barely moves while a drawing is held under the camera, so
+instead of searching the whole frame every time, the dots are looked for in small windows around their last known
+positions. The full-frame search of planvec.img_proc.find_red_dot_centroids only runs when tracking is lost.
+"""
+import cv2 as cv
+import numpy as np
+
+from planvec import img_proc
+from planvec.color_range import HSVColorRange
+from planvec.frame_context import FrameContext, as_frame_context
+from planvec.utils.timing import timeit
+
+from typing import List, Optional, Tuple, Union
+
+Point = Tuple[float, float]
+
+
+class RedDotTracker:
+    """Remembers the last corner centroids (x, y) and the perspective transformation derived from them.
+
+    Arguments
+    ---------
+        red_color_ranges: list of HSVColorRange's for red low and red high filter ranges
+        n_dots: number of corner dots
+        window_radius: half side length in pixels of the square search window around each last known centroid
+        move_tolerance: if no corner moved more than this many pixels, the cached transformation is reused
+        pyramid_level: pyramid level of the full-frame search, see img_proc.find_red_dot_centroids
+        refine_radius: refinement window margin of the full-frame search, see img_proc.find_red_dot_centroids
+    """
+
+    def __init__(self, red_color_ranges: List[HSVColorRange], n_dots: int = 4, window_radius: int = 48,
+                 move_tolerance: float = 1.0, pyramid_level: int = 0, refine_radius: int = 8) -> None:
+        self.red_color_ranges = red_color_ranges
+        self.n_dots = n_dots
+        self.window_radius = window_radius
+        self.move_tolerance = move_tolerance
+        self.pyramid_level = pyramid_level
+        self.refine_radius = refine_radius
+        self.corners = None  # corners the cached transformation was computed for
+        self.last_corners = None  # corners found in the last frame
+        self._transformation = None
+        self._transformation_dst_corners = None
+        # Counters
+        self.n_tracking_hits = 0  # all dots found in their windows
+        self.n_tracking_misses = 0  # tracking lost, full search needed
+        self.n_full_searches = 0
+        self.n_full_search_failures = 0
+        self.n_transformation_reuses = 0
+
+    @classmethod
+    def from_config(cls, processing_config, color_ranges: dict) -> 'RedDotTracker':
+        """Tracker with the settings of the processing config section and the red ranges of the color ranges."""
+        return cls([color_range for key, color_range in color_ranges.items() if 'red' in key],
+                   window_radius=processing_config.tracking_window_radius,
+                   move_tolerance=processing_config.tracking_move_tolerance,
+                   pyramid_level=processing_config.red_dot_pyramid_level,
+                   refine_radius=processing_config.red_dot_refine_radius)
+
+    def reset(self) -> None:
+        """Forget the tracked corners, the next frame runs a full search."""
+        self.corners = None
+        self.last_corners = None
+        self._transformation = None
+        self._transformation_dst_corners = None
+
+    def stats(self) -> dict:
+        return {'tracking_hits': self.n_tracking_hits,
+                'tracking_misses': self.n_tracking_misses,
+                'full_searches': self.n_full_searches,
+                'full_search_failures': self.n_full_search_failures,
+                'transformation_reuses': self.n_transformation_reuses}
+
+    @timeit
+    def locate(self, img: Union[np.ndarray, FrameContext]) -> Optional[List[Point]]:
+        """Returns the corner centroids in the order of img_proc.sort_points_clockwise or None if they cannot be
+        found in the frame at all."""
+        frame = as_frame_context(img)
+        if self.last_corners is not None:
+            corners = self._track(frame)
+            if corners is not None:
+                self.n_tracking_hits += 1
+                self.last_corners = corners
+                return corners
+            self.n_tracking_misses += 1
+
+        self.n_full_searches += 1
+        corners = img_proc.find_red_dot_centroids(frame, self.red_color_ranges, n_dots=self.n_dots,
+                                                  pyramid_level=self.pyramid_level, refine_radius=self.refine_radius)
+        if corners is None:
+            self.n_full_search_failures += 1
+            self.reset()
+            return None
+        self.last_corners = corners
+        return corners
+
+    def _track(self, frame: FrameContext) -> Optional[List[Point]]:
+        """Look for each dot in a window around its last position. Fails if any dot is missing or touches its
+        window border, i.e. might have moved (partially) out of the window."""
+        height, width = frame.shape[:2]
+        corners = []
+        for last_x, last_y in self.last_corners:
+            x_min, y_min = max(0, int(last_x) - self.window_radius), max(0, int(last_y) - self.window_radius)
+            x_max = min(width, int(last_x) + self.window_radius + 1)
+            y_max = min(height, int(last_y) + self.window_radius + 1)
+            window = (x_min, y_min, x_max, y_max)
+            largest_region = img_proc.find_largest_red_region(frame, self.red_color_ranges, window)
+            if largest_region is None or img_proc.window_border_touched(largest_region[1], window, (width, height)):
+                return None
+            corners.append(largest_region[0])
+        return corners
+
+    def get_transformation(self, dst_corners: List[List[float]]) -> np.ndarray:
+        """Perspective transformation from the last located corners to dst_corners. The cached transformation is
+        reused as long as no corner moved more than move_tolerance and the destination did not change."""
+        dst_corners = np.float32(dst_corners)
+        src_corners = np.float32(self.last_corners)
+        if (self._transformation is not None
+                and np.array_equal(dst_corners, self._transformation_dst_corners)
+                and np.abs(src_corners - self.corners).max() <= self.move_tolerance):
+            self.n_transformation_reuses += 1
+            return self._transformation
+        self._transformation = cv.getPerspectiveTransform(src_corners, dst_corners)
+        self._transformation_dst_corners = dst_corners
+        self.corners = src_corners
+        return self._transformation
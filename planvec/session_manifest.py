@@ -0,0 +1,148 @@
+"""
+Index of the files saved in a session (a date folder of the DataManager). Listing the team folders on every save and
+jam gets slow on network-synced Desktop folders with thousands of files, so every saved file is recorded in an SQLite
+database in the date folder instead, with school, team, image index, kind (the file name suffix, e.g. 'output'), file
+type, size and checksum. Every record is written in a transaction once the file is complete, so the manifest never
+lists a half-written file.
+
+The folders stay the source of truth: the manifest is rebuilt from them if it does not exist (e.g. the first session
+after an update) and can be rebuilt any time with rebuild, e.g. after files were copied or deleted by hand.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from typing import List, Optional
+
+MANIFEST_FILE_NAME = 'manifest.sqlite'
+CHECKSUM_CHUNK_SIZE = 2 ** 20
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS teams (
+    school TEXT NOT NULL,
+    team TEXT NOT NULL,
+    PRIMARY KEY (school, team)
+);
+CREATE TABLE IF NOT EXISTS files (
+    school TEXT NOT NULL,
+    team TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (school, team, file_name)
+);
+'''
+
+
+def file_checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHECKSUM_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def parse_file_name(file_name: str) -> Optional[tuple]:
+    """(idx, kind, file_type) of a saved file name '{idx}_{team}_{date_time_tag}_{kind}.{file_type}', None if the
+    name does not follow this format. kind is '' for files without suffix."""
+    stem, _, file_type = file_name.rpartition('.')
+    idx, _, rest = stem.partition('_')
+    if not stem or not idx.isdigit() or not rest:
+        return None
+    kind = rest.rsplit('_', 1)[-1]
+    return int(idx), kind if not kind[:1].isdigit() else '', file_type
+
+
+class SessionManifest:
+    """Manifest of the date folder dir_path. It is safe to use from several threads, e.g. the DataManager's writer
+    threads, all access goes through one connection guarded by a lock."""
+
+    def __init__(self, dir_path: str) -> None:
+        self.dir_path = dir_path
+        self.path = os.path.join(dir_path, MANIFEST_FILE_NAME)
+        is_new = not os.path.exists(self.path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+        if is_new:
+            self.rebuild()
+
+    def add_team(self, school_name: str, team_name: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO teams VALUES (?, ?)', (school_name, team_name))
+
+    def record(self, school_name: str, team_name: str, file_path: str) -> None:
+        """Records a completely written file of a team folder."""
+        file_name = os.path.basename(file_path)
+        idx, kind, file_type = parse_file_name(file_name)
+        size, sha256 = os.path.getsize(file_path), file_checksum(file_path)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO teams VALUES (?, ?)', (school_name, team_name))
+            self._connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (school_name, team_name, file_name, idx, kind, file_type, size, sha256,
+                                      time.time()))
+
+    def remove(self, school_name: str, team_name: str, file_names: List[str]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM files WHERE school = ? AND team = ? AND file_name = ?',
+                                         [(school_name, team_name, file_name) for file_name in file_names])
+
+    def school_names(self) -> List[str]:
+        return [row[0] for row in self._query('SELECT DISTINCT school FROM teams ORDER BY school')]
+
+    def team_names(self, school_name: str) -> List[str]:
+        return [row[0] for row in self._query('SELECT team FROM teams WHERE school = ? ORDER BY team',
+                                              (school_name,))]
+
+    def file_names(self, school_name: str, team_name: str, endswith: str = '') -> List[str]:
+        """Names of the files of a team ending with endswith, in the order of their index."""
+        return [row[0] for row in self._query('SELECT file_name FROM files WHERE school = ? AND team = ? '
+                                              'ORDER BY idx, file_name', (school_name, team_name))
+                if row[0].endswith(endswith)]
+
+    def max_idx(self, school_name: str, team_name: str) -> Optional[int]:
+        """Highest image index of a team, None if it has no files."""
+        return self._query('SELECT MAX(idx) FROM files WHERE school = ? AND team = ?', (school_name, team_name))[0][0]
+
+    def n_files(self) -> int:
+        return self._query('SELECT COUNT(*) FROM files')[0][0]
+
+    def _query(self, sql: str, parameters: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def rebuild(self) -> None:
+        """Replaces the manifest by the team folders and files found in the date folder."""
+        teams, files = [], []
+        for school_name in _sub_dir_names(self.dir_path):
+            school_dir_path = os.path.join(self.dir_path, school_name)
+            for team_name in _sub_dir_names(school_dir_path):
+                teams.append((school_name, team_name))
+                team_dir_path = os.path.join(school_dir_path, team_name)
+                for entry in os.scandir(team_dir_path):
+                    parsed = parse_file_name(entry.name) if entry.is_file() else None
+                    if parsed is not None:
+                        stat = entry.stat()
+                        files.append((school_name, team_name, entry.name) + parsed +
+                                     (stat.st_size, file_checksum(entry.path), stat.st_mtime))
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM teams')
+            self._connection.execute('DELETE FROM files')
+            self._connection.executemany('INSERT INTO teams VALUES (?, ?)', teams)
+            self._connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', files)
+        print(f'Rebuilt manifest {self.path}: {len(teams)} teams, {len(files)} files.')
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def _sub_dir_names(dir_path: str) -> List[str]:
+    return sorted(entry.name for entry in os.scandir(dir_path) if entry.is_dir())
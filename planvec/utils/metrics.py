@@ -0,0 +1,239 @@
+"""
+Optional metrics of the running application in Prometheus text format, either served on localhost (GET /metrics)
+or written periodically to a file (e.g. for the node exporter's textfile collector).
+
+The registry is disabled by default, all recording functions then return immediately. When enabled, recording is a
+dictionary update and all formatting happens only when the metrics are scraped or written. Exported are:
+    - planvec_function_duration_seconds: histograms of all @timeit-decorated functions, see planvec.utils.timing
+    - planvec_operation_duration_seconds: histograms of operations timed with timed_operation, e.g. saving and jamming
+    - counters (planvec_<name>_total) and gauges (planvec_<name>) registered by the application
+"""
+import functools
+import itertools
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from time import monotonic, perf_counter_ns
+
+from planvec.utils import timing
+from planvec.utils.timing import TimingStats
+
+from typing import Callable, Dict, List, Union
+
+METRIC_PREFIX = 'planvec'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Histogram bucket boundaries in seconds (upper bounds), from 100 us to 10 s
+BUCKET_BOUNDS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class MetricsRegistry:
+    """Counters, gauges and operation timings. Gauges are callables which are evaluated on collection."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.counters = {}  # name -> (value, help)
+        self.gauges = {}  # name -> (callable, help)
+        self.operations = {}  # name -> TimingStats
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, help_text: str = '') -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            current_value, current_help = self.counters.get(name, (0, help_text))
+            self.counters[name] = (current_value + value, current_help or help_text)
+
+    def drain_counters(self) -> Dict[str, tuple]:
+        """Returns the counters as name -> (value, help) and resets them, e.g. to forward the counts of a worker
+        process to the registry of the main process with merge_counters."""
+        with self._lock:
+            counters, self.counters = self.counters, {}
+        return counters
+
+    def merge_counters(self, counters: Dict[str, tuple]) -> None:
+        for name, (value, help_text) in counters.items():
+            self.inc(name, value, help_text=help_text)
+
+    def register_gauge(self, name: str, get_value: Callable[[], float], help_text: str = '') -> None:
+        self.gauges[name] = (get_value, help_text)
+
+    def unregister_gauge(self, name: str) -> None:
+        self.gauges.pop(name, None)
+
+    def observe_ns(self, operation: str, elapsed_ns: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if operation not in self.operations:
+                self.operations[operation] = TimingStats(operation)
+            self.operations[operation].add(elapsed_ns)
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            operations = dict(self.operations)
+        for name, (value, help_text) in sorted(counters.items()):
+            metric_name = f'{METRIC_PREFIX}_{name}_total'
+            lines += [f'# HELP {metric_name} {help_text or name}', f'# TYPE {metric_name} counter',
+                      f'{metric_name} {value}']
+        for name, (get_value, help_text) in sorted(self.gauges.items()):
+            metric_name = f'{METRIC_PREFIX}_{name}'
+            try:
+                value = float(get_value())
+            except Exception:  # a gauge must never break the export, e.g. if its source is being torn down
+                continue
+            lines += [f'# HELP {metric_name} {help_text or name}', f'# TYPE {metric_name} gauge',
+                      f'{metric_name} {value}']
+        lines += _render_histograms(f'{METRIC_PREFIX}_function_duration_seconds', 'function',
+                                    'Run time of @timeit-decorated functions.', timing.TimeitRecord.record)
+        lines += _render_histograms(f'{METRIC_PREFIX}_operation_duration_seconds', 'operation',
+                                    'Run time of saving, jamming and other operations.', operations)
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histograms(metric_name: str, label: str, help_text: str,
+                       stats_by_name: Dict[str, TimingStats]) -> List[str]:
+    """Prometheus histograms from the log-linear histograms of TimingStats. The fine bucket containing a bound is
+    counted as below the bound, i.e. the bucket counts are accurate up to the fine bucket width (~3%)."""
+    lines = [f'# HELP {metric_name} {help_text}', f'# TYPE {metric_name} histogram']
+    bound_indices = [timing._histogram_index(int(bound_s * timing.NS_PER_S)) for bound_s in BUCKET_BOUNDS_S]
+    for name, stats in sorted(stats_by_name.items()):
+        if stats.count == 0:
+            continue
+        cumulative_counts = list(itertools.accumulate(stats.histogram))
+        for bound_s, bound_idx in zip(BUCKET_BOUNDS_S, bound_indices):
+            lines.append(f'{metric_name}_bucket{{{label}="{name}",le="{bound_s}"}} {cumulative_counts[bound_idx]}')
+        lines.append(f'{metric_name}_bucket{{{label}="{name}",le="+Inf"}} {stats.count}')
+        lines.append(f'{metric_name}_sum{{{label}="{name}"}} {stats.total_ns / timing.NS_PER_S}')
+        lines.append(f'{metric_name}_count{{{label}="{name}"}} {stats.count}')
+    return lines
+
+
+METRICS = MetricsRegistry()
+
+
+class CounterRate:
+    """Gauge callable: per-second rate of a counter between two collections, e.g. frames per second."""
+
+    def __init__(self, counter_name: str, registry: MetricsRegistry = METRICS) -> None:
+        self.counter_name = counter_name
+        self.registry = registry
+        self._last_value = 0
+        self._last_time = monotonic()
+
+    def __call__(self) -> float:
+        value = self.registry.counters.get(self.counter_name, (0, ''))[0]
+        now = monotonic()
+        rate = (value - self._last_value) / (now - self._last_time) if now > self._last_time else 0.0
+        self._last_value, self._last_time = value, now
+        return rate
+
+
+def timed_operation(operation: str):
+    """Decorator recording the run time of a function as operation in METRICS (if enabled)."""
+    def decorator(method):
+        @functools.wraps(method)
+        def timed(*args, **kw):
+            if not METRICS.enabled:
+                return method(*args, **kw)
+            start_time = perf_counter_ns()
+            try:
+                return method(*args, **kw)
+            finally:
+                METRICS.observe_ns(operation, perf_counter_ns() - start_time)
+        return timed
+    return decorator
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHttpExporter:
+    """Serves METRICS on http://<host>:<port>/metrics from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry = METRICS, host: str = '127.0.0.1', port: int = 9464) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # no log line per scrape
+                pass
+
+        self.server = _ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsHttpExporter', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/metrics'
+
+    def start(self) -> 'MetricsHttpExporter':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsFileExporter:
+    """Writes METRICS to a file every interval_s seconds from a daemon thread. The file is replaced atomically, such
+    that readers never see a partially written file."""
+
+    def __init__(self, path: Union[str, Path], registry: MetricsRegistry = METRICS, interval_s: float = 15) -> None:
+        self.path = Path(path)
+        self.registry = registry
+        self.interval_s = interval_s
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='MetricsFileExporter', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_s):
+            self.write()
+
+    def write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def start(self) -> 'MetricsFileExporter':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.write()
+
+
+def start_metrics_exporter(metrics_config, default_file_path: Path):
+    """Enables METRICS and starts the exporter of the metrics config section ('http' or 'file' mode). Returns the
+    exporter or None if metrics are disabled."""
+    if not metrics_config.enabled:
+        return None
+    METRICS.enabled = True
+    if metrics_config.mode == 'file':
+        file_path = metrics_config.file_path or default_file_path
+        exporter = MetricsFileExporter(file_path, interval_s=metrics_config.interval_s).start()
+        print(f'Writing metrics to {file_path} every {metrics_config.interval_s} s.')
+    elif metrics_config.mode == 'http':
+        exporter = MetricsHttpExporter(host=metrics_config.host, port=metrics_config.port).start()
+        print(f'Serving metrics on {exporter.url}.')
+    else:
+        raise ValueError(f'Metrics mode {metrics_config.mode} not supported, use \'http\' or \'file\'.')
+    return exporter
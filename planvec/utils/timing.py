@@ -1,57 +1,207 @@
-from time import time
+"""
+Lightweight function timing. Functions decorated with @timeit record their run times in nanoseconds (perf_counter_ns)
+into bounded per-function statistics: a rolling window of the most recent calls and a log-linear histogram (HDR
+style, every power of two is split into 2**HISTOGRAM_SUB_BITS linear buckets) for percentiles over all calls. Memory
+use per function is fixed no matter how long the application runs.
+
+Timing can be switched off in two ways:
+    - PLANVEC_TIMING=0 in the environment when planvec is imported: @timeit returns the function itself, i.e. there
+      is no wrapper and no overhead at all
+    - set_timing_enabled(False) at runtime: the wrapper only checks a flag and calls the function
+"""
+import functools
+import os
+from collections import deque
+from time import perf_counter_ns
+
+from typing import Dict, List, Sequence
+
+WINDOW_SIZE = 1000  # number of recent calls kept per function
+HISTOGRAM_SUB_BITS = 5  # 32 buckets per power of two, i.e. percentiles are accurate to ~3%
+HISTOGRAM_SIZE = (64 - HISTOGRAM_SUB_BITS + 1) << HISTOGRAM_SUB_BITS  # covers all 64 bit durations
+DEFAULT_PERCENTILES = (50, 95, 99)
+NS_PER_S = 1e9
+
+TIMING_COMPILED_IN = os.environ.get('PLANVEC_TIMING', '1').lower() not in ('0', 'false', 'off', 'no')
+
+
+def _histogram_index(value_ns: int) -> int:
+    """Bucket of a duration: values below 2**HISTOGRAM_SUB_BITS get their own bucket, above the bucket width doubles
+    with every power of two."""
+    n_bits = value_ns.bit_length()
+    if n_bits <= HISTOGRAM_SUB_BITS:
+        return value_ns
+    shift = n_bits - HISTOGRAM_SUB_BITS - 1
+    return ((shift + 1) << HISTOGRAM_SUB_BITS) + (value_ns >> shift) - (1 << HISTOGRAM_SUB_BITS)
+
+
+def _histogram_bucket_bounds(index: int) -> (int, int):
+    """Smallest and largest duration (ns) of a histogram bucket."""
+    if index < (1 << HISTOGRAM_SUB_BITS):
+        return index, index
+    shift = (index >> HISTOGRAM_SUB_BITS) - 1
+    mantissa = (index & ((1 << HISTOGRAM_SUB_BITS) - 1)) + (1 << HISTOGRAM_SUB_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class TimingStats:
+    """Bounded run time statistics of a single function. All durations are in nanoseconds."""
+
+    def __init__(self, name: str, window_size: int = WINDOW_SIZE) -> None:
+        self.name = name
+        self.window = deque(maxlen=window_size)
+        self.histogram = [0] * HISTOGRAM_SIZE
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+
+    def add(self, elapsed_ns: int) -> None:
+        self.window.append(elapsed_ns)
+        self.histogram[_histogram_index(elapsed_ns)] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if self.min_ns is None or elapsed_ns < self.min_ns:
+            self.min_ns = elapsed_ns
+        if self.max_ns is None or elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def reset(self) -> None:
+        self.window.clear()
+        self.histogram = [0] * HISTOGRAM_SIZE
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count else float('nan')
+
+    @property
+    def window_mean_ns(self) -> float:
+        return sum(self.window) / len(self.window) if self.window else float('nan')
+
+    def percentile_ns(self, percentile: float) -> float:
+        """Percentile over all calls from the histogram, the upper bound of the bucket it falls into (clipped to the
+        maximum seen)."""
+        if self.count == 0:
+            return float('nan')
+        rank = max(1, int(round(percentile / 100 * self.count)))
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.histogram):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(_histogram_bucket_bounds(index)[1], self.max_ns)
+        return self.max_ns
+
+    def percentiles_ns(self, percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[float, float]:
+        return {percentile: self.percentile_ns(percentile) for percentile in percentiles}
 
 
 class TimeitRecord:
-    record = {}
+    record = {}  # function name -> TimingStats
+    enabled = True
+
+
+def set_timing_enabled(enabled: bool) -> None:
+    """Switch recording on or off at runtime. To remove the timing wrappers completely, set PLANVEC_TIMING=0 in the
+    environment before importing planvec."""
+    TimeitRecord.enabled = enabled
+
+
+def is_timing_enabled() -> bool:
+    return TIMING_COMPILED_IN and TimeitRecord.enabled
+
+
+def _get_stats(method_name: str) -> TimingStats:
+    stats = TimeitRecord.record.get(method_name)
+    if stats is None:
+        stats = TimingStats(method_name)
+        TimeitRecord.record[method_name] = stats
+    return stats
 
 
 def timeit(method, print_out=False):
     """Decorator to time any function."""
+    if not TIMING_COMPILED_IN:
+        return method
     method_name = method.__name__
+    stats = _get_stats(method_name)
 
+    @functools.wraps(method)
     def timed(*args, **kw):
-        start_time = time()
+        if not TimeitRecord.enabled:
+            return method(*args, **kw)
+        start_time = perf_counter_ns()
         result = method(*args, **kw)
-        elapsed_time = round(time() - start_time, 5)
-        if method_name in TimeitRecord.record:
-            TimeitRecord.record[method_name].append(elapsed_time)
-        else:
-            TimeitRecord.record[method_name] = [elapsed_time]
+        elapsed_ns = perf_counter_ns() - start_time
+        stats.add(elapsed_ns)
         if print_out:
-            print(f'Timeit: {method_name:>40} --- {elapsed_time:<7} sec.')
+            print(f'Timeit: {method_name:>40} --- {elapsed_ns / NS_PER_S:<7.5f} sec.')
         return result
     return timed
 
 
+def drain_new_timings(n_sent: Dict[str, int]) -> Dict[str, List[int]]:
+    """Run times in nanoseconds of the calls recorded since the previous drain, e.g. to forward the timings of a worker
+    process to the main process with add_timings. n_sent holds the number of calls drained so far per function and
+    is updated. Only the rolling window is kept, i.e. at most WINDOW_SIZE calls per function are returned."""
+    new_timings = {}
+    for name, stats in TimeitRecord.record.items():
+        n_new = min(stats.count - n_sent.get(name, 0), len(stats.window))
+        if n_new > 0:
+            new_timings[name] = list(stats.window)[-n_new:]
+        n_sent[name] = stats.count
+    return new_timings
+
+
+def add_timings(timings: Dict[str, List[int]]) -> None:
+    """Records run times in nanoseconds per function name, as returned by drain_new_timings."""
+    for name, durations_ns in timings.items():
+        stats = _get_stats(name)
+        for elapsed_ns in durations_ns:
+            stats.add(elapsed_ns)
+
+
 def reset_timing():
     """Resets the recording. All function calls after calling this function are averaged irrespectively from precious
     ones."""
-    TimeitRecord.record = {}
+    for stats in TimeitRecord.record.values():
+        stats.reset()
 
 
-def get_timeit_record():
-    """Access the TIMEIT_RECORD container which stores all timed functions."""
-    return TimeitRecord.record
+def get_timeit_record() -> Dict[str, List[float]]:
+    """Recent run times in seconds of all timed functions which have been called, at most WINDOW_SIZE per function."""
+    return {name: [elapsed_ns / NS_PER_S for elapsed_ns in stats.window]
+            for name, stats in TimeitRecord.record.items() if stats.count > 0}
 
 
 def get_avg_timings():
-    """Go through function calls in timeit record and sort them according to mean execution time."""
-    record = get_timeit_record()
-    average_timings = {}
-    for func in record:
-        average_timings[func] = sum(record[func]) / len(record[func])
-    return average_timings
+    """Mean execution time in seconds of every timed function since the last reset."""
+    return {name: stats.mean_ns / NS_PER_S for name, stats in TimeitRecord.record.items() if stats.count > 0}
+
+
+def get_timing_percentiles(percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Dict[float, float]]:
+    """Execution time percentiles in seconds of every timed function since the last reset."""
+    return {name: {percentile: value / NS_PER_S for percentile, value in stats.percentiles_ns(percentiles).items()}
+            for name, stats in TimeitRecord.record.items() if stats.count > 0}
 
 
-def print_avg_timings_sorted(round_places=3):
+def print_avg_timings_sorted(round_places=3, percentiles: Sequence[float] = DEFAULT_PERCENTILES):
     """Print a summary of @timeit-decorated function calls."""
     avg_timings = get_avg_timings()
+    timing_percentiles = get_timing_percentiles(percentiles)
     sorted_funcs = sorted(avg_timings, key=avg_timings.get, reverse=True)
+    percentiles_header = ' '.join(f'{"p" + str(percentile):>8}' for percentile in percentiles)
     print(f'{60 * "="}')
+    print(f'{"function (times in s)":>45} --- {"mean":<8} {percentiles_header} {"calls":>8}')
     total_time = 0
     for func in sorted_funcs:
         timing = round(avg_timings[func], round_places)
         total_time += timing
-        print(f'{func:>45} --- {timing:<5} s')
+        percentile_values = ' '.join(f'{round(timing_percentiles[func][percentile], round_places):>8}'
+                                     for percentile in percentiles)
+        print(f'{func:>45} --- {timing:<8} {percentile_values} {TimeitRecord.record[func].count:>8}')
     print(f'{"Total time recorded":>45} --- \033[1m{round(total_time, round_places)} s\033[0m')
     print(f'{60 * "="}')
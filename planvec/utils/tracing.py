@@ -0,0 +1,159 @@
+"""
+Per-frame latency tracing. Every camera frame gets a FrameTrace with a running frame id which travels with the frame
+from capture through the processing stages to the display in the GUI. Each step is recorded as a span (start, end,
+thread) with perf_counter_ns. Finished traces are kept in a bounded ring buffer by the TraceRecorder, which can dump
+them as Chrome trace event JSON to be viewed in chrome://tracing or https://ui.perfetto.dev.
+
+In the trace viewer every thread is a row, spans of the same frame are connected by flow arrows and carry the
+frame id in their arguments.
+"""
+import itertools
+import json
+import threading
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from time import perf_counter_ns
+
+from typing import List, Optional, Union
+
+NS_PER_US = 1000
+
+
+class _Span:
+    """Context manager recording a span of a FrameTrace on the current thread."""
+
+    def __init__(self, frame_trace: 'FrameTrace', name: str) -> None:
+        self.frame_trace = frame_trace
+        self.name = name
+        self.start_ns = None
+
+    def __enter__(self) -> '_Span':
+        self.start_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.frame_trace.add_span(self.name, self.start_ns, perf_counter_ns())
+
+
+class FrameTrace:
+    """Spans of a single frame. A trace is written by one thread at a time as it is handed along with the frame."""
+
+    def __init__(self, frame_id: int) -> None:
+        self.frame_id = frame_id
+        self.spans = []  # (name, start_ns, end_ns, thread id)
+        self.marks = {}  # name -> timestamp in ns, e.g. when the frame was put into a queue
+
+    def span(self, name: str) -> _Span:
+        """Use as `with frame_trace.span('rectify'): ...`."""
+        return _Span(self, name)
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, thread_id: int = None) -> None:
+        self.spans.append((name, start_ns, end_ns, threading.get_ident() if thread_id is None else thread_id))
+
+    def mark(self, name: str) -> None:
+        """Remembers the current time, see span_since_mark."""
+        self.marks[name] = perf_counter_ns()
+
+    def span_since_mark(self, name: str, mark_name: str) -> None:
+        """Adds a span from a mark until now on the current thread, e.g. the time a frame waited in a queue."""
+        if mark_name in self.marks:
+            self.add_span(name, self.marks[mark_name], perf_counter_ns())
+
+    @property
+    def start_ns(self) -> Optional[int]:
+        return min(span[1] for span in self.spans) if self.spans else None
+
+    @property
+    def end_ns(self) -> Optional[int]:
+        return max(span[2] for span in self.spans) if self.spans else None
+
+    @property
+    def latency_ns(self) -> Optional[int]:
+        """Time from the start of the first to the end of the last span, i.e. capture to display."""
+        return self.end_ns - self.start_ns if self.spans else None
+
+
+def trace_span(frame_trace: Optional[FrameTrace], name: str):
+    """Span context of frame_trace or a no-op context if frame_trace is None (tracing disabled)."""
+    if frame_trace is None:
+        return nullcontext()
+    return frame_trace.span(name)
+
+
+class TraceRecorder:
+    """Hands out FrameTraces and keeps the last n_frames finished ones.
+
+    Arguments
+    ---------
+        n_frames: size of the ring buffer of finished frames
+        enabled: if False, new_frame returns None and nothing is recorded
+    """
+
+    def __init__(self, n_frames: int = 300, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._frames = deque(maxlen=n_frames)
+        self._frame_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._thread_names = {}
+        self.origin_ns = perf_counter_ns()
+
+    def new_frame(self) -> Optional[FrameTrace]:
+        if not self.enabled:
+            return None
+        self._register_thread()
+        return FrameTrace(next(self._frame_ids))
+
+    def finish(self, frame_trace: Optional[FrameTrace]) -> None:
+        """Stores a frame whose last span has been recorded."""
+        if frame_trace is None:
+            return
+        self._register_thread()
+        with self._lock:
+            self._frames.append(frame_trace)
+
+    def _register_thread(self) -> None:
+        """Remember the name of the calling thread for the trace viewer."""
+        thread_id = threading.get_ident()
+        if thread_id not in self._thread_names:
+            self._thread_names[thread_id] = threading.current_thread().name
+
+    def register_thread_name(self, name: str, thread_id: int = None) -> None:
+        """Overrides the name of the calling thread (or of thread_id, e.g. a worker process id) in the trace viewer,
+        e.g. for QThreads which have generic names."""
+        self._thread_names[threading.get_ident() if thread_id is None else thread_id] = name
+
+    def frames(self) -> List[FrameTrace]:
+        with self._lock:
+            return list(self._frames)
+
+    def latencies_ns(self) -> List[int]:
+        return [frame_trace.latency_ns for frame_trace in self.frames() if frame_trace.spans]
+
+    def to_chrome_trace(self) -> dict:
+        """Trace event format, see https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU"""
+        pid = 1
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'planvec'}}]
+        for thread_id, thread_name in list(self._thread_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        for frame_trace in self.frames():
+            spans = sorted(frame_trace.spans, key=lambda span: span[1])
+            for span_idx, (name, start_ns, end_ns, thread_id) in enumerate(spans):
+                ts = (start_ns - self.origin_ns) / NS_PER_US
+                events.append({'name': name, 'cat': 'frame', 'ph': 'X', 'pid': pid, 'tid': thread_id, 'ts': ts,
+                               'dur': (end_ns - start_ns) / NS_PER_US, 'args': {'frame_id': frame_trace.frame_id}})
+                # Flow arrows connect the spans of a frame across threads
+                flow_phase = 's' if span_idx == 0 else ('f' if span_idx == len(spans) - 1 else 't')
+                if len(spans) > 1:
+                    events.append({'name': 'frame', 'cat': 'frame', 'ph': flow_phase, 'bp': 'e', 'pid': pid,
+                                   'tid': thread_id, 'ts': ts, 'id': frame_trace.frame_id})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path: Union[str, Path]) -> Path:
+        """Writes the recorded frames as Chrome trace JSON and returns the path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+        return path
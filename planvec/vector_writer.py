@@ -0,0 +1,158 @@
+"""
+Writes the vectorized contours of a drawing directly to PDF or SVG without going through a matplotlib figure.
+
+The page has exactly the physical size of the drawing area and all contours end up in a single path, e.g. in the PDF
+case one content stream with one stroke operation:
+
+    1 0 0 RG 1 w          (red, line width in pt)
+    x0 y0 m x1 y1 l ... h (one subpath per contour, closed contours are closed with h)
+    S                     (stroke all subpaths at once)
+"""
+import zlib
+from pathlib import Path
+
+import numpy as np
+from dotmap import DotMap
+
+from planvec.utils.timing import timeit
+from planvec.utils.units_conversion import inches_to_cm
+
+from typing import List, Sequence, Tuple, Union
+
+POINTS_PER_INCH = 72.0
+CM_PER_INCH = 2.54
+RED = (1.0, 0.0, 0.0)
+
+
+class VectorDrawing:
+    """Contours in (row, col) pixel coordinates of a canvas (the rectified image) mapped onto a page of given size.
+
+    Arguments
+    ---------
+        contours: list of (n, 2) arrays of (row, col) coordinates as returned by planvec.pipeline.vectorize
+        canvas_shape: (width, height) in pixels of the image the contours were found in, e.g. rectify_shape
+        page_size_cm: (width, height) of the output page in cm, the canvas is stretched onto the full page
+        line_width: stroke width in pt
+        color: stroke color as (r, g, b) with values in [0, 1]
+    """
+
+    def __init__(self, contours: List[np.ndarray], canvas_shape: Tuple[int, int], page_size_cm: Tuple[float, float],
+                 line_width: float = 1.0, color: Tuple[float, float, float] = RED) -> None:
+        self.contours = contours
+        self.canvas_shape = canvas_shape
+        self.page_size_cm = page_size_cm
+        self.line_width = line_width
+        self.color = color
+
+    @classmethod
+    def from_config(cls, contours: List[np.ndarray], processing_config: DotMap) -> 'VectorDrawing':
+        """Drawing with canvas shape, page size and line width of the processing config."""
+        width_inches, height_inches = processing_config.out_size_inches
+        return cls(contours,
+                   canvas_shape=tuple(processing_config.rectify_shape),
+                   page_size_cm=(inches_to_cm(width_inches), inches_to_cm(height_inches)),
+                   line_width=processing_config.line_width)
+
+    @property
+    def page_size_pt(self) -> Tuple[float, float]:
+        return tuple(size_cm / CM_PER_INCH * POINTS_PER_INCH for size_cm in self.page_size_cm)
+
+    def _page_polylines(self, page_size: Tuple[float, float], flip_y: bool) -> List[np.ndarray]:
+        """Contours as (n, 2) arrays of (x, y) page coordinates. PDF has its origin at the bottom left (flip_y),
+        SVG at the top left like images."""
+        canvas_width, canvas_height = self.canvas_shape
+        page_width, page_height = page_size
+        scale = np.array([page_width / canvas_width, page_height / canvas_height])
+        polylines = []
+        for contour in self.contours:
+            if len(contour) < 2:
+                continue
+            points = contour[:, ::-1] * scale  # (row, col) -> (x, y)
+            if flip_y:
+                points[:, 1] = page_height - points[:, 1]
+            polylines.append(points)
+        return polylines
+
+    @staticmethod
+    def _is_closed(polyline: np.ndarray) -> bool:
+        return len(polyline) > 2 and np.array_equal(polyline[0], polyline[-1])
+
+    @timeit
+    def to_pdf_bytes(self) -> bytes:
+        page_width, page_height = self.page_size_pt
+        content = [f'{self.color[0]:g} {self.color[1]:g} {self.color[2]:g} RG {self.line_width:g} w 1 J 1 j']
+        for polyline in self._page_polylines((page_width, page_height), flip_y=True):
+            closed = self._is_closed(polyline)
+            points = polyline[:-1] if closed else polyline
+            content.append(_format_points(points[:1], '{:.3f} {:.3f} m'))
+            content.append(_format_points(points[1:], '{:.3f} {:.3f} l'))
+            if closed:
+                content.append('h')
+        content.append('S')
+        stream = zlib.compress('\n'.join(content).encode('ascii'))
+
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] '
+            f'/Resources << >> /Contents 4 0 R >>'.encode('ascii'),
+            f'<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode('ascii') + stream + b'\nendstream',
+        ]
+        return _assemble_pdf(objects)
+
+    @timeit
+    def to_svg_string(self) -> str:
+        page_width_mm, page_height_mm = (10 * size_cm for size_cm in self.page_size_cm)
+        line_width_mm = self.line_width / POINTS_PER_INCH * CM_PER_INCH * 10
+        path_data = []
+        for polyline in self._page_polylines((page_width_mm, page_height_mm), flip_y=False):
+            closed = self._is_closed(polyline)
+            points = polyline[:-1] if closed else polyline
+            path_data.append(_format_points(points[:1], 'M{:.3f} {:.3f}') + ' ' +
+                             _format_points(points[1:], 'L{:.3f} {:.3f}', separator=' ') + (' Z' if closed else ''))
+        stroke = '#{:02x}{:02x}{:02x}'.format(*(int(round(255 * channel)) for channel in self.color))
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+                f'width="{page_width_mm:.4f}mm" height="{page_height_mm:.4f}mm" '
+                f'viewBox="0 0 {page_width_mm:.4f} {page_height_mm:.4f}">\n'
+                f'<path fill="none" stroke="{stroke}" stroke-width="{line_width_mm:.4f}" '
+                f'stroke-linecap="round" stroke-linejoin="round" d="{" ".join(path_data)}"/>\n'
+                f'</svg>\n')
+
+    def write_pdf(self, path: Union[str, Path]) -> None:
+        with open(path, 'wb') as pdf_file:
+            pdf_file.write(self.to_pdf_bytes())
+
+    def write_svg(self, path: Union[str, Path]) -> None:
+        with open(path, 'w') as svg_file:
+            svg_file.write(self.to_svg_string())
+
+    def write(self, path: Union[str, Path]) -> None:
+        """Writes a .pdf or .svg file depending on the file ending of path."""
+        file_type = str(path).split('.')[-1].lower()
+        if file_type == 'pdf':
+            self.write_pdf(path)
+        elif file_type == 'svg':
+            self.write_svg(path)
+        else:
+            raise ValueError(f'File type {file_type} not supported, use .pdf or .svg.')
+
+
+def _format_points(points: np.ndarray, point_format: str, separator: str = '\n') -> str:
+    return separator.join(point_format.format(x, y) for x, y in points.tolist())
+
+
+def _assemble_pdf(objects: Sequence[bytes]) -> bytes:
+    """Numbers the objects 1..n and writes them with header, cross-reference table and trailer. Object 1 needs to be
+    the document catalog."""
+    pdf = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for object_number, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f'{object_number} 0 obj\n'.encode('ascii') + obj + b'\nendobj\n'
+    xref_offset = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('ascii')
+    for offset in offsets:
+        pdf += f'{offset:010d} 00000 n \n'.encode('ascii')
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode('ascii')
+    return bytes(pdf)
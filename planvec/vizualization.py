@@ -44,10 +44,14 @@ def imshow(img, axis='on', img_space='RGB', **kwargs):
 
 @timeit
 def plot_image_regions(labelled_image, regionprops, **kwargs):
+    """Show an image with the bounding boxes of its regions, either skimage regionprops or img_proc.RegionStats."""
     imshow(labelled_image, img_space='BGR', **kwargs)
 
-    for region in regionprops:
-        minr, minc, maxr, maxc = region.bbox
+    if isinstance(regionprops, img_proc.RegionStats):
+        bboxes = regionprops.bboxes
+    else:
+        bboxes = [region.bbox for region in regionprops]
+    for minr, minc, maxr, maxc in bboxes:
         rect = mpatches.Rectangle((minc, minr), maxc - minc, maxr - minr,
                                   fill=False, edgecolor='cyan', linewidth=1.5)
         plt.gca().add_patch(rect)
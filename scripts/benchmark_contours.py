@@ -0,0 +1,78 @@
+"""
+benchmark_contours
+
+Compares the contour engines of planvec.img_proc.find_contours ('skimage' and 'opencv') on recorded frames, e.g. the
+*_original.jpeg images which the GUI stores for every saved drawing. Each frame is rectified and segmented once with
+the regular pipeline stages, then contour finding is timed for every engine on the same regions mask.
+
+Example: python benchmark_contours.py --frames-dir ~/Desktop/planvec/2020-02-14
+"""
+import argparse
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+
+from context import planvec
+from planvec import img_proc
+from planvec.pipeline import rectify, segment
+from config import planvec_config
+
+
+def main(parsed_args: argparse.Namespace):
+    frame_paths = sorted(parsed_args.frames_dir.rglob(parsed_args.pattern))
+    if len(frame_paths) == 0:
+        raise IOError(f'No frames matching {parsed_args.pattern} found in {parsed_args.frames_dir}. Exit.')
+
+    config = planvec_config.processing
+    color_ranges = planvec_config.color_range.toDict()
+    timings = {engine: [] for engine in img_proc.CONTOUR_ENGINES}
+    n_contours = {engine: [] for engine in img_proc.CONTOUR_ENGINES}
+    failures = {engine: 0 for engine in img_proc.CONTOUR_ENGINES}
+    n_frames_used = 0
+    for frame_path in frame_paths:
+        frame, warped_ok = rectify(cv2.imread(str(frame_path)), config, color_ranges)
+        if not warped_ok:
+            print(f'Skipping {frame_path.name}, red dots not found.')
+            continue
+        n_frames_used += 1
+        regions_mask, _ = segment(frame, config, color_ranges)
+        for engine in img_proc.CONTOUR_ENGINES:
+            contours = None
+            for _ in range(parsed_args.repeat):
+                start_time = perf_counter()
+                try:
+                    contours = img_proc.find_contours(regions_mask, level=0, engine=engine)
+                except KeyError:  # bug in skimage, see https://github.com/scikit-image/scikit-image/issues/4830
+                    failures[engine] += 1
+                    continue
+                timings[engine].append(perf_counter() - start_time)
+            if contours is not None:
+                contours = img_proc.filter_contours_by_size(contours, n_points_thresh=config.contours_size_threshold)
+                n_contours[engine].append(len(contours))
+
+    print(f'{60 * "="}')
+    print(f'{n_frames_used} of {len(frame_paths)} frames rectified, {parsed_args.repeat} runs per frame and engine.')
+    for engine in img_proc.CONTOUR_ENGINES:
+        engine_timings = timings[engine] if timings[engine] else [float('nan')]
+        print(f'{engine:>10} --- mean {1000 * statistics.mean(engine_timings):8.2f} ms'
+              f' --- median {1000 * statistics.median(engine_timings):8.2f} ms'
+              f' --- failures {failures[engine]:>3}'
+              f' --- contours/frame {statistics.mean(n_contours[engine]) if n_contours[engine] else 0:6.1f}')
+    print(f'{60 * "="}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare the skimage and opencv contour engines on recorded frames.')
+    parser.add_argument('-f', '--frames-dir', required=True, type=Path,
+                        help='Directory which is searched recursively for recorded frames, e.g. a session folder.')
+    parser.add_argument('-p', '--pattern', default='*_original.jpeg',
+                        help='File name pattern of the frames to use. Defaults to the GUI\'s original images.')
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help='How many times contour finding is timed per frame and engine.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,68 @@
+"""
+benchmark_packing
+
+Times planvec.plate_packing.pack_rectangles on random drawing sizes and compares the number of plates and their
+utilisation with the grid layout, in which every drawing takes a cell of the largest drawing size. Sizes are either
+drawn from a few common drawing sizes (like a session in which teams pick one of the GUI's input sizes) or uniformly
+at random, such that every drawing has a size of its own.
+
+Example: python benchmark_packing.py --n-items 3000 --distinct
+"""
+import argparse
+import math
+import random
+from time import perf_counter
+
+from context import planvec
+from planvec.pdf_jammer import calc_max_n_pdfs_per_plate
+from planvec.plate_packing import pack_rectangles
+from config import planvec_config
+
+COMMON_SIZES_CM = [(20, 14), (14, 10), (30, 20), (10, 10), (21, 29.7), (15, 15)]
+
+
+def random_sizes(n_items: int, distinct: bool) -> list:
+    if distinct:
+        return [(idx, round(random.uniform(8, 30), 1), round(random.uniform(8, 25), 1)) for idx in range(n_items)]
+    return [(idx,) + random.choice(COMMON_SIZES_CM) for idx in range(n_items)]
+
+
+def main(parsed_args: argparse.Namespace):
+    random.seed(parsed_args.seed)
+    plate_width, plate_height = parsed_args.plate_size
+    sizes = random_sizes(parsed_args.n_items, parsed_args.distinct)
+
+    start_time = perf_counter()
+    plates = pack_rectangles(sizes, plate_width, plate_height, spacing=parsed_args.spacing)
+    duration_s = perf_counter() - start_time
+
+    total_area = sum(width * height for _, width, height in sizes)
+    cell_width, cell_height = max(size[1] for size in sizes), max(size[2] for size in sizes)
+    n_grid_plates = math.ceil(len(sizes) / calc_max_n_pdfs_per_plate(plate_width, plate_height, cell_width,
+                                                                       cell_height))
+    utilisations = [plate.utilisation for plate in plates]
+    print(f'{len(sizes)} drawings, {len(set(size[1:] for size in sizes))} distinct sizes, '
+          f'plates of {plate_width}x{plate_height} cm')
+    print(f'Packed in {duration_s:.3f}s onto {len(plates)} plates (lower bound '
+          f'{math.ceil(total_area / (plate_width * plate_height))}, grid of {cell_width}x{cell_height} cm cells: '
+          f'{n_grid_plates} plates)')
+    print(f'Utilisation: mean {sum(utilisations) / len(utilisations):.0%}, min {min(utilisations):.0%}, '
+          f'max {max(utilisations):.0%}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time packing drawings of mixed sizes onto plates.')
+    parser.add_argument('-n', '--n-items', default=3000, type=int, help='Number of drawings to pack.')
+    parser.add_argument('-d', '--distinct', action='store_true',
+                        help='Every drawing gets a random size instead of one of a few common sizes.')
+    parser.add_argument('--plate-size', type=float, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        default=(planvec_config.pdf_output.plate_width_cm, planvec_config.pdf_output.plate_height_cm),
+                        help='Plate size in cm, defaults to the plate size of the config.')
+    parser.add_argument('-s', '--spacing', default=planvec_config.pdf_output.jam_spacing_cm, type=float,
+                        help='Space in cm between drawings.')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the random sizes.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,68 @@
+"""
+benchmark_pipeline
+
+Times the image pipeline (run_pipeline, its stages and all @timeit-decorated img_proc functions) on deterministic
+synthetic frames at 640x480, 1280x720 and 1920x1080 and writes the results as JSON. Two result files, e.g. of two
+commits or machines, can be compared with --compare.
+
+Examples:
+    python benchmark_pipeline.py --out before.json
+    python benchmark_pipeline.py --out after.json --buffer-pool
+    python benchmark_pipeline.py --compare before.json after.json
+"""
+import argparse
+from pathlib import Path
+
+from context import planvec
+from planvec.benchmark import runner
+from config import planvec_config
+
+
+def print_comparison(baseline_path: Path, candidate_path: Path, statistic: str):
+    comparison = runner.compare_results(runner.load_results(baseline_path), runner.load_results(candidate_path),
+                                        statistic=statistic)
+    for resolution, entries in comparison.items():
+        print(f'{60 * "="}')
+        print(f'{resolution + " (" + statistic + ")":>45} --- {"baseline":>10} {"candidate":>10} {"ratio":>7}')
+        for name, (baseline_value, candidate_value, ratio) in sorted(entries.items(), key=lambda item: -item[1][0]):
+            print(f'{name:>45} --- {baseline_value:10.3f} {candidate_value:10.3f} {ratio:7.2f}')
+    print(f'{60 * "="}')
+
+
+def main(parsed_args: argparse.Namespace):
+    if parsed_args.compare:
+        print_comparison(*parsed_args.compare, statistic=parsed_args.statistic)
+        return
+    results = runner.run_benchmark(planvec_config.processing, planvec_config.color_range.toDict(),
+                                   resolutions=parsed_args.resolutions, n_frames=parsed_args.frames,
+                                   repeat=parsed_args.repeat, n_warmup=parsed_args.warmup, seed=parsed_args.seed,
+                                   use_buffer_pool=parsed_args.buffer_pool,
+                                   n_blue_strokes=parsed_args.blue_strokes, n_green_strokes=parsed_args.green_strokes,
+                                   noise_std=parsed_args.noise, lighting_gradient=parsed_args.lighting_gradient)
+    if parsed_args.out is not None:
+        print(f'Results written to {runner.save_results(results, parsed_args.out)}.')
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the image pipeline on synthetic frames.')
+    parser.add_argument('--resolutions', nargs='+', default=list(runner.RESOLUTIONS),
+                        help='Frame sizes as WIDTHxHEIGHT.')
+    parser.add_argument('--frames', type=int, default=10, help='Number of different frames per resolution.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of passes over the frames.')
+    parser.add_argument('--warmup', type=int, default=2, help='Number of unrecorded pipeline runs per resolution.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first synthetic frame.')
+    parser.add_argument('--blue-strokes', type=int, default=4, help='Number of drawn shapes per frame.')
+    parser.add_argument('--green-strokes', type=int, default=3, help='Number of green guide lines per frame.')
+    parser.add_argument('--noise', type=float, default=4.0, help='Standard deviation of the sensor noise.')
+    parser.add_argument('--lighting-gradient', type=float, default=0.3, help='Brightness drop across the frame.')
+    parser.add_argument('--buffer-pool', action='store_true', help='Run the pipeline in zero-copy mode.')
+    parser.add_argument('--out', type=Path, default=None, help='Path of the JSON result file.')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BASELINE', 'CANDIDATE'), default=None,
+                        help='Compare two JSON result files instead of running the benchmark.')
+    parser.add_argument('--statistic', default='mean_ms', help='Statistic to compare, e.g. mean_ms or p95_ms.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
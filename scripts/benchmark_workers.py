@@ -0,0 +1,146 @@
+"""
+benchmark_workers
+
+Measures how the frame rate of the multiprocessing backend (planvec.pipeline_pool) scales with the number of worker
+processes. Frames are taken from a recording (a video of planvec.frame_sources.FrameRecorder or a directory of
+*_original.jpeg images) or generated synthetically, and pushed through the pool as fast as it accepts them. Like the
+capture thread, every frame is written into a slot of a shared frame ring which the pool hands to the workers. Worker
+start-up and a warm-up pass are not measured. 0 workers is the single-threaded pipeline for reference, 'staged' the
+pipeline with a thread per stage (planvec.pipeline_stages).
+
+Examples:
+    python benchmark_workers.py --max-workers 4
+    python benchmark_workers.py --video ~/Desktop/planvec/recordings/session.avi --frames 200
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+from time import perf_counter
+
+import cv2 as cv
+import numpy as np
+
+from context import planvec
+from planvec.benchmark.synthetic import generate_frames
+from planvec.frame_ring import SharedFrameRing
+from planvec.frame_sources import ImageDirSource, VideoFileSource
+from planvec.gui.preview_renderer import PreviewRenderer
+from planvec.pipeline import run_pipeline
+from planvec.pipeline_pool import PipelineProcessPool
+from planvec.pipeline_stages import DEFAULT_QUEUE_SIZE, StagedPipeline
+from config import planvec_config
+
+PREVIEW_SIZE = (650, 650)
+
+
+def load_frames(parsed_args: argparse.Namespace) -> list:
+    if parsed_args.video is not None:
+        frame_source = VideoFileSource(parsed_args.video, realtime=False)
+    elif parsed_args.frames_dir is not None:
+        frame_source = ImageDirSource(parsed_args.frames_dir, realtime=False)
+    else:
+        return generate_frames(parsed_args.n_distinct_frames, *parsed_args.resolution)
+    frames = []
+    while len(frames) < parsed_args.n_distinct_frames:
+        ret, frame = frame_source.read()
+        if not ret:
+            break
+        frames.append(frame if not frames else cv.resize(frame, (frames[0].shape[1], frames[0].shape[0])))
+    frame_source.release()
+    return frames  # all of the size of the first frame, the frame ring has a single frame size
+
+
+def measure_in_thread(frames: list, n_frames: int, config, color_ranges: dict) -> float:
+    preview_renderer = PreviewRenderer(PREVIEW_SIZE, line_width=config.line_width)
+    run_pipeline(frames[0], None, config, color_ranges, preview_renderer=preview_renderer)  # warm-up
+    start_time = perf_counter()
+    for frame_idx in range(n_frames):
+        run_pipeline(frames[frame_idx % len(frames)], None, config, color_ranges, preview_renderer=preview_renderer)
+    return n_frames / (perf_counter() - start_time)
+
+
+def measure_staged(frames: list, n_frames: int, config, color_ranges: dict, queue_size: int) -> float:
+    preview_renderer = PreviewRenderer(PREVIEW_SIZE, line_width=config.line_width)
+    pipeline = StagedPipeline(config, color_ranges, preview_renderer=preview_renderer, queue_size=queue_size).start()
+    try:
+        for n_frames_to_run, measured in ((pipeline.max_in_flight, False), (n_frames, True)):  # warm-up, measurement
+            start_time = perf_counter()
+            n_submitted, n_done = 0, 0
+            while n_done < n_frames_to_run:
+                while pipeline.can_submit() and n_submitted < n_frames_to_run:
+                    pipeline.submit(frames[n_submitted % len(frames)])
+                    n_submitted += 1
+                n_done += len(pipeline.collect(timeout=1.0))
+            if measured:
+                return n_frames / (perf_counter() - start_time)
+    finally:
+        pipeline.close()
+
+
+def measure_pool(frames: list, n_frames: int, n_workers: int, config, color_ranges: dict) -> float:
+    pool = PipelineProcessPool(n_workers, config, color_ranges, PREVIEW_SIZE).start()
+    frame_ring = SharedFrameRing(pool.n_slots + 1, frames[0].shape)
+    try:
+        for n_frames_to_run, measured in ((pool.n_slots, False), (n_frames, True)):  # warm-up, then measurement
+            start_time = perf_counter()
+            n_submitted, n_done = 0, 0
+            while n_done < n_frames_to_run:
+                while pool.can_submit() and n_submitted < n_frames_to_run:
+                    frame_slot = frame_ring.acquire(timeout=0)
+                    np.copyto(frame_slot.array, frames[n_submitted % len(frames)])  # what the camera read does
+                    pool.submit(frame_ring.publish(frame_slot))
+                    frame_slot.release()
+                    n_submitted += 1
+                for result in pool.collect(timeout=1.0):
+                    pool.release(result)
+                    n_done += 1
+            if measured:
+                return n_frames / (perf_counter() - start_time)
+    finally:
+        pool.close()
+        frame_ring.retire()
+
+
+def main(parsed_args: argparse.Namespace):
+    config = planvec_config.processing
+    color_ranges = planvec_config.color_range.toDict()
+    frames = load_frames(parsed_args)
+    if len(frames) == 0:
+        raise IOError('No frames to benchmark with. Exit.')
+    print(f'{len(frames)} distinct frames of {frames[0].shape[1]}x{frames[0].shape[0]}, {os.cpu_count()} CPUs, '
+          f'{parsed_args.frames} frames per run.')
+
+    frame_rates = {0: measure_in_thread(frames, parsed_args.frames, config, color_ranges)}
+    print(f'{"in thread":>12} --- {frame_rates[0]:7.2f} fps')
+    frame_rates['staged'] = measure_staged(frames, parsed_args.frames, config, color_ranges, parsed_args.queue_size)
+    print(f'{"staged":>12} --- {frame_rates["staged"]:7.2f} fps'
+          f' --- speedup {frame_rates["staged"] / frame_rates[0]:5.2f}')
+    for n_workers in range(1, parsed_args.max_workers + 1):
+        frame_rates[n_workers] = measure_pool(frames, parsed_args.frames, n_workers, config, color_ranges)
+        print(f'{str(n_workers) + " workers":>12} --- {frame_rates[n_workers]:7.2f} fps'
+              f' --- speedup {frame_rates[n_workers] / frame_rates[0]:5.2f}')
+    if parsed_args.out is not None:
+        with open(parsed_args.out, 'w') as results_file:
+            json.dump({'cpu_count': os.cpu_count(), 'frame_shape': list(frames[0].shape),
+                       'n_frames': parsed_args.frames, 'fps_by_workers': frame_rates}, results_file, indent=2)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Frame rate of the pipeline with 1 to N worker processes and with '
+                                                 'a thread per stage.')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='Largest number of workers.')
+    parser.add_argument('--frames', type=int, default=60, help='Number of frames per measurement.')
+    parser.add_argument('--video', type=Path, default=None, help='Recorded video to take the frames from.')
+    parser.add_argument('--frames-dir', type=Path, default=None, help='Directory of *_original.jpeg frames.')
+    parser.add_argument('--n-distinct-frames', type=int, default=10, help='Number of different frames to cycle.')
+    parser.add_argument('--resolution', type=int, nargs=2, default=(1920, 1080), metavar=('WIDTH', 'HEIGHT'),
+                        help='Size of synthetic frames.')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='Stage queue size of staged.')
+    parser.add_argument('--out', type=Path, default=None, help='Path of a JSON result file.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,76 @@
+import argparse
+from pathlib import Path
+
+import cv2
+import matplotlib.pyplot as plt
+import numpy as np
+
+from context import planvec
+from planvec.calibration import SheetCalibration, calibration_file_path
+from planvec.planvec_paths import CALIBRATION_DIR_PATH
+from config import planvec_config
+
+
+def main(parsed_args: argparse.Namespace):
+    cap = cv2.VideoCapture(parsed_args.camera)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, planvec_config.video.max_input_width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, planvec_config.video.max_input_height)
+    input_img = None
+    for _ in range(parsed_args.warmup_frames):  # let the camera adjust exposure and white balance
+        ret, frame = cap.read()
+        if ret:
+            input_img = frame
+    cap.release()
+    if input_img is None:
+        raise IOError(f'Could not read a frame from camera {parsed_args.camera}. Exit.')
+
+    camera_matrix, dist_coeffs = None, None
+    if parsed_args.lens_model is not None:
+        lens_model = np.load(parsed_args.lens_model)
+        camera_matrix, dist_coeffs = lens_model['camera_matrix'], lens_model['dist_coeffs']
+
+    red_color_ranges = [color_range for key, color_range in planvec_config.color_range.items() if 'red' in key]
+    calibration = SheetCalibration.from_frame(input_img, red_color_ranges,
+                                              camera_matrix=camera_matrix, dist_coeffs=dist_coeffs)
+    if calibration is None:
+        raise ValueError('Could not find the four red dots in the camera frame. Check the sheet and the lighting.')
+
+    out_path = calibration_file_path(parsed_args.camera, parsed_args.out_dir)
+    calibration.save(out_path, planvec_config.processing.rectify_shape)
+    print(f'Stored calibration with corners {calibration.corners.tolist()} in {out_path}.')
+
+    if parsed_args.display:
+        rectified = calibration.rectify(input_img, planvec_config.processing.rectify_shape)
+        planvec.vizualization.imshow(rectified, axis='on', figsize=(18, 12), img_space='BGR')
+        plt.show()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Calibrate a fixed-mount camera to the drawing sheet. Place the '
+                                                 'sheet with the four red dots under the camera and run the script. '
+                                                 'The dot positions are stored per camera and the GUI rectifies '
+                                                 'all frames with them instead of searching the dots every frame.')
+    parser.add_argument('-c', '--camera',
+                        type=int,
+                        default=0,
+                        help='Device index of the camera to calibrate (as used by OpenCV).')
+    parser.add_argument('-l', '--lens-model',
+                        type=Path,
+                        help='Optional .npz file with "camera_matrix" and "dist_coeffs" as returned by '
+                             'cv2.calibrateCamera. If given, the lens distortion is removed as well.')
+    parser.add_argument('-o', '--out-dir',
+                        type=Path,
+                        default=CALIBRATION_DIR_PATH,
+                        help=f'Directory to store the calibration in. Defaults to {CALIBRATION_DIR_PATH}.')
+    parser.add_argument('--warmup-frames',
+                        type=int,
+                        default=10,
+                        help='Number of frames to read before the calibration frame is taken.')
+    parser.add_argument('-d', '--display',
+                        action='store_true',
+                        help='Show the rectified calibration frame.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
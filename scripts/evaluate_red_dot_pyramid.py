@@ -0,0 +1,107 @@
+"""
+evaluate_red_dot_pyramid
+
+Compares the coarse to fine red dot search (planvec.img_proc.find_red_dot_centroids_coarse_to_fine) against the full
+resolution search on recorded frames, e.g. the *_original.jpeg images which the GUI stores for every saved drawing. For
+every pyramid level the deviation of the found centroids from the full resolution ones, the number of frames in which
+the coarse to fine search did not find the dots and the search time are reported. The coarse to fine search is called
+without the fallback of find_red_dot_centroids, such that its misses are counted instead of hidden.
+
+Example: python evaluate_red_dot_pyramid.py --frames-dir ~/Desktop/planvec/2020-02-14 --levels 1 2 3
+"""
+import argparse
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from context import planvec
+from planvec import img_proc
+from config import planvec_config
+
+
+def time_search(img, red_color_ranges, pyramid_level, refine_radius, repeat):
+    """Full resolution search for pyramid_level 0, coarse to fine search without fallback otherwise."""
+    timings = []
+    corners = None
+    for _ in range(repeat):
+        start_time = perf_counter()
+        if pyramid_level == 0:
+            corners = img_proc.find_red_dot_centroids(img, red_color_ranges)
+        else:
+            corners = img_proc.find_red_dot_centroids_coarse_to_fine(img, red_color_ranges,
+                                                                     pyramid_level=pyramid_level,
+                                                                     refine_radius=refine_radius)
+        timings.append(perf_counter() - start_time)
+    return corners, statistics.median(timings)
+
+
+def main(parsed_args: argparse.Namespace):
+    frame_paths = sorted(parsed_args.frames_dir.rglob(parsed_args.pattern))
+    if len(frame_paths) == 0:
+        raise IOError(f'No frames matching {parsed_args.pattern} found in {parsed_args.frames_dir}. Exit.')
+
+    red_color_ranges = [color_range for key, color_range in planvec_config.color_range.items() if 'red' in key]
+    timings = {level: [] for level in [0] + parsed_args.levels}
+    deviations = {level: [] for level in parsed_args.levels}
+    mismatches = {level: 0 for level in parsed_args.levels}
+    not_found = {level: 0 for level in parsed_args.levels}
+    n_frames_used = 0
+    for frame_path in frame_paths:
+        img = cv2.imread(str(frame_path))
+        reference, reference_time = time_search(img, red_color_ranges, 0, parsed_args.refine_radius,
+                                                parsed_args.repeat)
+        if reference is None:
+            print(f'Skipping {frame_path.name}, red dots not found.')
+            continue
+        n_frames_used += 1
+        timings[0].append(reference_time)
+        for level in parsed_args.levels:
+            corners, level_time = time_search(img, red_color_ranges, level, parsed_args.refine_radius,
+                                              parsed_args.repeat)
+            timings[level].append(level_time)
+            if corners is None:
+                not_found[level] += 1
+                print(f'{frame_path.name}: level {level} did not find the dots.')
+                continue
+            deviation = np.linalg.norm(np.float64(corners) - np.float64(reference), axis=1).max()
+            deviations[level].append(deviation)
+            if deviation > parsed_args.tolerance:
+                mismatches[level] += 1
+                print(f'{frame_path.name}: level {level} deviates by {deviation:.2f} pixels.')
+
+    print(f'{60 * "="}')
+    print(f'{n_frames_used} of {len(frame_paths)} frames with red dots, refine radius {parsed_args.refine_radius}.')
+    print(f'{"level 0":>10} --- median {1000 * statistics.median(timings[0] or [float("nan")]):8.2f} ms')
+    for level in parsed_args.levels:
+        level_deviations = deviations[level] or [float('nan')]
+        print(f'{"level " + str(level):>10} --- median {1000 * statistics.median(timings[level] or [float("nan")]):8.2f} ms'
+              f' --- max deviation {max(level_deviations):6.3f} px'
+              f' --- mean deviation {statistics.mean(level_deviations):6.3f} px'
+              f' --- deviating (> {parsed_args.tolerance} px) {mismatches[level]:>3}'
+              f' --- not found {not_found[level]:>3}')
+    print(f'{60 * "="}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Accuracy and speed of the coarse to fine red dot search compared to '
+                                                 'the full resolution search.')
+    parser.add_argument('-f', '--frames-dir', required=True, type=Path,
+                        help='Directory which is searched recursively for recorded frames, e.g. a session folder.')
+    parser.add_argument('-p', '--pattern', default='*_original.jpeg',
+                        help='File name pattern of the frames to use. Defaults to the GUI\'s original images.')
+    parser.add_argument('-l', '--levels', default=[1, 2, 3], type=int, nargs='+',
+                        help='Pyramid levels to compare against the full resolution search.')
+    parser.add_argument('--refine-radius', default=planvec_config.processing.red_dot_refine_radius, type=int,
+                        help='Margin of the full resolution refinement windows in pixels.')
+    parser.add_argument('-t', '--tolerance', default=0.5, type=float,
+                        help='Centroid deviation in pixels above which a frame counts as mismatch.')
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help='How many times each search is timed per frame.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -1,23 +1,28 @@
-import os
 import argparse
 
 from context import planvec
 import planvec.pipeline
 import planvec.io
 import planvec.vizualization
-
-ASSETS_DIR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../test', 'assets')
-DEFAULT_FILE_PATH = os.path.join(ASSETS_DIR_PATH, 'solid_lines.jpg')
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame
+from config import planvec_config
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--file-path', default=DEFAULT_FILE_PATH)
+    parser.add_argument('--file-path', default=None, help='Input image, a synthetic frame is used if not given.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic frame.')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_args()
-    input_img = planvec.io.read_img_full_path(args.file_path, to_bgr=True)
-    output_img = planvec.pipeline.run_pipeline(input_img, visualize_steps=False, verbose=False)
+    if args.file_path is None:
+        input_img, _ = generate_frame(SyntheticFrameSpec(seed=args.seed))
+    else:
+        input_img = planvec.io.read_img_full_path(args.file_path, to_bgr=True)
+    fig, ax = planvec.vizualization.setup_figure()
+    ax, output_img = planvec.pipeline.run_pipeline(input_img, ax, planvec_config.processing,
+                                                   planvec_config.color_range.toDict(), visualize_steps=False,
+                                                   verbose=False)
     #planvec.vizualization.imshow(output_img, axis='off', img_space='BGR')
@@ -5,14 +5,19 @@ Command line tool to load output PDFs from a session and arrange them in a grid
 larger PDF ready for laser cutting multiple Drawings.
 
 The tool will grab the output from all teams from a certain session (date) and concatenate them to one or multiple
-output PDFs, ready for laser cutting.
+output PDFs, ready for laser cutting. Plate and drawing sizes are taken from the pdf_output section of the config.
+With --engine pdfjam the plates are created by 'pdfunite' and 'pdfjam' instead of in-process, e.g. to compare both.
+With --jobs N up to N plates are created at the same time. With --layout packed, drawings of mixed sizes are packed
+at their actual page size onto as few plates as possible instead of placed on a grid of the configured drawing size.
 """
 import argparse
 from pathlib import Path
 
+from context import planvec
 from planvec.gui.datamanager import DataManager
-from planvec.pdf_jammer import PdfJammer
+from planvec.pdf_jammer import JAM_ENGINES, JAM_LAYOUTS, PdfJammer
 from planvec.planvec_paths import DATA_DESKTOP_DIR_PATH
+from config import planvec_config
 
 
 DEFAULT_OUT_DIR_PAR = Path.home() / 'Desktop'
@@ -26,6 +31,14 @@ def parse_arguments():
     parser.add_argument('-o', '--out-dir', required=False, type=Path,
                         help='Absolute path - location to store created output pdf\'s. '
                              'Defaults to session folder given by --date-tag field.')
+    parser.add_argument('-e', '--engine', choices=JAM_ENGINES, default=planvec_config.pdf_output.jam_engine,
+                        help='Imposition engine, defaults to pdf_output.jam_engine of the config.')
+    parser.add_argument('-j', '--jobs', type=int, default=planvec_config.pdf_output.jam_jobs,
+                        help='Number of plates created at the same time, defaults to pdf_output.jam_jobs of the config.')
+    parser.add_argument('-l', '--layout', choices=JAM_LAYOUTS, default=planvec_config.pdf_output.jam_layout,
+                        help='Grid of equally sized cells or packed page sizes, defaults to pdf_output.jam_layout.')
+    parser.add_argument('-s', '--spacing', type=float, default=planvec_config.pdf_output.jam_spacing_cm,
+                        help='Space in cm between packed drawings, defaults to pdf_output.jam_spacing_cm.')
     args = parser.parse_args()
     return args
 
@@ -34,12 +47,19 @@ def main(parsed_args):
     equal_signs = 30 * '='
     print(f'{equal_signs} PDF JAMMER {equal_signs}\t')
     data_manager = DataManager(output_location='desktop', date_tag=parsed_args.date_tag)
+    pdf_config = planvec_config.pdf_output
     pdf_jammer = PdfJammer(data_manager=data_manager,
-                           out_dir_path=parsed_args.out_dir if parsed_args.out_dir else DATA_DESKTOP_DIR_PATH / parsed_args.date_tag)
+                           out_dir_path=parsed_args.out_dir if parsed_args.out_dir else DATA_DESKTOP_DIR_PATH / parsed_args.date_tag,
+                           plate_width=pdf_config.plate_width_cm, plate_height=pdf_config.plate_height_cm,
+                           pdf_width=pdf_config.draw_area_width_cm, pdf_height=pdf_config.draw_area_height_cm,
+                           engine=parsed_args.engine, jobs=parsed_args.jobs, layout=parsed_args.layout,
+                           spacing=parsed_args.spacing)
     pdfs_dict = pdf_jammer.accumulate_pdf_paths_all_schools_and_teams()
     pdf_paths_list = pdf_jammer.teams_pdfs_paths_to_list(pdfs_dict)
-    pdf_jammer.run(pdf_paths_list)
+    plate_results = pdf_jammer.run(pdf_paths_list)
     print(f'{equal_signs}==========={equal_signs}\t')
+    if not all(result.ok for result in plate_results):
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
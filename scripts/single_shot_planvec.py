@@ -8,6 +8,7 @@ from context import planvec
 from planvec import vizualization
 from planvec.pipeline import run_pipeline
 from planvec.utils.date_utils import get_date_time_tag
+from planvec.vector_writer import VectorDrawing
 from config import planvec_config
 
 
@@ -20,18 +21,23 @@ def main(parsed_args: argparse.Namespace):
 
     # Setup output final output figure and run complete pipeline
     fig, ax = vizualization.setup_figure()
-    _, output_img = run_pipeline(input_img, ax,
-                                 visualize_steps=False,
-                                 verbose=False,
-                                 config=planvec_config.processing,
-                                 color_ranges=planvec_config.color_range.toDict())
+    _, output_img, contours = run_pipeline(input_img, ax,
+                                           visualize_steps=False,
+                                           verbose=False,
+                                           config=planvec_config.processing,
+                                           color_ranges=planvec_config.color_range.toDict(),
+                                           return_contours=True)
 
     if parsed_args.display:
         plt.show()
 
     if not parsed_args.skip_save:
-        fig.tight_layout(pad=0)
-        fig.savefig(parsed_args.out_dir / get_date_time_tag(), bbox_inches='tight', pad_inches=0)
+        if parsed_args.writer == 'matplotlib':
+            fig.tight_layout(pad=0)
+            fig.savefig(parsed_args.out_dir / get_date_time_tag(), bbox_inches='tight', pad_inches=0)
+        else:
+            drawing = VectorDrawing.from_config(contours, planvec_config.processing)
+            drawing.write(parsed_args.out_dir / f'{get_date_time_tag()}.{parsed_args.writer}')
 
 
 def parse_arguments():
@@ -63,6 +69,11 @@ def parse_arguments():
     parser.add_argument('--output-height',
                         type=float,
                         help='The height of the output plate in centimeters.')
+    parser.add_argument('-w', '--writer',
+                        choices=['pdf', 'svg', 'matplotlib'],
+                        default='pdf',
+                        help='How to store the output. "pdf" and "svg" write the contours directly with the exact '
+                             'page size of the drawing area, "matplotlib" saves the output figure as before.')
     parser.add_argument('-d', '--display',
                         action='store_true',
                         help='Specify this flag without any value if you want to '
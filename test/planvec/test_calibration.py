@@ -0,0 +1,45 @@
+import numpy as np
+
+from planvec import pipeline
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame
+from planvec.calibration import SheetCalibration
+from config import planvec_config
+
+RED_COLOR_RANGES = [color_range for key, color_range in planvec_config.color_range.items() if 'red' in key]
+COLOR_RANGES = planvec_config.color_range.toDict()
+
+
+def calibration_for(frame):
+    calibration = SheetCalibration.from_frame(frame, RED_COLOR_RANGES)
+    assert calibration is not None
+    return calibration
+
+
+def test_first_frame_is_checked():
+    frame, _ = generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=0))
+    calibration = calibration_for(frame)
+    assert calibration.check_due()
+    moved_frame, _ = generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=1))  # other dot positions
+    _, warped_ok = pipeline.rectify(moved_frame, planvec_config.processing, COLOR_RANGES, calibration=calibration)
+    assert warped_ok
+    assert calibration.n_checks == 1 and not calibration.valid
+
+
+def test_calibrated_frame_is_rectified_with_the_remap():
+    frame, _ = generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=0))
+    calibration = calibration_for(frame)
+    rectified, warped_ok = pipeline.rectify(frame, planvec_config.processing, COLOR_RANGES, calibration=calibration)
+    assert warped_ok and calibration.valid and calibration.n_checks == 1
+    by_dots, _ = pipeline.rectify(frame, planvec_config.processing, COLOR_RANGES)
+    assert np.abs(rectified.bgr.astype(np.float64) - by_dots.bgr).mean() < 1.0
+
+
+def test_frame_of_other_size_falls_back_to_dot_search():
+    calibration = calibration_for(generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=0))[0])
+    calibration.n_frames_since_check = 0  # the first check passed
+    frame, _ = generate_frame(SyntheticFrameSpec(width=1920, height=1080, seed=0))
+    assert not calibration.fits(frame)
+    rectified, warped_ok = pipeline.rectify(frame, planvec_config.processing, COLOR_RANGES, calibration=calibration)
+    assert warped_ok and not calibration.valid
+    by_dots, _ = pipeline.rectify(frame, planvec_config.processing, COLOR_RANGES)
+    assert np.array_equal(rectified.bgr, by_dots.bgr)
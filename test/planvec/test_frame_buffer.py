@@ -0,0 +1,43 @@
+import queue
+import threading
+
+import pytest
+
+from planvec.frame_ring import SharedFrameRing
+from planvec.gui.video_stream import FrameBuffer
+
+
+def test_newest_frame_wins_and_overwritten_frames_are_counted():
+    frame_buffer = FrameBuffer()
+    for frame_idx in range(3):
+        frame_buffer.put((frame_idx, None))
+    assert frame_buffer.qsize() == 1
+    assert frame_buffer.get(timeout=0) == (2, None)
+    assert frame_buffer.qsize() == 0
+    assert frame_buffer.stats() == {'put': 3, 'dropped': 2, 'consumed': 1}
+
+
+def test_get_times_out_with_queue_empty():
+    with pytest.raises(queue.Empty):
+        FrameBuffer().get(timeout=0.01)
+
+
+def test_get_waits_for_a_frame():
+    frame_buffer = FrameBuffer()
+    timer = threading.Timer(0.05, frame_buffer.put, args=(('frame', None),))
+    timer.start()
+    assert frame_buffer.get(timeout=5) == ('frame', None)
+    timer.join()
+
+
+def test_slot_of_overwritten_frame_is_released():
+    ring = SharedFrameRing(2, (4, 4, 3))
+    frame_buffer = FrameBuffer()
+    first_slot = ring.publish(ring.acquire(timeout=0))
+    frame_buffer.put((first_slot, None))
+    second_slot = ring.publish(ring.acquire(timeout=0))
+    frame_buffer.put((second_slot, None))
+    assert first_slot.ref_count == 0 and second_slot.ref_count == 1
+    frame_buffer.clear()
+    assert second_slot.ref_count == 0 and frame_buffer.qsize() == 0
+    ring.retire()
@@ -0,0 +1,68 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from planvec.frame_ring import SharedFrameRing, slot_view
+
+FRAME_SHAPE = (6, 8, 3)
+
+
+@pytest.fixture
+def ring():
+    frame_ring = SharedFrameRing(2, FRAME_SHAPE)
+    yield frame_ring
+    frame_ring.retire()
+
+
+def test_acquire_times_out_when_all_slots_are_held(ring):
+    slots = [ring.acquire(timeout=0) for _ in range(ring.n_slots)]
+    assert all(slot is not None for slot in slots) and ring.n_free == 0
+    assert ring.acquire(timeout=0.01) is None
+    assert ring.stats()['acquire_timeouts'] == 1
+    slots[0].release()
+    assert ring.acquire(timeout=0) is slots[0]
+    for slot in slots:
+        slot.release()
+
+
+def test_slot_is_free_after_every_reference_is_released(ring):
+    slot = ring.publish(ring.acquire(timeout=0)).retain().retain()
+    assert slot.ref_count == 3 and slot.seq == 0
+    for n_refs_left in (2, 1, 0):
+        slot.release()
+        assert slot.ref_count == n_refs_left
+    assert ring.n_free == ring.n_slots
+
+
+def test_double_release_raises(ring):
+    slot = ring.acquire(timeout=0)
+    slot.release()
+    with pytest.raises(RuntimeError):
+        slot.release()
+    with pytest.raises(RuntimeError):
+        slot.retain()
+
+
+def test_frames_are_written_into_the_shared_block(ring):
+    slot = ring.acquire(timeout=0)
+    slot.array[...] = 7
+    attached = SharedMemory(name=slot.block_name)
+    try:
+        view = slot_view(attached, slot.offset, slot.shape)
+        assert (view == 7).all()
+        del view
+    finally:
+        attached.close()
+    slot.release()
+
+
+def test_memory_is_freed_after_retire_and_last_release():
+    ring = SharedFrameRing(2, FRAME_SHAPE)
+    slot = ring.publish(ring.acquire(timeout=0))
+    block_name = slot.block_name
+    ring.retire()
+    assert ring.acquire(timeout=0) is None
+    SharedMemory(name=block_name).close()  # still held by the slot
+    slot.release()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=block_name)
@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+
+from planvec.frame_sources import ImageDirSource
+
+
+def write_images(dir_path, n_images, corrupt_indices=()):
+    for idx in range(n_images):
+        image_path = dir_path / f'{idx:03d}_original.jpeg'
+        if idx in corrupt_indices:
+            image_path.write_bytes(b'not a jpeg')
+        else:
+            cv2.imwrite(str(image_path), np.full((12, 16, 3), idx * 10, dtype=np.uint8))
+
+
+def test_unreadable_image_is_skipped_when_looping(tmp_path):
+    write_images(tmp_path, 3, corrupt_indices=(1,))
+    source = ImageDirSource(tmp_path, realtime=False, loop=True)
+    for _ in range(6):
+        ret, frame = source.read()
+        assert ret and frame.shape == (12, 16, 3)
+    assert source.n_frames_read == 6 and not source.finished
+
+
+def test_single_corrupt_image_finishes_looping_source(tmp_path):
+    write_images(tmp_path, 1, corrupt_indices=(0,))
+    source = ImageDirSource(tmp_path, realtime=False, loop=True)
+    assert source.read() == (False, None)
+    assert source.finished
+
+
+def test_source_without_loop_finishes_after_last_frame(tmp_path):
+    write_images(tmp_path, 2, corrupt_indices=(1,))
+    source = ImageDirSource(tmp_path, realtime=False, loop=False)
+    assert source.read()[0]
+    assert source.read() == (False, None)
+    assert source.finished
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from planvec import img_proc
+
+
+def bounding_box(contour):
+    return contour[:, 0].min(), contour[:, 0].max(), contour[:, 1].min(), contour[:, 1].max()
+
+
+@pytest.mark.parametrize('engine', img_proc.CONTOUR_ENGINES)
+def test_find_contours_returns_closed_contours(engine):
+    mask = np.zeros((40, 50), dtype=np.uint8)
+    mask[10:20, 10:30] = 255
+    contours = img_proc.find_contours(mask, level=0, engine=engine)
+    assert len(contours) == 1
+    assert np.array_equal(contours[0][0], contours[0][-1])
+
+
+def test_opencv_contours_are_one_pixel_inside_skimage_contours():
+    mask = np.zeros((40, 50), dtype=np.uint8)
+    mask[10:20, 10:30] = 255
+    mask[13:16, 15:20] = 0  # a hole
+    contours_cv = sorted(img_proc.find_contours(mask, level=0, engine='opencv'), key=len)
+    contours_sk = sorted(img_proc.find_contours(mask, level=0, engine='skimage'), key=len)
+    assert bounding_box(contours_cv[1]) == (10, 19, 10, 29)
+    assert bounding_box(contours_sk[1]) == (9, 20, 9, 30)
+    assert bounding_box(contours_cv[0]) == (12, 16, 14, 20)
+    assert bounding_box(contours_sk[0]) == (13, 15, 15, 19)
@@ -0,0 +1,35 @@
+import numpy as np
+
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame
+from planvec.frame_ring import SharedFrameRing
+from planvec.pipeline_pool import PipelineProcessPool, STATUS_OK
+from planvec.utils.metrics import METRICS
+from planvec.utils.timing import TimeitRecord
+from config import planvec_config
+
+COLLECT_TIMEOUT_S = 60.0
+
+
+def test_worker_counters_and_timings_are_merged():
+    config = planvec_config.processing
+    frame, _ = generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=0))
+    ring = SharedFrameRing(2, frame.shape)
+    metrics_enabled, METRICS.enabled = METRICS.enabled, True
+    n_attempts = METRICS.counters.get('rectification_attempts', (0, ''))[0]
+    n_rectify_calls = TimeitRecord.record['rectify_wrt_red_dots'].count
+    pool = PipelineProcessPool(1, config, planvec_config.color_range.toDict(), (320, 240)).start()
+    try:
+        frame_slot = ring.acquire(timeout=0)
+        np.copyto(frame_slot.array, frame)
+        frame_slot = ring.publish(frame_slot)
+        pool.submit(frame_slot)
+        frame_slot.release()
+        results = pool.collect(timeout=COLLECT_TIMEOUT_S)
+        assert len(results) == 1 and results[0].status == STATUS_OK
+        pool.release(results[0])
+        assert METRICS.counters['rectification_attempts'][0] == n_attempts + 1
+        assert TimeitRecord.record['rectify_wrt_red_dots'].count == n_rectify_calls + 1
+    finally:
+        pool.close()
+        ring.retire()
+        METRICS.enabled = metrics_enabled
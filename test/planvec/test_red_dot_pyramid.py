@@ -0,0 +1,54 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from planvec import img_proc
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame
+from config import planvec_config
+
+RED_COLOR_RANGES = [color_range for key, color_range in planvec_config.color_range.items() if 'red' in key]
+DOTS_IMG_PATH = os.path.join(os.path.dirname(__file__), '..', 'assets', 'dots.jpg')
+SEEDS = range(10)
+TOLERANCE_PX = 1.0
+GROUND_TRUTH_TOLERANCE_PX = 2.0
+MIN_FOUND_RATE = 0.9
+
+
+def max_deviation(centroids, reference) -> float:
+    return float(np.max(np.linalg.norm(np.asarray(centroids, dtype=np.float64) -
+                                       np.asarray(reference, dtype=np.float64), axis=1)))
+
+
+@pytest.fixture(scope='module')
+def synthetic_frames():
+    return [generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=seed)) for seed in SEEDS]
+
+
+@pytest.mark.parametrize('pyramid_level', [1, 2, 3])
+def test_coarse_to_fine_matches_full_resolution(synthetic_frames, pyramid_level):
+    n_found = 0
+    for frame, dot_centers in synthetic_frames:
+        full_res = img_proc.find_red_dot_centroids(frame, RED_COLOR_RANGES)
+        coarse_to_fine = img_proc.find_red_dot_centroids_coarse_to_fine(frame, RED_COLOR_RANGES,
+                                                                         pyramid_level=pyramid_level)
+        assert full_res is not None
+        assert max_deviation(full_res, dot_centers) <= GROUND_TRUTH_TOLERANCE_PX
+        if coarse_to_fine is None:
+            continue
+        n_found += 1
+        assert max_deviation(coarse_to_fine, full_res) <= TOLERANCE_PX
+        assert max_deviation(coarse_to_fine, dot_centers) <= GROUND_TRUTH_TOLERANCE_PX
+    assert n_found / len(synthetic_frames) >= MIN_FOUND_RATE
+
+
+@pytest.mark.parametrize('pyramid_level', [1, 2, 3])
+def test_coarse_to_fine_finds_dots_in_photo(pyramid_level):
+    img = cv2.imread(DOTS_IMG_PATH)
+    full_res = img_proc.find_red_dot_centroids(img, RED_COLOR_RANGES)
+    coarse_to_fine = img_proc.find_red_dot_centroids_coarse_to_fine(img, RED_COLOR_RANGES,
+                                                                     pyramid_level=pyramid_level)
+    assert full_res is not None and len(full_res) == 4
+    # The photo has more red blobs than dots, which of them are the four largest may differ between the levels
+    assert coarse_to_fine is not None and len(coarse_to_fine) == 4
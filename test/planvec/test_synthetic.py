@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from planvec import img_proc
+from planvec.benchmark.synthetic import SyntheticFrameSpec, generate_frame, generate_frames
+from config import planvec_config
+
+RED_COLOR_RANGES = [color_range for key, color_range in planvec_config.color_range.items() if 'red' in key]
+GROUND_TRUTH_TOLERANCE_PX = 2.0
+
+
+def test_generate_frames_is_deterministic():
+    frames = generate_frames(3, 640, 360, seed=7)
+    frames_again = generate_frames(3, 640, 360, seed=7)
+    for frame, frame_again in zip(frames, frames_again):
+        assert frame.shape == (360, 640, 3) and frame.dtype == np.uint8
+        assert np.array_equal(frame, frame_again)
+
+
+def test_generate_frames_differ_between_seeds():
+    frame, other_frame = generate_frames(1, 640, 360, seed=0)[0], generate_frames(1, 640, 360, seed=1)[0]
+    assert not np.array_equal(frame, other_frame)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ground_truth_dots_match_detection(seed):
+    frame, dot_centers = generate_frame(SyntheticFrameSpec(width=1280, height=720, seed=seed))
+    centroids = img_proc.find_red_dot_centroids(frame, RED_COLOR_RANGES)
+    assert centroids is not None and len(centroids) == len(dot_centers) == 4
+    deviations = np.linalg.norm(np.asarray(centroids, dtype=np.float64) - np.asarray(dot_centers), axis=1)
+    assert deviations.max() <= GROUND_TRUTH_TOLERANCE_PX